@@ -15,7 +15,7 @@ import bot_core.pose_t as pose_t
 import bot_param.update_t as update_t
 
 from pybot.vision.camera_utils import construct_K, DepthCamera
-from pybot.vision.image_utils import im_resize
+from pybot.vision.image_utils import im_resize, im_decode
 
 from pybot.externals.log_utils import Decoder, LogReader, LogController
 
@@ -58,10 +58,10 @@ class ImageDecoder(Decoder):
                                                                 msg.width),
                              scale=self.scale)
         elif msg.pixelformat == image_t.PIXEL_FORMAT_MJPEG:
-            im = cv2.imdecode(np.asarray(bytearray(msg.data),
-                                         dtype=np.uint8),
-                              -1)
-            return im_resize(im, scale=self.scale)
+            # Decode directly at reduced resolution if possible
+            return im_decode(np.asarray(bytearray(msg.data),
+                                        dtype=np.uint8),
+                             scale=self.scale)
         else:
             raise RuntimeError('Unknown pixelformat for ImageDecoder')
 
@@ -189,11 +189,18 @@ class LCMLogReader(LogReader):
     def length(self):
         return len(self.index)
 
+    def time_bounds(self):
+        if self.index is not None:
+            return self.index[0], self.index[-1]
+        utimes = [ev.timestamp for ev in self.log]
+        self.log.seek(0)
+        return utimes[0], utimes[-1]
+
     def get_frame_with_timestamp(self, t):
         self.log.c_eventlog.seek_to_timestamp(t)
         while True:
             ev = self.log.next()
-            res, msg = self.decode_msg(ev.channel, ev.data, ev.timestamp)
+            res, msg = self.decode_msg(ev.channel, ev.data, ev.timestamp, shard=False)
             if res: return msg
 
             # if ev.channel == self.decoder.channel:
@@ -208,15 +215,18 @@ class LCMLogReader(LogReader):
         return self.get_frame_with_timestamp(self.index[idx])
 
     def iteritems(self, reverse=False):
-        # Indexed iteration
+        self.reset_shard()
+
+        # Indexed iteration (index filtered by shard before seeking)
         if self.index is not None:
+            index = self.index[self.shard_mask(self.index)]
             if reverse:
-                for t in self.index[::-1]:
+                for t in index[::-1]:
                     if self.start_idx != 0:
                         raise RuntimeWarning('No support for start_idx != 0')
                     yield self.get_frame_with_timestamp(t)
             else:
-                for t in self.index:
+                for t in index:
                     yield self.get_frame_with_timestamp(t)
 
         # Unindexed iteration (usually much faster)
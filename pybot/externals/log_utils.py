@@ -57,10 +57,14 @@ class LogDecoder(object):
         else:
             self.decoder_ = { decoder.channel: decoder }
 
-    def decode_msg(self, channel, data, t):
+    def decode_msg(self, channel, data, t, shard=True):
+        """
+        Decode message (if it should be), with shard=False messages
+        are decoded regardless of the shard (e.g. indexed seeks)
+        """
         try:
             dec = self.decoder_[channel]
-            if dec.should_decode():
+            if dec.should_decode() and (not shard or self.in_shard(t)):
                 return True, (t, channel, dec.decode(data))
         except KeyError:
             pass
@@ -71,6 +75,9 @@ class LogDecoder(object):
 
         return False, (None, None, None)
 
+    def in_shard(self, t):
+        return True
+
     @property
     def decoder(self):
         return self.decoder_
@@ -194,6 +201,8 @@ class LogReader(LogDecoder):
         self.idx_ = 0
         self.start_idx_ = start_idx
         self.max_length_ = max_length
+        self.shard_ = None
+        self.shard_idx_ = 0
 
         # Load the log
         self._init_log()
@@ -240,6 +249,69 @@ class LogReader(LogDecoder):
     def _index(self):
         raise NotImplementedError()
 
+    def time_bounds(self):
+        """ First and last timestamp of the log (in decoded units) """
+        raise NotImplementedError()
+
+    def shard(self, index, count, strategy='contiguous'):
+        """
+        Restrict decoding to shard `index` of `count`, deterministic
+        and disjoint across shards. Messages outside the shard are
+        skipped before decoding, indexed logs filter their index
+        (see shard_mask). Returns self.
+
+           contiguous:  Equal time windows over the log (time_bounds)
+           strided:     Every count-th decoded message (counted from
+                        the start of each iteration, see reset_shard)
+
+        A log is a single sequence, shard lists of logs with
+        dataset_readers.shard_indices(..., strategy='by_sequence')
+        """
+        if count < 1 or not 0 <= index < count:
+            raise ValueError('Invalid shard {} of {}'.format(index, count))
+        if strategy == 'contiguous':
+            st, end = self.time_bounds()
+            self.shard_bounds_ = np.linspace(float(st), float(end), count + 1)
+        elif strategy != 'strided':
+            raise ValueError('Unknown log shard strategy {}, use contiguous/strided'
+                             .format(strategy))
+        self.shard_ = (index, count, strategy)
+        self.shard_idx_ = 0
+        return self
+
+    @property
+    def shard_info(self):
+        return self.shard_
+
+    def reset_shard(self):
+        """ Restart the strided message count (at each iteration) """
+        self.shard_idx_ = 0
+
+    def shard_mask(self, ts):
+        """ Messages (timestamps ts, in order) within the shard """
+        ts = np.asarray(ts)
+        if self.shard_ is None:
+            return np.ones(len(ts), dtype=bool)
+
+        index, count, strategy = self.shard_
+        if strategy == 'strided':
+            return np.arange(len(ts)) % count == index
+        s = np.searchsorted(self.shard_bounds_, np.float64(ts), side='right') - 1
+        return np.clip(s, 0, count - 1) == index
+
+    def in_shard(self, t):
+        if self.shard_ is None:
+            return True
+
+        index, count, strategy = self.shard_
+        if strategy == 'strided':
+            self.shard_idx_ += 1
+            return (self.shard_idx_ - 1) % count == index
+
+        t = t.to_sec() if hasattr(t, 'to_sec') else float(t)
+        s = np.searchsorted(self.shard_bounds_, t, side='right') - 1
+        return min(max(s, 0), count - 1) == index
+
     def length(self, channel):
         raise NotImplementedError()
 
@@ -23,7 +23,7 @@ from tf2_msgs.msg import TFMessage
 from pybot.geometry.rigid_transform import RigidTransform
 from pybot.utils.misc import Accumulator
 from pybot.utils.dataset.sun3d_utils import SUN3DAnnotationDB
-from pybot.vision.image_utils import im_resize
+from pybot.vision.image_utils import im_resize, im_decode
 from pybot.vision.imshow_utils import imshow_cv
 from pybot.vision.camera_utils import CameraIntrinsic
 from pybot.externals.log_utils import Decoder, LogReader, LogController, LogDB
@@ -66,7 +66,7 @@ class CameraInfoDecoder(Decoder):
                                shape=[msg.height, msg.width])
 
 
-def compressed_imgmsg_to_cv2(cmprs_img_msg, desired_encoding = "passthrough"):
+def compressed_imgmsg_to_cv2(cmprs_img_msg, desired_encoding = "passthrough", scale=1.0):
     """
     Convert a sensor_msgs::CompressedImage message to an OpenCV :cpp:type:`cv::Mat`.
 
@@ -85,11 +85,14 @@ def compressed_imgmsg_to_cv2(cmprs_img_msg, desired_encoding = "passthrough"):
     This function returns an OpenCV :cpp:type:`cv::Mat` message on success, or raises :exc:`cv_bridge.CvBridgeError` on failure.
 
     If the image only has one channel, the shape has size 2 (width and height)
+
+    The image is decoded at scale (directly at reduced resolution
+    for 1/2, 1/4, 1/8, see image_utils.im_decode)
     """
     str_msg = cmprs_img_msg.data
     buf = np.ndarray(shape=(1, len(str_msg)),
                       dtype=np.uint8, buffer=cmprs_img_msg.data)
-    im = cv2.imdecode(buf, cv2.IMREAD_ANYCOLOR)
+    im = im_decode(buf, scale=scale, flags=cv2.IMREAD_ANYCOLOR)
 
     if desired_encoding == "passthrough":
         return im
@@ -117,7 +120,7 @@ class ImageDecoder(Decoder):
     def decode(self, msg):
         try:
             if self.compressed:
-                im = compressed_imgmsg_to_cv2(msg, self.encoding)
+                return compressed_imgmsg_to_cv2(msg, self.encoding, scale=self.scale)
             else:
                 im = self.bridge.imgmsg_to_cv2(msg, self.encoding)
         except CvBridgeError as e:
@@ -346,6 +349,10 @@ class ROSBagReader(LogReader):
         info = self.log.get_type_and_topic_info()
         return info.topics[topic].message_count
 
+    def time_bounds(self):
+        st, end = self.log.get_start_time(), self.log.get_end_time()
+        return st + (end-st) * self.start_idx / 100.0, end
+
     def load_log(self, filename):
         st = time.time()
         print('{} :: Loading ROSBag {} ...'.format(self.__class__.__name__, filename))
@@ -476,6 +483,7 @@ class ROSBagReader(LogReader):
         raise NotImplementedError()
 
     def itercursors(self, topics=[], reverse=False):
+        self.reset_shard()
         if self.index is not None:
             raise NotImplementedError('Cannot provide items indexed')
 
@@ -96,6 +96,39 @@ def tf_compose(R, t):
     return T
 
 
+# Vectorized pose arrays [N x 4 x 4]
+
+def tf_quaternion_matrices(xyzw): 
+    """ Rotation matrices [N x 3 x 3] from quaternions [N x 4] (xyzw) """
+    q = np.asarray(xyzw, dtype=np.float64).reshape(-1,4)
+    q = q * np.sqrt(2.0 / np.maximum(np.sum(q * q, axis=1), 1e-12))[:,np.newaxis]
+    x, y, z, w = q[:,0], q[:,1], q[:,2], q[:,3]
+    R = np.empty((len(q), 3, 3))
+    R[:,0,0], R[:,0,1], R[:,0,2] = 1.0-y*y-z*z, x*y-z*w, x*z+y*w
+    R[:,1,0], R[:,1,1], R[:,1,2] = x*y+z*w, 1.0-x*x-z*z, y*z-x*w
+    R[:,2,0], R[:,2,1], R[:,2,2] = x*z-y*w, y*z+x*w, 1.0-x*x-y*y
+    return R
+
+def tf_compose_batch(R, t): 
+    """ Construct [R t; 0 1] matrices [N x 4 x 4] from R [N x 3 x 3] and t [N x 3] """
+    T = np.tile(np.eye(4), (len(R), 1, 1))
+    T[:,:3,:3] = R
+    T[:,:3,3] = t
+    return T
+
+def tf_inverse_batch(T): 
+    """ Inverse of rigid transformations [N x 4 x 4] """
+    Tinv = np.tile(np.eye(4), (len(T), 1, 1))
+    Tinv[:,:3,:3] = np.transpose(T[:,:3,:3], (0,2,1))
+    Tinv[:,:3,3] = -np.einsum('nij,nj->ni', Tinv[:,:3,:3], T[:,:3,3])
+    return Tinv
+
+def tf_relative_to_first(T): 
+    """ Poses [N x 4 x 4] relative to the first: T_0^-1 * T_i """
+    if not len(T): 
+        return T
+    return np.einsum('ij,njk->nik', tf_inverse_batch(T[:1])[0], T)
+
 def rpyxyz(roll, pitch, yaw, x, y, z, axes='rxyz'):
     return RigidTransform.from_rpyxyz(roll, pitch, yaw, x, y, z, axes=axes)
 
@@ -2,16 +2,21 @@
 # License: MIT
 
 import os
+import copy
 
+import cv2
 import numpy as np
 
 from pybot.geometry.rigid_transform import RigidTransform, Quaternion, rpyxyz
 from pybot.utils.db_utils import AttrDict
 from pybot.utils.dataset_readers import natural_sort, \
-    FileReader, NoneReader, DatasetReader, ImageDatasetReader, \
-    StereoDatasetReader, VelodyneDatasetReader
+    FileReader, PoseArrayReader, NoneReader, DatasetReader, ImageDatasetReader, \
+    StereoDatasetReader, VelodyneDatasetReader, \
+    PackedSequenceWriter, PackedSequenceReader, \
+    shard_indices, save_shard_manifest
 from pybot.utils.itertools_recipes import izip
 from pybot.vision.camera_utils import StereoCamera
+from pybot.vision.image_utils import im_resize, im_read, im_decode
 
 # Earth radius (approx.) in meters
 EARTH_RADIUS = 6378137.
@@ -33,21 +38,57 @@ def kitti_stereo_calib(sequence, scale=1.0):
     else:
         return None
 
-def kitti_load_poses(fn):
-    X = (np.fromfile(fn, dtype=np.float64, sep=' ')).reshape(-1,12)
-    return [RigidTransform.from_Rt(p[:3,:3], p[:3,3])
-            for p in [x.reshape(3,4) for x in X]]
+def kitti_load_pose_array(fn):
+    """ KITTI poses file as a pose array [N x 4 x 4] """
+    X = (np.fromfile(fn, dtype=np.float64, sep=' ')).reshape(-1,3,4)
+    T = np.tile(np.eye(4), (len(X), 1, 1))
+    T[:,:3,:4] = X
+    return T
 
-def kitti_poses_to_str(poses):
-    return "\r\n".join(map(
-        lambda x: " ".join(
-            list(map(str, (x.matrix[:3,:4]).flatten()))), poses))
+def kitti_load_poses(fn):
+    return [RigidTransform.from_matrix(T) for T in kitti_load_pose_array(fn)]
 
 def kitti_poses_to_mat(poses):
+    """ Poses (list of RigidTransform, or [N x 4 x 4] array) as [N x 12] """
+    if isinstance(poses, np.ndarray):
+        return poses[:,:3,:4].reshape(-1,12).astype(np.float64)
     return np.vstack([x.matrix[:3,:4].flatten()
                       for x in poses]) \
              .astype(np.float64)
 
+def kitti_poses_to_str(poses):
+    X = kitti_poses_to_mat(poses)
+    fmt = ' '.join(['%.12g'] * 12)
+    return '\r\n'.join([fmt] * len(X)) % tuple(X.ravel())
+
+def kitti_write_poses(fn, poses):
+    """ Write poses (list of RigidTransform, or [N x 4 x 4] array) """
+    np.savetxt(os.path.expanduser(fn), kitti_poses_to_mat(poses),
+               fmt='%.12g', delimiter=' ')
+
+def oxts_poses(packets, scale):
+    """
+    OXTS packets (structured array with lat, lon, alt, roll,
+    pitch, yaw fields) to [N x 4 x 4] poses: Mercator translation
+    for the given scale (cos of the reference latitude), and
+    rotation R = Rz * Ry * Rx from the Euler angles
+    """
+    lat, lon, alt = packets['lat'], packets['lon'], packets['alt']
+    rx, ry, rz = packets['roll'], packets['pitch'], packets['yaw']
+
+    T = np.tile(np.eye(4), (len(packets), 1, 1))
+    T[:,0,3] = scale * lon * np.pi * EARTH_RADIUS / 180.
+    T[:,1,3] = scale * EARTH_RADIUS * \
+               np.log(np.tan((90. + lat) * np.pi / 360.))
+    T[:,2,3] = alt
+
+    cx, sx, cy, sy, cz, sz = np.cos(rx), np.sin(rx), \
+                             np.cos(ry), np.sin(ry), np.cos(rz), np.sin(rz)
+    T[:,0,0], T[:,0,1], T[:,0,2] = cz*cy, cz*sy*sx - sz*cx, cz*sy*cx + sz*sx
+    T[:,1,0], T[:,1,1], T[:,1,2] = sz*cy, sz*sy*sx + cz*cx, sz*sy*cx - cz*sx
+    T[:,2,0], T[:,2,1], T[:,2,2] = -sy, cy*sx, cy*cx
+    return T
+
 class OXTSReader(DatasetReader):
     def __init__(self, dataformat, template='oxts/data/%010i.txt',
                  start_idx=0, max_files=100000):
@@ -65,42 +106,71 @@ class OXTSReader(DatasetReader):
     def oxts_formats(self):
         return self.oxts_formats_
 
+    def parse(self, texts):
+        """
+        Parse OXTS file contents into an [N x 30] array, and a
+        structured packet array (one field per oxts format)
+        """
+        nfields = len(self.oxts_formats)
+        X = np.fromstring(' '.join(texts), dtype=np.float64, sep=' ')
+        if X.size != len(texts) * nfields:
+            raise ValueError('OXTS files have inconsistent number of fields, '
+                             'expected {}'.format(nfields))
+        X = X.reshape(-1, nfields)
+        return X, X.view(dtype=[(str(fmt), np.float64)
+                                for fmt in self.oxts_formats]).ravel()
+
+    @property
+    def origin(self):
+        """
+        Mercator scale and inverse pose [4 x 4] of the first frame
+        of the sequence, shared by per-frame reads and load()
+        """
+        if self.p_init_ is None:
+            with open(self.files[0], 'r') as f:
+                _, packets = self.parse([f.read()])
+            self.scale_ = np.cos(packets['lat'][0] * np.pi / 180.)
+            T = oxts_poses(packets, self.scale_)[0]
+            self.p_init_ = np.eye(4)
+            self.p_init_[:3,:3] = T[:3,:3].T
+            self.p_init_[:3,3] = -T[:3,:3].T.dot(T[:3,3])
+        return self.scale_, self.p_init_
+
+    def poses(self, packets):
+        """ Poses [N x 4 x 4] relative to the first frame """
+        scale, p_init = self.origin
+        return np.einsum('ij,njk->nik', p_init, oxts_poses(packets, scale))
+
     def oxts_process_cb(self, fn):
-        X = np.fromfile(fn, dtype=np.float64, sep=' ')
+        with open(fn, 'r') as f:
+            X, packets = self.parse([f.read()])
         packet = AttrDict({fmt: x
-                           for (fmt, x) in zip(self.oxts_formats, X)})
-
-        # compute scale from first lat value
-        if self.scale_ is None:
-            self.scale_ = np.cos(packet.lat * np.pi / 180.)
-
-        # Use a Mercator projection to get the translation vector
-        tx = self.scale_ * packet.lon * np.pi * EARTH_RADIUS / 180.
-        ty = self.scale_ * EARTH_RADIUS * \
-             np.log(np.tan((90. + packet.lat) * np.pi / 360.))
-        tz = packet.alt
-        t = np.array([tx, ty, tz])
-
-        # We want the initial position to be the origin, but keep the ENU
-        # coordinate system
-        rx, ry, rz = packet.roll, packet.pitch, packet.yaw
-        Rx = np.float32([1,0,0, 0,
-                         np.cos(rx), -np.sin(rx), 0,
-                         np.sin(rx), np.cos(rx)]).reshape(3,3)
-        Ry = np.float32([np.cos(ry),0,np.sin(ry),
-                         0, 1, 0,
-                         -np.sin(ry), 0, np.cos(ry)]).reshape(3,3)
-        Rz = np.float32([np.cos(rz), -np.sin(rz), 0,
-                         np.sin(rz), np.cos(rz), 0,
-                         0, 0, 1]).reshape(3,3)
-        R = np.dot(Rz, Ry.dot(Rx))
-        pose = RigidTransform.from_Rt(R, t)
+                           for (fmt, x) in zip(self.oxts_formats, X[0])})
+        return AttrDict(packet=packet,
+                        pose=RigidTransform.from_matrix(self.poses(packets)[0]))
 
-        if self.p_init_ is None:
-            self.p_init_ = pose.inverse()
+    def load(self, num_workers=8):
+        """
+        Bulk-load all OXTS files (read in a thread pool, and parsed
+        in one pass) into an [N x 30] array, and compute poses
+        (relative to the first frame) vectorized. Returns the
+        [N x 4 x 4] pose array, and a structured packet array
+        (one field per oxts format).
+        """
+        from multiprocessing.pool import ThreadPool
+        def read(fn):
+            with open(fn, 'r') as f:
+                return f.read()
+
+        pool = ThreadPool(num_workers)
+        try:
+            texts = pool.map(read, self.files)
+        finally:
+            pool.close()
+            pool.join()
 
-        # Use the Euler angles to get the rotation matrix
-        return AttrDict(packet=packet, pose=self.p_init_ * pose)
+        _, packets = self.parse(texts)
+        return self.poses(packets), packets
 
 class KITTIDatasetReader(object):
     """
@@ -163,7 +233,7 @@ class KITTIDatasetReader(object):
             pose_fn = os.path.join(
                 os.path.expanduser(directory),
                 'poses', ''.join([sequence, '.txt']))
-            self.poses_ = FileReader(pose_fn, process_cb=kitti_load_poses)
+            self.poses_ = PoseArrayReader(pose_fn, load_cb=kitti_load_pose_array)
         except Exception as e:
             print('Failed to read pose data: {}'.format(e))
             self.poses_ = NoneReader()
@@ -186,6 +256,45 @@ class KITTIDatasetReader(object):
     def poses(self):
         return self.poses_.items
 
+    @property
+    def pose_array(self):
+        """ Ground truth poses as an [N x 4 x 4] array """
+        if not isinstance(self.poses_, PoseArrayReader):
+            return None
+        return self.poses_.array
+
+    @property
+    def indices(self):
+        return self.stereo.indices
+
+    def subset(self, inds):
+        """ Reader over frames inds (stereo, velodyne and poses) """
+        c = copy.copy(self)
+        c.stereo = self.stereo.subset(inds)
+        c.velodyne = self.velodyne.subset(inds)
+        c.poses_ = self.poses_.subset(inds)
+        return c
+
+    def shard(self, index, count, strategy='contiguous', manifest=None):
+        """
+        Frames of shard `index` of `count` within this sequence
+        (contiguous/strided), see iterscenes for sharding sequences
+        """
+        if strategy == 'by_sequence':
+            raise ValueError('Shard a single sequence with contiguous/strided, '
+                             'or sequences with iterscenes(strategy=by_sequence)')
+        inds = shard_indices(len(self.stereo), index, count, strategy=strategy)
+        c = self.subset(inds)
+        if manifest is not None:
+            save_shard_manifest(manifest, index, count, strategy, inds,
+                                files=c.stereo.left.files, sequence=self.sequence)
+        return c
+
+    def close(self):
+        self.stereo.close()
+        if hasattr(self.velodyne, 'close'):
+            self.velodyne.close()
+
     def iteritems(self, *args, **kwargs):
         return self.stereo.left.iteritems(*args, **kwargs)
 
@@ -231,15 +340,159 @@ class KITTIDatasetReader(object):
                    right_template='image_1/%06i.png',
                    velodyne_template='velodyne/%06i.bin',
                    start_idx=0, max_files=100000,
-                   scale=1.0, verbose=False):
+                   scale=1.0, verbose=False,
+                   shard_index=0, num_shards=1, strategy='by_sequence'):
+        """
+        Iterate over sequences, optionally restricted to shard
+        shard_index of num_shards: by_sequence assigns whole
+        sequences to shards, contiguous/strided shard the frames
+        within each sequence (see shard_indices)
+        """
+        if strategy == 'by_sequence':
+            sequences = [sequences[idx] for idx in shard_indices(
+                len(sequences), shard_index, num_shards, strategy=strategy)]
 
         for seq in progressbar(sequences,
                                size=len(sequences), verbose=verbose):
-            yield seq, cls(directory=directory, sequence=seq,
-                           left_template=left_template,
-                           right_template=right_template,
-                           velodyne_template=velodyne_template,
-                           start_idx=start_idx, max_files=max_files)
+            dataset = cls(directory=directory, sequence=seq,
+                          left_template=left_template,
+                          right_template=right_template,
+                          velodyne_template=velodyne_template,
+                          start_idx=start_idx, max_files=max_files)
+            if strategy != 'by_sequence':
+                dataset = dataset.shard(shard_index, num_shards, strategy=strategy)
+            yield seq, dataset
+
+def kitti_pack_sequence(dataset, filename, encoded=True,
+                        chunk_bytes=16 * 1024 * 1024):
+    """
+    Pack a KITTIDatasetReader sequence (stereo, velodyne, poses) into
+    a single-file archive (see KITTIPackedDatasetReader), in chunks of
+    about chunk_bytes. With encoded=True, the png files are copied
+    as-is, otherwise images are stored raw (decoded and scaled with
+    the dataset's scale). Frames without a velodyne scan (matched by
+    file name) are stored with an empty [0 x 4] scan.
+    """
+    def read_bytes(fn):
+        with open(fn, 'rb') as f:
+            return f.read()
+
+    left, right = dataset.stereo.left, dataset.stereo.right
+    velodyne = None
+    if hasattr(dataset.velodyne, 'files'):
+        stem = lambda fn: os.path.splitext(os.path.basename(fn))[0]
+        velodyne = dict((stem(fn), fn) for fn in dataset.velodyne.files)
+        missing = [fn for fn in left.files if stem(fn) not in velodyne]
+        if len(missing):
+            print('kitti_pack_sequence: {} of {} frames have no velodyne scan'
+                  .format(len(missing), len(left)))
+
+    writer = PackedSequenceWriter(filename, chunk_bytes=chunk_bytes, meta=dict(
+        sequence=dataset.sequence, encoded=encoded,
+        scale=1.0 if encoded else dataset.scale))
+    for idx in range(len(left)):
+        if encoded:
+            items = dict(left=read_bytes(left.files[idx]),
+                         right=read_bytes(right.files[idx]))
+        else:
+            items = dict(left=left[idx], right=right[idx])
+        if velodyne is not None:
+            fn = velodyne.get(stem(left.files[idx]), None)
+            items['velodyne'] = np.fromfile(fn, dtype=np.float32).reshape(-1,4) \
+                                if fn is not None else np.zeros((0,4), dtype=np.float32)
+        writer.append(**items)
+
+    if dataset.pose_array is not None:
+        writer.add_array('poses', kitti_poses_to_mat(dataset.pose_array))
+    writer.close()
+    print('Packed {} frames into {}'.format(len(left), filename))
+
+class KITTIPackedDatasetReader(object):
+    """
+    KITTIPackedDatasetReader: KITTIDatasetReader over a single-file
+    sequence archive (see kitti_pack_sequence), memory-mapped and
+    read chunk by chunk. Velodyne scans (and raw images) are returned
+    as read-only views into the chunk read.
+    """
+    def __init__(self, filename, scale=1.0, grayscale=False):
+        self.scale = scale
+        flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_UNCHANGED
+        self.archive_ = PackedSequenceReader(
+            filename, decode_cb=lambda field, buf: im_decode(
+                buf, scale=self.image_scale_, flags=flags), chunked=True)
+
+        # Images are archived at meta['scale'], encoded images
+        # are decoded directly at (reduced) scale
+        self.sequence = self.archive_.meta.get('sequence', '')
+        self.image_scale_ = scale / self.archive_.meta.get('scale', 1.0)
+        try:
+            self.calib = kitti_stereo_calib(self.sequence, scale=scale)
+        except Exception as e:
+            self.calib = None
+
+        self.poses_ = [RigidTransform.from_Rt(p[:3,:3], p[:3,3])
+                       for p in self.archive_.array('poses').reshape(-1,3,4)] \
+                       if self.archive_.has_array('poses') else None
+
+    def __len__(self):
+        return len(self.archive_)
+
+    @property
+    def poses(self):
+        return self.poses_
+
+    def _fnos(self, every_k_frames=1, reverse=False):
+        fnos = np.arange(0, len(self.archive_), every_k_frames).astype(int)
+        return fnos[::-1] if reverse else fnos
+
+    def _image(self, field, index):
+        im = self.archive_.read(field, index)
+        return im if self.archive_.is_encoded(field) \
+            else im_resize(im, scale=self.image_scale_)
+
+    def iteritems(self, every_k_frames=1, reverse=False):
+        for fno in self._fnos(every_k_frames, reverse):
+            yield self._image('left', fno)
+
+    def iter_stereo_frames(self, every_k_frames=1, reverse=False):
+        for fno in self._fnos(every_k_frames, reverse):
+            yield self._image('left', fno), self._image('right', fno)
+
+    def iter_velodyne_frames(self, every_k_frames=1, reverse=False):
+        for fno in self._fnos(every_k_frames, reverse):
+            yield self.archive_.read('velodyne', fno)
+
+    def iterframes(self, every_k_frames=1, reverse=False):
+        has_velodyne = 'velodyne' in self.archive_.fields
+        for fno in self._fnos(every_k_frames, reverse):
+            yield AttrDict(left=self._image('left', fno),
+                           right=self._image('right', fno),
+                           velodyne=self.archive_.read('velodyne', fno)
+                           if has_velodyne else None,
+                           pose=self.poses_[fno] if self.poses_ is not None else None)
+
+    def iter_gt_frames(self, every_k_frames=1, reverse=False):
+        for fno in self._fnos(every_k_frames, reverse):
+            yield AttrDict(left=self._image('left', fno),
+                           right=self._image('right', fno), velodyne=None,
+                           pose=self.poses_[fno] if self.poses_ is not None else None)
+
+    @property
+    def stereo_frames(self):
+        return self.iter_stereo_frames()
+
+    @property
+    def velodyne_frames(self):
+        return self.iter_velodyne_frames()
+
+def kitti_disparity_process_cb(scale=1.0):
+    """
+    Read 16-bit disparity maps at scale (values unscaled). Invalid
+    (zero) disparities must not be blended into their neighbours,
+    so these are subsampled (nearest) rather than decoded reduced.
+    """
+    return lambda fn: im_read(fn, scale=scale, flags=cv2.IMREAD_ANYDEPTH,
+                              interpolation=cv2.INTER_NEAREST, reduced=False)
 
 class KITTIStereoGroundTruthDatasetReader(object):
     def __init__(self, directory, is_2015=False, scale=1.0):
@@ -263,12 +516,14 @@ class KITTIStereoGroundTruthDatasetReader(object):
             left_template=''.join([left_dir, '/%06i_10.png']),
             right_template=''.join([right_dir, '/%06i_10.png']),
             scale=scale, grayscale=True)
-        self.noc = ImageDatasetReader(
+        self.noc = DatasetReader(
             template=os.path.join(os.path.expanduser(directory),
-                                  noc_dir, '%06i_10.png'))
-        self.occ = ImageDatasetReader(
+                                  noc_dir, '%06i_10.png'),
+            process_cb=kitti_disparity_process_cb(scale=scale))
+        self.occ = DatasetReader(
             template=os.path.join(os.path.expanduser(directory),
-                                  occ_dir, '%06i_10.png'))
+                                  occ_dir, '%06i_10.png'),
+            process_cb=kitti_disparity_process_cb(scale=scale))
 
         def calib_read(fn, scale):
             db = AttrDict.load_yaml(fn)
@@ -291,6 +546,7 @@ class KITTIStereoGroundTruthDatasetReader(object):
         Iterate over all the ground-truth data
            - For noc, occ disparity conversion, see
              devkit_stereo_flow/matlab/disp_read.m
+           - Disparities are scaled with the image resolution
         """
         for (left, right), noc, occ, calib in izip(
                 self.iter_stereo_frames(*args, **kwargs),
@@ -298,9 +554,9 @@ class KITTIStereoGroundTruthDatasetReader(object):
                 self.occ.iteritems(*args, **kwargs),
                 self.calib.iteritems(*args, **kwargs)):
             yield AttrDict(left=left, right=right,
-                           depth=(occ/256).astype(np.float32),
-                           noc=(noc/256).astype(np.float32),
-                           occ=(occ/256).astype(np.float32),
+                           depth=(occ * (self.scale / 256.)).astype(np.float32),
+                           noc=(noc * (self.scale / 256.)).astype(np.float32),
+                           occ=(occ * (self.scale / 256.)).astype(np.float32),
                            calib=calib, pose=None)
 
     def iteritems(self, *args, **kwargs):
@@ -400,13 +656,18 @@ class KITTIRawDatasetReader(object):
     def oxts_fieldnames(self):
         return self.oxts_.oxts_formats
 
+    def load_oxts(self, num_workers=8):
+        """ Bulk-load OXTS poses [N x 4 x 4] and packets (see OXTSReader.load) """
+        return self.oxts_.load(num_workers=num_workers)
+
     @property
     def oxts_data(self):
         return list(map(lambda oxts: oxts.packet, self.oxts_.iteritems()))
 
     @property
     def poses(self):
-        return list(map(lambda oxts: oxts.pose, self.oxts_.iteritems()))
+        poses, _ = self.oxts_.load()
+        return [RigidTransform.from_matrix(T) for T in poses]
 
 class OmnicamDatasetReader(object):
     """
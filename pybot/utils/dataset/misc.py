@@ -6,10 +6,11 @@ import numpy as np
 import cv2
 
 from itertools import izip
-from pybot.geometry.rigid_transform import RigidTransform
+from pybot.geometry.rigid_transform import RigidTransform, \
+    tf_quaternion_matrices, tf_compose_batch, tf_relative_to_first
 from pybot.utils.db_utils import AttrDict
 from pybot.utils.dataset_readers import natural_sort, \
-    read_dir, NoneReader, FileReader, DatasetReader, ImageDatasetReader, StereoDatasetReader, VelodyneDatasetReader
+    read_dir, NoneReader, FileReader, PoseArrayReader, DatasetReader, ImageDatasetReader, StereoDatasetReader, VelodyneDatasetReader
 from pybot.vision.camera_utils import Camera, CameraIntrinsic
 
 class VaFRICDatasetReader(object): 
@@ -125,21 +126,26 @@ class RPGUrban(object):
             self.rgb_ = NoneReader()
         
         # Read poses
-        def load_poses(fn):
-            """
-            poses: image_id tx ty tz qx qy qz qw
-            """
-            X = (np.fromfile(fn, dtype=np.float64, sep=' ')).reshape(-1,8)
-            abs_poses = map(lambda p: RigidTransform(xyzw=p[4:], tvec=p[1:4]), X)
-            rel_poses = [abs_poses[0].inverse() * p for p in abs_poses]
-            return rel_poses
-
         try:
             pose_fn = os.path.join(os.path.expanduser(directory), 'info', 'groundtruth.txt')
-            self.poses_ = FileReader(pose_fn, process_cb=load_poses)
+            self.poses_ = PoseArrayReader(pose_fn, load_cb=RPGUrban.load_pose_array)
         except Exception as e:
             self.poses_ = NoneReader()
 
+    @staticmethod
+    def load_pose_array(fn):
+        """
+        poses: image_id tx ty tz qx qy qz qw
+        Returns poses relative to the first [N x 4 x 4]
+        """
+        X = (np.fromfile(fn, dtype=np.float64, sep=' ')).reshape(-1,8)
+        T = tf_compose_batch(tf_quaternion_matrices(X[:,4:]), X[:,1:4])
+        return tf_relative_to_first(T)
+
+    @property
+    def pose_array(self):
+        return self.poses_.array if isinstance(self.poses_, PoseArrayReader) else None
+
     @property
     def calib(self):
         return self.calib_
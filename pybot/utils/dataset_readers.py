@@ -9,18 +9,41 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from collections import defaultdict, namedtuple, OrderedDict
+from collections import defaultdict, namedtuple, OrderedDict, deque
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+from multiprocessing.sharedctypes import RawArray
 
+import copy
 import fnmatch
+import hashlib
+import json
 import logging
 import os
 import re
+import threading
 
 import cv2
 import numpy as np
 
+from pybot.geometry.rigid_transform import RigidTransform
 from pybot.utils.itertools_recipes import izip, chain, islice, repeat
-from pybot.vision.image_utils import im_resize
+from pybot.vision.image_utils import im_read
+
+class _DirEntry(object):
+    """ Minimal os.DirEntry (name, path, is_dir) """
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+def _listdir_scandir(directory):
+    return (_DirEntry(directory, name) for name in os.listdir(directory))
+
+# os.scandir (py3.5+), or os.listdir + os.stat
+scandir = getattr(os, 'scandir', _listdir_scandir)
 
 def valid_path(path):
     """ docstring """
@@ -29,11 +52,13 @@ def valid_path(path):
         raise RuntimeError('Path invalid {:}'.format(vpath))
     return vpath
 
+_natural_split = re.compile('([0-9]+)').split
+
 def natural_sort(l):
     """ docstring """
     def convert(text): return int(text) if text.isdigit() else text.lower()
     def alphanum_key(key): return [convert(c)
-                                   for c in re.split('([0-9]+)', key)]
+                                   for c in _natural_split(key)]
     return sorted(l, key=alphanum_key)
 
 def recursive_set_dict(d, splits, value):
@@ -108,6 +133,216 @@ def read_dir(directory, pattern='*.png', recursive=True,
     return fn_map
 
 
+MANIFEST_PREFIX = '.pybot_manifest_'
+
+
+def _dir_stamp(d):
+    """
+    Directory (mtime in ns, size), adding or removing entries
+    updates either one
+    """
+    st = os.stat(d)
+    return [getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9)), st.st_size]
+
+
+def _scan_tree(directory, pattern, recursive=True):
+    """
+    Match files within a directory tree (os.scandir-based), returns
+    the matched files, and the stamps of all visited directories
+    """
+    files, stamps = [], {}
+    stack = [directory]
+    while len(stack):
+        d = stack.pop()
+        try:
+            stamps[d] = _dir_stamp(d)
+            entries = list(scandir(d))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir():
+                if recursive:
+                    stack.append(entry.path)
+            elif fnmatch.fnmatch(entry.name, pattern) and \
+                 not entry.name.startswith(MANIFEST_PREFIX):
+                files.append(entry.path)
+    return files, stamps
+
+
+def scan_dir(directory, pattern='*.png', recursive=True, include_root=True,
+             num_workers=8):
+    """
+    Match files within a directory (scandir-based), scanning the
+    top-level subdirectories in parallel. Returns the (unsorted)
+    matched files, and the stamps (mtime in ns, size) of all
+    visited directories.
+    """
+    directory = os.path.expanduser(directory)
+    files, stamps = [], {directory: _dir_stamp(directory)}
+    subdirs = []
+    for entry in scandir(directory):
+        if entry.is_dir():
+            subdirs.append(entry.path)
+        elif include_root and fnmatch.fnmatch(entry.name, pattern) and \
+             not entry.name.startswith(MANIFEST_PREFIX):
+            files.append(entry.path)
+
+    if not recursive or not len(subdirs):
+        return files, stamps
+
+    pool = ThreadPool(max(1, min(num_workers, len(subdirs))))
+    try:
+        results = pool.map(lambda d: _scan_tree(d, pattern), subdirs)
+    finally:
+        pool.close()
+        pool.join()
+    for sub_files, sub_stamps in results:
+        files.extend(sub_files)
+        stamps.update(sub_stamps)
+    return files, stamps
+
+
+MANIFEST_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pybot', 'manifests')
+
+
+def _manifest_filenames(directory, key, cache_dir=None):
+    """ Manifest beside the dataset, and in the (user) cache directory """
+    name = '{}{}.json'.format(MANIFEST_PREFIX, key)
+    cache_dir = MANIFEST_CACHE_DIR if cache_dir is None else os.path.expanduser(cache_dir)
+    dhash = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+    return [os.path.join(directory, name),
+            os.path.join(cache_dir, '{}_{}'.format(dhash[:16], name[1:]))]
+
+
+def read_manifest(directory, pattern='*.png', recursive=True,
+                  include_root=True, num_workers=8, refresh=False,
+                  cache_dir=None, beside=False):
+    """
+    Naturally sorted files matching pattern within a directory, read
+    from a cached manifest (sorted relative file list, directory
+    stamps, and count). The manifest is validated by stat-ing the
+    directories it covers (adding/removing files updates the
+    directory mtime_ns or size), and rebuilt with scan_dir otherwise.
+
+    Manifests are written to cache_dir (~/.cache/pybot/manifests by
+    default), or beside the dataset (as a hidden file) with
+    beside=True. Existing manifests beside the dataset are used.
+    """
+    directory = os.path.normpath(os.path.expanduser(directory))
+    key = hashlib.sha1(repr((pattern, recursive, include_root))
+                       .encode('utf-8')).hexdigest()[:12]
+    fns = _manifest_filenames(directory, key, cache_dir=cache_dir)
+
+    if not refresh:
+        for fn in fns:
+            try:
+                with open(fn, 'r') as f:
+                    m = json.load(f)
+                if all(_dir_stamp(os.path.join(directory, d)) == stamp
+                       for d, stamp in m['stamps'].items()) \
+                   and len(m['files']) == m['count']:
+                    return [os.path.join(directory, f) for f in m['files']]
+            except (IOError, OSError, ValueError, KeyError):
+                continue
+
+    files, stamps = scan_dir(directory, pattern=pattern, recursive=recursive,
+                             include_root=include_root, num_workers=num_workers)
+    files = natural_sort(files)
+    relpath = lambda p: os.path.relpath(p, directory)
+    m = dict(pattern=pattern, count=len(files),
+             files=[relpath(f) for f in files],
+             stamps=dict((relpath(d), stamp) for d, stamp in stamps.items()))
+    for fn in (fns if beside else fns[1:]):
+        try:
+            if not os.path.exists(os.path.dirname(fn)):
+                os.makedirs(os.path.dirname(fn))
+            tmp = '{}.{}.tmp'.format(fn, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(m, f)
+            os.rename(tmp, fn)
+
+            # Creating the manifest beside the dataset updates the
+            # directory stamp, record it (overwriting in-place)
+            if os.path.dirname(fn) == directory:
+                m['stamps']['.'] = _dir_stamp(directory)
+                with open(fn, 'w') as f:
+                    json.dump(m, f)
+            break
+        except (IOError, OSError):
+            continue
+    return files
+
+
+SHARD_STRATEGIES = ('contiguous', 'strided', 'by_sequence')
+
+
+def shard_indices(n, index, count, strategy='contiguous', groups=None):
+    """
+    Deterministic partition of range(n) into `count` disjoint shards,
+    returns the (sorted) indices of shard `index`
+
+       contiguous:   Consecutive blocks of (almost) equal size
+       strided:      Every count-th item, starting at index
+       by_sequence:  Whole sequences (groups[i] is the sequence of
+                     item i, each item its own if None) are assigned
+                     to shards, largest first to the least loaded
+    """
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('Invalid shard {} of {}'.format(index, count))
+
+    if strategy == 'contiguous':
+        bounds = (np.arange(count + 1) * n) // count
+        return np.arange(bounds[index], bounds[index+1])
+    elif strategy == 'strided':
+        return np.arange(index, n, count)
+    elif strategy == 'by_sequence':
+        groups = np.arange(n) if groups is None else np.asarray(groups)
+        if len(groups) != n:
+            raise ValueError('Expected {} sequence labels, got {}'
+                             .format(n, len(groups)))
+        if not n:
+            return np.arange(0)
+        _, labels, sizes = np.unique(groups, return_inverse=True,
+                                     return_counts=True)
+        loads = np.zeros(count, dtype=np.int64)
+        assignment = np.empty(len(sizes), dtype=np.int64)
+        for g in np.argsort(-sizes, kind='mergesort'):
+            assignment[g] = np.argmin(loads)
+            loads[assignment[g]] += sizes[g]
+        return np.where(assignment[labels] == index)[0]
+    else:
+        raise ValueError('Unknown shard strategy {}, use {}'
+                         .format(strategy, SHARD_STRATEGIES))
+
+
+def shard_filename(filename, index, count, ext=None):
+    """ e.g. out.h5 -> out-00002-of-00008.h5 """
+    root, fext = os.path.splitext(os.path.expanduser(filename))
+    return '{}-{:05d}-of-{:05d}{}'.format(
+        root, index, count, fext if ext is None else ext)
+
+
+def save_shard_manifest(filename, index, count, strategy, indices,
+                        files=None, **meta):
+    """
+    Write the manifest of a shard (its item indices, and files),
+    so that the shard can be re-read or audited without re-scanning
+    """
+    m = dict(meta, index=int(index), count=int(count), strategy=strategy,
+             indices=[int(idx) for idx in indices],
+             files=list(files) if files is not None else None)
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(m, f)
+    os.rename(tmp, filename)
+    return m
+
+
+def load_shard_manifest(filename):
+    with open(os.path.expanduser(filename), 'r') as f:
+        return json.load(f)
+
+
 class NoneReader(object):
     def __init__(self):
         pass
@@ -115,33 +350,206 @@ class NoneReader(object):
     def iteritems(self, *args, **kwargs):
         return repeat(None)
 
+    def subset(self, inds):
+        return self
+
 
 class FileReader(object):
     def __init__(self, filename, process_cb, start_idx=0):
         self.filename_ = filename
         self.start_idx_ = start_idx
         self.items_ = process_cb(filename)
+        self.indices_ = None
 
     def iteritems(self, every_k_frames=1, reverse=False):
         if reverse:
             raise NotImplementedError
         return islice(self.items_, self.start_idx_, None, every_k_frames)
 
+    def subset(self, inds):
+        """ Reader over items[start_idx + inds] """
+        reader = copy.copy(self)
+        items = self.items_[self.start_idx_:]
+        reader.items_ = [items[idx] for idx in inds]
+        reader.start_idx_ = 0
+        reader.indices_ = np.asarray(inds, dtype=np.int64) \
+                          if self.indices_ is None else self.indices_[inds]
+        return reader
+
     @property
     def items(self):
         return self.items_
 
 
+class PoseArrayReader(FileReader):
+    """
+    Pose file parsed once (load_cb) into an [N x 4 x 4] pose array,
+    RigidTransforms are only built when the poses are iterated
+    """
+    def __init__(self, filename, load_cb, start_idx=0):
+        self.filename_ = filename
+        self.start_idx_ = start_idx
+        self.array_ = load_cb(filename)
+        self.items_ = None
+        self.indices_ = None
+
+    @property
+    def array(self):
+        return self.array_[self.start_idx_:]
+
+    @property
+    def items(self):
+        if self.items_ is None:
+            self.items_ = [RigidTransform.from_matrix(T) for T in self.array_]
+        return self.items_
+
+    def iteritems(self, every_k_frames=1, reverse=False):
+        if reverse:
+            raise NotImplementedError
+        if self.items_ is not None:
+            return islice(self.items_, self.start_idx_, None, every_k_frames)
+        return (RigidTransform.from_matrix(T)
+                for T in self.array_[self.start_idx_::every_k_frames])
+
+    def subset(self, inds):
+        """ Reader over poses[start_idx + inds] """
+        reader = copy.copy(self)
+        reader.array_ = self.array[np.asarray(inds, dtype=np.int64)]
+        reader.items_ = None
+        reader.start_idx_ = 0
+        reader.indices_ = np.asarray(inds, dtype=np.int64) \
+                          if self.indices_ is None else self.indices_[inds]
+        return reader
+
+
+def item_nbytes(item):
+    """ Approximate size of a (nested tuple/list of) array(s) """
+    if isinstance(item, (tuple, list)):
+        return sum(item_nbytes(it) for it in item)
+    return getattr(item, 'nbytes', 0)
+
+
+def item_freeze(item):
+    """ Mark (nested tuple/list of) array(s) read-only """
+    if isinstance(item, (tuple, list)):
+        for it in item:
+            item_freeze(it)
+    elif isinstance(item, np.ndarray):
+        item.flags.writeable = False
+    return item
+
+
+class LRUCache(object):
+    """
+    Thread-safe LRU cache bounded by item count (maxlen),
+    and/or by total size in bytes (maxbytes). Cached arrays are
+    shared with every reader, and are marked read-only.
+
+    Each invalidate() bumps the generation, and values computed
+    against an older generation (put(..., generation)) are dropped.
+    """
+    def __init__(self, maxlen=None, maxbytes=None):
+        self.maxlen_ = maxlen
+        self.maxbytes_ = maxbytes
+        self.lock_ = threading.Lock()
+        self.items_ = OrderedDict()
+        self.nbytes_ = 0
+        self.hits_, self.misses_ = 0, 0
+        self.generation_ = 0
+
+    def __len__(self):
+        return len(self.items_)
+
+    def __contains__(self, key):
+        return key in self.items_
+
+    @property
+    def nbytes(self):
+        return self.nbytes_
+
+    @property
+    def generation(self):
+        return self.generation_
+
+    @property
+    def stats(self):
+        total = self.hits_ + self.misses_
+        return dict(hits=self.hits_, misses=self.misses_,
+                    hit_rate=self.hits_ * 1.0 / total if total else 0.,
+                    items=len(self.items_), nbytes=self.nbytes_)
+
+    def get(self, key, default=None):
+        with self.lock_:
+            try:
+                value, nbytes = self.items_.pop(key)
+            except KeyError:
+                self.misses_ += 1
+                return default
+            self.items_[key] = (value, nbytes)
+            self.hits_ += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        nbytes = item_nbytes(value)
+        item_freeze(value)
+        with self.lock_:
+            if generation is not None and generation != self.generation_:
+                return value
+            if key in self.items_:
+                self.nbytes_ -= self.items_.pop(key)[1]
+            self.items_[key] = (value, nbytes)
+            self.nbytes_ += nbytes
+
+            # Evict least-recently used items (retain at least one)
+            while len(self.items_) > 1 and (
+                    (self.maxlen_ is not None and len(self.items_) > self.maxlen_) or
+                    (self.maxbytes_ is not None and self.nbytes_ > self.maxbytes_)):
+                _, (_, evicted) = self.items_.popitem(last=False)
+                self.nbytes_ -= evicted
+        return value
+
+    def invalidate(self, key=None):
+        """ Drop a specific key, or all keys if None """
+        with self.lock_:
+            self.generation_ += 1
+            if key is None:
+                self.items_.clear()
+                self.nbytes_ = 0
+            elif key in self.items_:
+                self.nbytes_ -= self.items_.pop(key)[1]
+
+
 class DatasetReader(object):
     """
     Simple Dataset Reader
     Refer to this class and ImageDatasetWriter for input/output
+
+    prefetch:    Number of items decoded ahead (in a thread pool
+                 of num_workers) while the caller processes the
+                 current item (0: synchronous)
+    cache_size:  Bounded LRU cache of decoded items for random access,
+    cache_bytes: by item count and/or bytes (None: no cache), cached
+                 arrays are read-only (copy before drawing on them)
+
+    shard() splits the reader into disjoint shards for
+    multi-process/multi-node runs (see run_sharded)
     """
     def __init__(self, process_cb=lambda x: x,
                  template='template_%i.txt', start_idx=0, max_files=10000,
-                 files=None):
+                 files=None, prefetch=0, num_workers=2,
+                 cache_size=None, cache_bytes=None):
         template = os.path.expanduser(template)
         self.process_cb = process_cb
+        self.prefetch_ = prefetch
+        self.num_workers_ = num_workers
+        self.pool_ = None
+
+        self.cache_ = LRUCache(maxlen=cache_size, maxbytes=cache_bytes) \
+                      if cache_size is not None or cache_bytes is not None else None
+        self.inflight_ = {}
+        self.inflight_lock_ = threading.Lock()
+        self.indices_ = None
+        self.shard_ = None
 
         if files is None:
             # Index starts at 0
@@ -155,8 +563,8 @@ class DatasetReader(object):
             end = basename.find('i', st) + 1
             pattern = basename.replace(basename[st:end], '*')
             try:
-                files = os.listdir(directory)
-                nmatches = len(fnmatch.filter(files, pattern))
+                nmatches = len(read_manifest(directory, pattern=pattern,
+                                             recursive=False))
             except:
                 nmatches = start_idx + max_files
             self.files = [template % idx
@@ -174,33 +582,174 @@ class DatasetReader(object):
         # print('First file: {:}: {:}'.format(template % start_idx, 'GOOD' if
         # os.path.exists(template % start_idx) else 'BAD'))
 
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if getattr(self, 'pool_', None) is not None:
+            self.pool_.close()
+            self.pool_.join()
+            self.pool_ = None
+
     @staticmethod
-    def from_filenames(process_cb, files):
-        return DatasetReader(process_cb=process_cb, files=files)
+    def from_filenames(process_cb, files, **kwargs):
+        return DatasetReader(process_cb=process_cb, files=files, **kwargs)
 
     @staticmethod
-    def from_directory(process_cb, directory, pattern='*.png'):
-        files = read_dir(directory, pattern=pattern, flatten=True)
-        sorted_files = natural_sort(files)
-        return DatasetReader.from_filenames(process_cb, sorted_files)
+    def from_directory(process_cb, directory, pattern='*.png', **kwargs):
+        sorted_files = read_manifest(directory, pattern=pattern,
+                                     include_root=False)
+        return DatasetReader.from_filenames(process_cb, sorted_files, **kwargs)
 
-    # TODO (sudeep.pillai) @async_prefetch
-    def iteritems(self, every_k_frames=1, reverse=False):
+    def _iter_fnos(self, fnos, prefetch=None):
+        """
+        Read items in order, decoding up to `prefetch` items ahead
+        in the thread pool. The bounded queue of pending reads
+        provides backpressure, and pending reads are dropped
+        when the iterator is abandoned.
+        """
+        prefetch = self.prefetch_ if prefetch is None else prefetch
+        if prefetch <= 0:
+            for fno in fnos:
+                yield self.__getitem__(fno)
+            return
+
+        if self.pool_ is None:
+            self.pool_ = ThreadPool(self.num_workers_)
+
+        pending = deque()
+        fnos = iter(fnos)
+        try:
+            for fno in islice(fnos, prefetch):
+                pending.append(self.pool_.apply_async(self.__getitem__, (fno,)))
+            while len(pending):
+                item = pending.popleft().get()
+                for fno in islice(fnos, 1):
+                    pending.append(self.pool_.apply_async(self.__getitem__, (fno,)))
+                yield item
+        finally:
+            pending.clear()
+
+    def iteritems(self, every_k_frames=1, reverse=False, prefetch=None):
         fnos = np.arange(0, len(self.files), every_k_frames).astype(int)
         if reverse:
             fnos = fnos[::-1]
-        for fno in fnos:
-            yield self.process_cb(self.files[fno])
+        return self._iter_fnos(fnos, prefetch=prefetch)
 
-    def iterinds(self, inds, reverse=False):
+    def iterinds(self, inds, reverse=False, prefetch=None):
         fnos = inds.astype(int)
         if reverse:
             fnos = fnos[::-1]
-        for fno in fnos:
-            yield self.__getitem__(fno)
+        return self._iter_fnos(fnos, prefetch=prefetch)
 
     def __getitem__(self, index):
-        return self.process_cb(self.files[index])
+        if self.cache_ is None:
+            return self.process_cb(self.files[index])
+
+        item = self.cache_.get(index)
+        if item is not None:
+            return item
+
+        # Wait on a hinted read of the same index, if any
+        with self.inflight_lock_:
+            result = self.inflight_.get(index)
+        if result is not None:
+            return result.get()
+
+        generation = self.cache_.generation
+        item = self.process_cb(self.files[index])
+        return self.cache_.put(index, item, generation=generation)
+
+    def _load_into_cache(self, index, generation):
+        try:
+            item = self.process_cb(self.files[index])
+            return self.cache_.put(index, item, generation=generation)
+        finally:
+            with self.inflight_lock_:
+                self.inflight_.pop(index, None)
+
+    def prefetch_hint(self, inds):
+        """
+        Hint upcoming indices, which are decoded into the
+        cache in the background (requires a cache)
+        """
+        if self.cache_ is None:
+            raise RuntimeError('{}: prefetch_hint requires cache_size/cache_bytes'
+                               .format(self.__class__.__name__))
+        if self.pool_ is None:
+            self.pool_ = ThreadPool(self.num_workers_)
+
+        for index in np.asarray(inds, dtype=int).ravel():
+            with self.inflight_lock_:
+                if index in self.cache_ or index in self.inflight_:
+                    continue
+                self.inflight_[index] = self.pool_.apply_async(
+                    self._load_into_cache, (index, self.cache_.generation))
+
+    def invalidate(self, index=None):
+        """
+        Drop a cached item, or the entire cache if None. Pending
+        hinted reads are dropped, and not inserted once done.
+        """
+        if self.cache_ is None:
+            return
+        with self.inflight_lock_:
+            if index is None:
+                self.inflight_.clear()
+            else:
+                self.inflight_.pop(index, None)
+            self.cache_.invalidate(index)
+
+    @property
+    def cache_stats(self):
+        return self.cache_.stats if self.cache_ is not None else None
+
+    def subset(self, inds):
+        """
+        Reader over files[inds], sharing the process_cb (with its own
+        worker pool and cache). indices maps back to this reader.
+        """
+        inds = np.asarray(inds, dtype=np.int64)
+        reader = copy.copy(self)
+        reader.files = [self.files[idx] for idx in inds]
+        reader.indices_ = self.indices[inds]
+        reader.shard_ = None
+        reader.pool_ = None
+        if self.cache_ is not None:
+            reader.cache_ = LRUCache(maxlen=self.cache_.maxlen_,
+                                     maxbytes=self.cache_.maxbytes_)
+        reader.inflight_ = {}
+        reader.inflight_lock_ = threading.Lock()
+        return reader
+
+    def sequences(self):
+        """ Sequence (parent directory) of each file, for by_sequence """
+        return [os.path.dirname(fn) for fn in self.files]
+
+    def shard(self, index, count, strategy='contiguous', manifest=None):
+        """
+        Shard `index` of `count` (see shard_indices), deterministic
+        and disjoint across shards. Optionally writes the shard
+        manifest (indices, files) to `manifest`.
+        """
+        inds = shard_indices(len(self.files), index, count, strategy=strategy,
+                             groups=self.sequences()
+                             if strategy == 'by_sequence' else None)
+        reader = self.subset(inds)
+        reader.shard_ = (index, count, strategy)
+        if manifest is not None:
+            save_shard_manifest(manifest, index, count, strategy,
+                                reader.indices, files=reader.files)
+        return reader
+
+    @property
+    def indices(self):
+        return np.arange(len(self.files)) if self.indices_ is None \
+            else self.indices_
+
+    @property
+    def shard_info(self):
+        return self.shard_
 
     def __len__(self):
         return len(self.files)
@@ -222,45 +771,305 @@ def read_velodyne_pc(filename):
     return np.fromfile(filename, dtype=np.float32).reshape(-1, 4)
 
 
+VELODYNE_FIELDS = {'xyzi': slice(0, 4), 'xyz': slice(0, 3), 'intensity': 3}
+
+
+def memmap_velodyne_pc(filename, fields='xyzi', every_k_points=1):
+    """
+    Memory-mapped velodyne point cloud from *.bin, returned as a
+    read-only view (no copy). Field selection ('xyzi', 'xyz',
+    'intensity') and strided subsampling are views as well.
+    """
+    if not os.path.getsize(filename):
+        # np.memmap cannot map empty files
+        pc = np.zeros((0, 4), dtype=np.float32)
+        pc.flags.writeable = False
+    else:
+        pc = np.memmap(filename, dtype=np.float32, mode='r').reshape(-1, 4)
+    return pc[::every_k_points, VELODYNE_FIELDS[fields]]
+
+
 class VelodyneDatasetReader(DatasetReader):
-    """ Velodyne reader using read_velodyne """
+    """
+    Velodyne reader using read_velodyne, or memory-mapped
+    read-only views (memmap_velodyne_pc) if memmap=True
+    """
     def __init__(self, template='template_%i.txt',
-                 start_idx=0, max_files=10000, files=None):
+                 start_idx=0, max_files=10000, files=None,
+                 memmap=False, fields='xyzi', every_k_points=1, **kwargs):
+        self.fields_ = fields
+        self.every_k_points_ = every_k_points
+        process_cb = (lambda fn: memmap_velodyne_pc(
+            fn, fields=fields, every_k_points=every_k_points)) \
+            if memmap else (lambda fn: read_velodyne_pc(fn))
         DatasetReader.__init__(
-            self, process_cb=lambda fn: read_velodyne_pc(fn),
+            self, process_cb=process_cb,
             template=template,
-            start_idx=start_idx, max_files=max_files, files=files)
+            start_idx=start_idx, max_files=max_files, files=files, **kwargs)
+
+    def window(self, index, num_scans=5, fields=None, every_k_points=None,
+               stack=False):
+        """
+        Memory-mapped views of scans [index-num_scans+1, index] for
+        multi-sweep accumulation. If stack=True, the views are
+        gathered into a single preallocated array (one copy),
+        along with the per-scan offsets into it.
+        """
+        fields = self.fields_ if fields is None else fields
+        every_k_points = self.every_k_points_ \
+            if every_k_points is None else every_k_points
+        inds = range(max(0, index - num_scans + 1), index + 1)
+        scans = [memmap_velodyne_pc(self.files[idx], fields=fields,
+                                    every_k_points=every_k_points)
+                 for idx in inds]
+        if not stack:
+            return scans
+
+        offsets = np.r_[0, np.cumsum([len(scan) for scan in scans])]
+        out = np.empty((offsets[-1],) + scans[0].shape[1:], dtype=np.float32)
+        for scan, st, end in izip(scans, offsets[:-1], offsets[1:]):
+            out[st:end] = scan
+        return out, offsets
 
 
 def imread_process_cb(scale=1.0, grayscale=False):
-    return lambda fn: im_resize(
-        cv2.imread(
-            fn, cv2.IMREAD_GRAYSCALE
-            if grayscale else cv2.IMREAD_UNCHANGED),
-        scale=scale)
+    """
+    Image reader at scale, JPEGs are decoded directly at reduced
+    resolution when the scale is 1/2, 1/4 or 1/8 (see image_utils.im_read)
+    """
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_UNCHANGED
+    return lambda fn: im_read(fn, scale=scale, flags=flags)
+
+
+class SharedFrameRing(object):
+    """
+    Ring of preallocated shared-memory frame buffers (slots), that
+    worker processes decode into, and the consumer reads as zero-copy
+    (read-only) numpy views. A slot is owned by the consumer from the
+    time it is acquired, until it is explicitly released.
+    """
+    def __init__(self, num_slots, slot_bytes):
+        self.slot_bytes_ = slot_bytes
+        self.slots_ = [RawArray('B', slot_bytes) for _ in range(num_slots)]
+        self.free_ = deque(range(num_slots))
+
+    @property
+    def slots(self):
+        return self.slots_
+
+    @property
+    def num_slots(self):
+        return len(self.slots_)
+
+    @property
+    def num_free(self):
+        return len(self.free_)
+
+    def acquire(self):
+        return self.free_.popleft() if len(self.free_) else None
+
+    def release(self, slot):
+        self.free_.append(slot)
+
+    def view(self, slot, shape, dtype):
+        im = np.frombuffer(self.slots_[slot], dtype=dtype,
+                           count=int(np.prod(shape))).reshape(shape)
+        im.flags.writeable = False
+        return im
+
+
+# Per-process decoder state for ImageDatasetReader.iteritems_shared
+_shared_slots, _shared_process_cb = None, None
+
+
+def _init_shared_decoder(slots, scale, grayscale):
+    global _shared_slots, _shared_process_cb
+    _shared_slots = slots
+    _shared_process_cb = imread_process_cb(scale=scale, grayscale=grayscale)
+
+
+def _decode_into_slot(fn, slot):
+    im = _shared_process_cb(fn)
+    if im is None:
+        raise IOError('Failed to read image {}'.format(fn))
+    if im.nbytes > len(_shared_slots[slot]):
+        raise ValueError('Image {} ({} bytes) does not fit a ring slot ({} bytes), '
+                         'use a larger slot_bytes'
+                         .format(fn, im.nbytes, len(_shared_slots[slot])))
+    buf = np.frombuffer(_shared_slots[slot], dtype=im.dtype, count=im.size)
+    buf[:] = im.ravel()
+    return im.shape, im.dtype.str
 
 
 class ImageDatasetReader(DatasetReader):
-    """ ImageDatasetReader """
+    """
+    ImageDatasetReader
+
+    For CPU-bound decoding, iteritems_shared()/iterinds_shared()
+    decode in a process pool into a SharedFrameRing, and yield
+    zero-copy views into the ring.
+    """
     def __init__(self, template='template_%i.txt',
                  start_idx=0, max_files=10000, files=None,
-                 scale=1.0, grayscale=False):
+                 scale=1.0, grayscale=False, **kwargs):
         super(ImageDatasetReader, self).__init__(
             process_cb=imread_process_cb(
                 scale=scale, grayscale=grayscale),
             template=template, start_idx=start_idx,
-            max_files=max_files, files=files)
+            max_files=max_files, files=files, **kwargs)
+        self.scale_ = scale
+        self.grayscale_ = grayscale
+        self.ring_ = None
+        self.decode_pool_ = None
+        self.shared_params_ = None
+
+    def close(self):
+        super(ImageDatasetReader, self).close()
+        self._close_shared()
+
+    def _close_shared(self):
+        if getattr(self, 'decode_pool_', None) is not None:
+            self.decode_pool_.close()
+            self.decode_pool_.join()
+            self.decode_pool_ = None
+            self.ring_ = None
+            self.shared_params_ = None
 
     @staticmethod
     def from_filenames(files, **kwargs):
-        return DatasetReader(process_cb=imread_process_cb(**kwargs),
-                             files=files)
+        return ImageDatasetReader(files=files, **kwargs)
 
     @staticmethod
     def from_directory(directory, pattern='*.png', **kwargs):
-        return DatasetReader.from_directory(
-            process_cb=imread_process_cb(),
-            directory=directory, pattern=pattern)
+        files = read_manifest(directory, pattern=pattern, include_root=False)
+        return ImageDatasetReader.from_filenames(files, **kwargs)
+
+    def subset(self, inds):
+        reader = super(ImageDatasetReader, self).subset(inds)
+        reader.ring_ = None
+        reader.decode_pool_ = None
+        reader.shared_params_ = None
+        return reader
+
+    @property
+    def ring(self):
+        return self.ring_
+
+    def release(self, slot):
+        """ Return a slot (handed out with release='manual') to the ring """
+        self.ring_.release(slot)
+
+    def _setup_shared(self, num_workers=None, num_slots=None, slot_bytes=None):
+        """
+        Setup (or rebuild, if the parameters changed) the ring and the
+        decoder pool. Slots are sized to the first frame unless
+        slot_bytes is given, and larger frames fail to decode.
+        """
+        num_workers = cpu_count() if num_workers is None else num_workers
+        num_slots = 2 * num_workers + 2 if num_slots is None else num_slots
+        if self.decode_pool_ is not None:
+            if slot_bytes is None:
+                slot_bytes = self.shared_params_[2]
+            if self.shared_params_ == (num_workers, num_slots, slot_bytes):
+                return
+            if self.ring_.num_free != self.ring_.num_slots:
+                raise RuntimeError('{}: Cannot resize the ring while frames are '
+                                   'in use, release() them first'
+                                   .format(self.__class__.__name__))
+            self._close_shared()
+
+        if slot_bytes is None:
+            im = self.process_cb(self.files[0])
+            if im is None:
+                raise IOError('Failed to read image {}'.format(self.files[0]))
+            slot_bytes = im.nbytes
+        self.ring_ = SharedFrameRing(num_slots, slot_bytes)
+        self.decode_pool_ = Pool(processes=num_workers,
+                                 initializer=_init_shared_decoder,
+                                 initargs=(self.ring_.slots, self.scale_,
+                                           self.grayscale_))
+        self.shared_params_ = (num_workers, num_slots, slot_bytes)
+
+    def _iter_shared(self, fnos, num_workers=None, num_slots=None,
+                     slot_bytes=None, release='auto'):
+        """
+        Decode files in the process pool into free ring slots, and
+        yield views in order. With release='auto', a view is only
+        valid until the next item is requested. With
+        release='manual', (slot, view) is yielded, and the slot is
+        owned by the caller until release(slot).
+        """
+        if release not in ('auto', 'manual'):
+            raise ValueError('Unknown release mode {}, use auto/manual'
+                             .format(release))
+        self._setup_shared(num_workers=num_workers, num_slots=num_slots,
+                           slot_bytes=slot_bytes)
+        ring, pool = self.ring_, self.decode_pool_
+
+        fnos = iter(fnos)
+        pending, prev, done = deque(), None, False
+        try:
+            while True:
+                # Submit as many reads as there are free slots
+                while not done and ring.num_free:
+                    try:
+                        fno = next(fnos)
+                    except StopIteration:
+                        done = True
+                        break
+                    slot = ring.acquire()
+                    pending.append((slot, pool.apply_async(
+                        _decode_into_slot, (self.files[fno], slot))))
+
+                if not len(pending):
+                    if done:
+                        return
+                    raise RuntimeError('{}: No free slots, release() frames '
+                                       'before requesting more'
+                                       .format(self.__class__.__name__))
+
+                slot, result = pending.popleft()
+                try:
+                    shape, dtype = result.get()
+                except Exception:
+                    ring.release(slot)
+                    raise
+
+                if release == 'manual':
+                    yield slot, ring.view(slot, shape, dtype)
+                    continue
+
+                if prev is not None:
+                    ring.release(prev)
+                prev = slot
+                yield ring.view(slot, shape, dtype)
+        finally:
+            # Wait on abandoned reads before returning their slots
+            for slot, result in pending:
+                result.wait()
+                ring.release(slot)
+            if prev is not None:
+                ring.release(prev)
+
+    def iteritems_shared(self, every_k_frames=1, reverse=False,
+                         num_workers=None, num_slots=None, slot_bytes=None,
+                         release='auto'):
+        fnos = np.arange(0, len(self.files), every_k_frames).astype(int)
+        if reverse:
+            fnos = fnos[::-1]
+        return self._iter_shared(fnos, num_workers=num_workers,
+                                 num_slots=num_slots, slot_bytes=slot_bytes,
+                                 release=release)
+
+    def iterinds_shared(self, inds, reverse=False,
+                        num_workers=None, num_slots=None, slot_bytes=None,
+                        release='auto'):
+        fnos = inds.astype(int)
+        if reverse:
+            fnos = fnos[::-1]
+        return self._iter_shared(fnos, num_workers=num_workers,
+                                 num_slots=num_slots, slot_bytes=slot_bytes,
+                                 release=release)
 
 
 class StereoDatasetReader(object):
@@ -272,15 +1081,15 @@ class StereoDatasetReader(object):
                  left_template='image_0/%06i.png',
                  right_template='image_1/%06i.png',
                  start_idx=0, max_files=10000,
-                 scale=1.0, grayscale=False):
+                 scale=1.0, grayscale=False, **kwargs):
         left_dir = os.path.join(os.path.expanduser(directory), left_template)
         right_dir = os.path.join(os.path.expanduser(directory), right_template)
         self.left = ImageDatasetReader(template=left_dir, start_idx=start_idx,
                                        max_files=max_files, scale=scale,
-                                       grayscale=grayscale)
+                                       grayscale=grayscale, **kwargs)
         self.right = ImageDatasetReader(template=right_dir, start_idx=start_idx,
                                         max_files=max_files, scale=scale,
-                                        grayscale=grayscale)
+                                        grayscale=grayscale, **kwargs)
 
     @classmethod
     def from_filenames(cls, left_files, right_files, **kwargs):
@@ -300,12 +1109,49 @@ class StereoDatasetReader(object):
         return izip(self.left.iteritems(*args, **kwargs),
                     self.right.iteritems(*args, **kwargs))
 
-    def iterinds(self, inds, reverse=False):
-        fnos = inds.astype(int)
-        if reverse:
-            fnos = fnos[::-1]
-        for fno in fnos:
-            yield self.__getitem__(fno)
+    def iterinds(self, inds, reverse=False, prefetch=None):
+        return izip(self.left.iterinds(inds, reverse=reverse, prefetch=prefetch),
+                    self.right.iterinds(inds, reverse=reverse, prefetch=prefetch))
+
+    def subset(self, inds):
+        c = copy.copy(self)
+        c.left, c.right = self.left.subset(inds), self.right.subset(inds)
+        return c
+
+    def shard(self, index, count, strategy='contiguous', manifest=None):
+        """ Shard both cameras identically (see DatasetReader.shard) """
+        c = copy.copy(self)
+        c.left = self.left.shard(index, count, strategy=strategy)
+        c.right = self.right.subset(c.left.indices)
+        c.right.shard_ = c.left.shard_
+        if manifest is not None:
+            save_shard_manifest(manifest, index, count, strategy, c.indices,
+                                files=list(izip(c.left.files, c.right.files)))
+        return c
+
+    @property
+    def indices(self):
+        return self.left.indices
+
+    @property
+    def shard_info(self):
+        return self.left.shard_info
+
+    def close(self):
+        self.left.close()
+        self.right.close()
+
+    def prefetch_hint(self, inds):
+        self.left.prefetch_hint(inds)
+        self.right.prefetch_hint(inds)
+
+    def invalidate(self, index=None):
+        self.left.invalidate(index)
+        self.right.invalidate(index)
+
+    @property
+    def cache_stats(self):
+        return (self.left.cache_stats, self.right.cache_stats)
 
     def __getitem__(self, index):
         return (self.left[index], self.right[index])
@@ -317,3 +1163,361 @@ class StereoDatasetReader(object):
     def length(self):
         assert(len(self.left) == len(self.right))
         return len(self.left)
+
+
+class PackedSequenceWriter(object):
+    """
+    Single-file sequence archive writer. Per-frame items of each field
+    (encoded blobs as bytes, or raw arrays) are written sequentially,
+    frame by frame and 64-byte aligned, in page-aligned chunks of
+    consecutive frames (of about chunk_bytes each). These are followed
+    by the chunk index (offset, size, first frame), per-field frame
+    indices (offset, size, ndim + shape), additional arrays (e.g.
+    poses), and a json header located via the fixed-size footer:
+
+        [chunk [blobs ...] ...][index arrays][json header][header offset][MAGIC]
+
+        writer = PackedSequenceWriter('00.seq', meta=dict(sequence='00'))
+        for ... :
+            writer.append(left=open(fn, 'rb').read(), velodyne=pc)
+        writer.add_array('poses', poses)
+        writer.close()
+    """
+    MAGIC = b'PYBOTSEQ'
+    ALIGN = 64
+    CHUNK_ALIGN = 4096
+
+    def __init__(self, filename, meta=None, chunk_bytes=16 * 1024 * 1024):
+        self.filename_ = os.path.expanduser(filename)
+        self.f_ = open(self.filename_, 'wb')
+        self.f_.write(PackedSequenceWriter.MAGIC)
+        self.meta_ = meta if meta is not None else {}
+        self.chunk_bytes_ = chunk_bytes
+        self.chunks_ = []
+        self.fields_ = OrderedDict()
+        self.arrays_ = OrderedDict()
+        self.num_frames_ = 0
+
+    def __del__(self):
+        self.close()
+
+    def _align(self, align=ALIGN):
+        pad = -self.f_.tell() % align
+        if pad:
+            self.f_.write(b'\0' * pad)
+
+    def _write(self, data):
+        self._align()
+        offset = self.f_.tell()
+        self.f_.write(data)
+        return offset
+
+    def _validate(self, items):
+        """ Check the frame's fields before anything is written """
+        if self.num_frames_ and set(items.keys()) != set(self.fields_.keys()):
+            raise ValueError('Frame fields {} do not match archive fields {}'
+                             .format(sorted(items.keys()),
+                                     sorted(self.fields_.keys())))
+        for name, item in items.items():
+            if isinstance(item, np.ndarray) and item.ndim > 3:
+                raise ValueError('Field {} has more than 3 dimensions'
+                                 .format(name))
+            if name in self.fields_ and \
+               self.fields_[name]['encoded'] == isinstance(item, np.ndarray):
+                raise ValueError('Field {} mixes encoded and raw items'
+                                 .format(name))
+
+    def append(self, **items):
+        """
+        Append a frame, with an item per field: bytes (encoded, e.g.
+        png file contents), or a numpy array (stored raw)
+        """
+        if not len(items):
+            raise ValueError('Frame has no fields')
+        self._validate(items)
+
+        # Start a new chunk (page-aligned) once the current one is full
+        if not len(self.chunks_) or \
+           self.f_.tell() - self.chunks_[-1][0] >= self.chunk_bytes_:
+            self._align(PackedSequenceWriter.CHUNK_ALIGN)
+            self.chunks_.append([self.f_.tell(), 0, self.num_frames_])
+
+        for name, item in items.items():
+            if name not in self.fields_:
+                self.fields_[name] = dict(
+                    encoded=not isinstance(item, np.ndarray),
+                    dtype=None if not isinstance(item, np.ndarray)
+                    else item.dtype.str,
+                    offsets=[], sizes=[], shapes=[])
+            field = self.fields_[name]
+            if field['encoded']:
+                data, shape = bytes(item), (0, 0, 0, 0)
+            else:
+                item = np.ascontiguousarray(item, dtype=field['dtype'])
+                data = item.tobytes()
+                shape = ((item.ndim,) + tuple(item.shape) + (0, 0, 0))[:4]
+            field['offsets'].append(self._write(data))
+            field['sizes'].append(len(data))
+            field['shapes'].append(shape)
+
+        self.chunks_[-1][1] = self.f_.tell() - self.chunks_[-1][0]
+        self.num_frames_ += 1
+
+    def add_array(self, name, arr):
+        """ Store a (sequence-level) array, e.g. poses """
+        arr = np.ascontiguousarray(arr)
+        self.arrays_[name] = dict(offset=self._write(arr.tobytes()),
+                                  dtype=arr.dtype.str, shape=list(arr.shape))
+
+    def _write_index(self, index):
+        return dict((key, dict(offset=self._write(arr.tobytes()),
+                               dtype=arr.dtype.str, shape=list(arr.shape)))
+                    for key, arr in index.items())
+
+    def close(self):
+        if getattr(self, 'f_', None) is None:
+            return
+
+        import json
+        chunks = np.uint64(self.chunks_).reshape(-1, 3)
+        chunks = self._write_index(dict(offsets=chunks[:,0], sizes=chunks[:,1],
+                                        frames=chunks[:,2]))
+        fields = OrderedDict()
+        for name, field in self.fields_.items():
+            fields[name] = dict(encoded=field['encoded'], dtype=field['dtype'])
+            fields[name].update(self._write_index(dict(
+                offsets=np.uint64(field['offsets']),
+                sizes=np.uint64(field['sizes']),
+                shapes=np.int64(field['shapes']).reshape(-1, 4))))
+
+        header = json.dumps(dict(version=2, num_frames=self.num_frames_,
+                                 meta=self.meta_, chunks=chunks, fields=fields,
+                                 arrays=self.arrays_)).encode('utf-8')
+        offset = self._write(header)
+        self.f_.write(np.uint64(offset).tobytes())
+        self.f_.write(PackedSequenceWriter.MAGIC)
+        self.f_.close()
+        self.f_ = None
+
+
+class PackedSequenceReader(object):
+    """
+    Memory-mapped reader for PackedSequenceWriter archives. Raw
+    items are returned as read-only views into the mapping, and
+    encoded items are decoded with decode_cb(field, buffer).
+
+    With chunked=True, each chunk of frames is read with a single
+    sequential read on first access (e.g. for network storage),
+    and items are served from the chunk in memory.
+    """
+    def __init__(self, filename, decode_cb=None, chunked=False):
+        import json
+        self.filename_ = os.path.expanduser(filename)
+        self.mm_ = np.memmap(self.filename_, dtype=np.uint8, mode='r')
+        magic = PackedSequenceWriter.MAGIC
+        if self.mm_[:len(magic)].tobytes() != magic or \
+           self.mm_[-len(magic):].tobytes() != magic:
+            raise IOError('Not a packed sequence archive {}'
+                          .format(self.filename_))
+        end = len(self.mm_) - len(magic)
+        offset = int(np.frombuffer(self.mm_[end-8:end].tobytes(),
+                                   dtype=np.uint64)[0])
+        self.header_ = json.loads(self.mm_[offset:end-8].tobytes()
+                                  .decode('utf-8'))
+
+        self.decode_cb = decode_cb if decode_cb is not None \
+            else lambda field, buf: cv2.imdecode(buf, cv2.IMREAD_UNCHANGED)
+        self.index_ = {}
+        for name, field in self.header_['fields'].items():
+            self.index_[name] = dict((key, self._array(field[key]))
+                                     for key in ('offsets', 'sizes', 'shapes'))
+
+        self.chunks_ = dict((key, self._array(desc).astype(np.int64))
+                            for key, desc in self.header_['chunks'].items()) \
+                            if 'chunks' in self.header_ else None
+        self.chunked_ = chunked and self.chunks_ is not None
+        self.chunk_, self.chunk_idx_ = None, None
+
+    def _array(self, desc):
+        dtype = np.dtype(str(desc['dtype']))
+        count = int(np.prod(desc['shape']))
+        return np.frombuffer(self.mm_, dtype=dtype, count=count,
+                             offset=int(desc['offset'])).reshape(desc['shape'])
+
+    def __len__(self):
+        return self.header_['num_frames']
+
+    @property
+    def fields(self):
+        return list(self.header_['fields'].keys())
+
+    @property
+    def meta(self):
+        return self.header_['meta']
+
+    @property
+    def num_chunks(self):
+        return len(self.chunks_['offsets']) if self.chunks_ is not None else 0
+
+    def chunk_index(self, index):
+        """ Chunk containing frame index """
+        return int(np.searchsorted(self.chunks_['frames'], index, side='right')) - 1
+
+    def _buffer(self, index, offset, size):
+        if not self.chunked_:
+            return self.mm_[offset:offset+size]
+
+        # Single sequential read of the frame's chunk
+        cidx = self.chunk_index(index)
+        if cidx != self.chunk_idx_:
+            start = int(self.chunks_['offsets'][cidx])
+            self.chunk_ = np.array(self.mm_[start:start+int(self.chunks_['sizes'][cidx])])
+            self.chunk_.flags.writeable = False
+            self.chunk_idx_ = cidx
+        start = offset - int(self.chunks_['offsets'][cidx])
+        return self.chunk_[start:start+size]
+
+    def is_encoded(self, name):
+        return bool(self.header_['fields'][name]['encoded'])
+
+    def has_array(self, name):
+        return name in self.header_['arrays']
+
+    def array(self, name):
+        return self._array(self.header_['arrays'][name])
+
+    def read(self, name, index):
+        field, index_ = self.header_['fields'][name], self.index_[name]
+        offset, size = int(index_['offsets'][index]), int(index_['sizes'][index])
+        buf = self._buffer(index, offset, size)
+        if field['encoded']:
+            return self.decode_cb(name, buf)
+
+        # Shape is stored as (ndim, d0, d1, d2)
+        dtype = np.dtype(str(field['dtype']))
+        shape = index_['shapes'][index]
+        return np.frombuffer(buf, dtype=dtype).reshape(
+            tuple(int(s) for s in shape[1:1+shape[0]]))
+
+    def iteritems(self, name, every_k_frames=1, reverse=False):
+        fnos = np.arange(0, len(self), every_k_frames).astype(int)
+        if reverse:
+            fnos = fnos[::-1]
+        for fno in fnos:
+            yield self.read(name, fno)
+
+
+def _run_shard(args):
+    """ Process a single shard into its own IterDB (see run_sharded) """
+    from pybot.utils.db_utils import IterDB
+
+    reader_cb, map_cb, filename, index, count, strategy, method = args
+    reader = reader_cb().shard(index, count, strategy=strategy)
+    indices = getattr(reader, 'indices', None)
+
+    db = IterDB(shard_filename(filename, index, count), mode='w')
+    nitems, processed = 0, []
+    try:
+        for pos, item in enumerate(getattr(reader, method)()):
+            idx = int(indices[pos]) if indices is not None else pos
+            out = map_cb(idx, item)
+            if out is None:
+                continue
+            db.append('index', np.int64([idx]))
+            for key, value in out.items():
+                db.append(key, value)
+            processed.append(idx)
+            nitems += 1
+    finally:
+        db.close()
+        if hasattr(reader, 'close'):
+            reader.close()
+
+    files = getattr(reader, 'files', None)
+    save_shard_manifest(shard_filename(filename, index, count, ext='.json'),
+                        index, count, strategy, processed,
+                        files=files, num_items=nitems, done=True)
+    return index, nitems
+
+
+def merge_shards(filename, count, shards=None, remove=True):
+    """
+    Merge per-shard IterDBs (in shard order) into a single IterDB
+    at filename. 'index' holds the reader index of each result
+    (the position within its shard for log readers).
+    """
+    from pybot.utils.db_utils import IterDB
+
+    shards = range(count) if shards is None else shards
+    db = IterDB(filename, mode='w')
+    try:
+        for index in shards:
+            fn = shard_filename(filename, index, count)
+            sdb = IterDB(fn, mode='r')
+            try:
+                for key in sdb.keys:
+                    for value in sdb.itervalues_for_key(key):
+                        db.append(key, value)
+            finally:
+                sdb.close()
+            if remove:
+                os.remove(fn)
+    finally:
+        db.close()
+
+
+def run_sharded(reader_cb, map_cb, filename, num_shards=None,
+                strategy='contiguous', method='iteritems',
+                num_workers=None, shards=None, merge=None, resume=True):
+    """
+    Run map_cb(index, item) over all items of a reader, split into
+    num_shards shards processed in a process pool, and merge the
+    results (dict of key: value per item, or None to skip) into an
+    IterDB at filename.
+
+       reader_cb:  Picklable (module-level) function that creates
+                   the reader in each worker, e.g.
+                   functools.partial(ImageDatasetReader, template=...)
+       method:     Reader iterator (iteritems, iterframes, ...)
+       shards:     Subset of shards to process (e.g. for multi-node
+                   runs, followed by merge_shards() on one node),
+                   results are only merged if all shards are run
+       resume:     Skip shards whose manifest is complete
+
+    Each shard writes its own IterDB and manifest
+    (see shard_filename), that are merged in shard order.
+    """
+    num_workers = cpu_count() if num_workers is None else num_workers
+    num_shards = num_workers if num_shards is None else num_shards
+    shards = list(range(num_shards)) if shards is None else list(shards)
+
+    def is_done(index):
+        try:
+            m = load_shard_manifest(
+                shard_filename(filename, index, num_shards, ext='.json'))
+        except (IOError, OSError, ValueError):
+            return False
+        return m.get('done', False) and \
+            os.path.exists(shard_filename(filename, index, num_shards))
+
+    todo = [index for index in shards if not (resume and is_done(index))]
+    print('{}: Processing {} of {} shards ({} workers)'.format(
+        'run_sharded', len(todo), num_shards, num_workers))
+
+    args = [(reader_cb, map_cb, filename, index, num_shards, strategy, method)
+            for index in todo]
+    if num_workers <= 1 or len(args) <= 1:
+        results = [_run_shard(a) for a in args]
+    else:
+        pool = Pool(processes=min(num_workers, len(args)))
+        try:
+            results = pool.map(_run_shard, args, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    for index, nitems in results:
+        print('Shard {}/{}: {} items'.format(index, num_shards, nitems))
+
+    if merge or (merge is None and len(shards) == num_shards):
+        merge_shards(filename, num_shards, shards=shards)
@@ -82,7 +82,7 @@ def read_pytable(h5f, group=None):
                 item = read_pytable(h5f, child)
             else:
                 item = child.read()
-                if isinstance(item, str) and item.startswith('OBJ_'):
+                if isinstance(item, bytes) and item.startswith(b'OBJ_'):
                     item = cPickle.loads(item[4:])
             data[child._v_name] = item
         except tb.NoSuchNodeError:
@@ -156,7 +156,7 @@ def flush_pytable(h5f, data=None, group=None, table=None, force=True):
                 assert v is not None
                 table[k] = h5f.create_carray(group._gp, k, obj=v)
             except (TypeError, ValueError, AssertionError):
-                v = 'OBJ_' + cPickle.dumps(v, -1)
+                v = b'OBJ_' + cPickle.dumps(v, -1)
                 table[k] = h5f.create_array(group._gp, k, v)
                 # print 'TypeError', v
             finally:
@@ -362,15 +362,29 @@ class IterDB(object):
         for chunk in itchunks:
             yield chunk
 
-    def iterchunks_keys(self, keys, batch_size=10, verbose=False):
+    def num_chunks(self, key, batch_size=10):
+        return (self.length(key) + batch_size - 1) // batch_size
+
+    def read_chunk(self, key, index, batch_size=10):
+        """ Read only the index-th chunk (of batch_size items) """
+        start = index * batch_size
+        return [self.unpack(item) for item in
+                self.get_node(key).read(start, start + batch_size)]
+
+    def iterchunks_keys(self, keys, batch_size=10, inds=None, verbose=False):
         """
-        Iterate in chunks and izip specific keys
+        Iterate in chunks and izip specific keys. If inds is
+        provided, only those chunks are read (in order)
         """
         for key in keys:
             if key not in self.keys:
                 raise RuntimeError(
                     'Key %s not found in dataset. keys: %s' % (key, self.keys))
 
+        if inds is not None:
+            return (tuple(self.read_chunk(key, idx, batch_size=batch_size)
+                          for key in keys) for idx in inds)
+
         iterables = (self.iterchunks(key, batch_size=batch_size,
                                      verbose=verbose) for key in keys)
         return izip(*iterables)
@@ -216,6 +216,54 @@ def pick(iterable, inds):
             except IndexError:
                 first = None
 
+def prefetch(iterable, size=2):
+    """
+    Read-ahead up to `size` items of the iterable in a background
+    thread, while the consumer processes the current item. Exceptions 
+    raised by the iterable are re-raised in the consumer. 
+    """
+    import sys
+    import threading
+    from six.moves import queue
+
+    q = queue.Queue(maxsize=max(size, 1))
+    done = threading.Event()
+    sentinel = object()
+
+    def put(item):
+        while not done.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception:
+            put((sentinel, sys.exc_info()))
+            return
+        put((sentinel, None))
+
+    t = threading.Thread(target=producer)
+    t.daemon = True
+    t.start()
+    try:
+        while True:
+            item, exc_info = q.get()
+            if item is sentinel:
+                if exc_info is not None:
+                    import six
+                    six.reraise(*exc_info)
+                return
+            yield item
+    finally:
+        done.set()
+
 def test_pick(): 
     import numpy as np
     it = np.arange(200)
@@ -3,6 +3,7 @@
 from __future__ import print_function
 
 import time
+import threading
 from collections import OrderedDict
 from functools import wraps
 
@@ -10,12 +11,14 @@ def print_green(prt): print("\033[92m {}\033[00m" .format(prt))
 
 global g_timers
 g_timers = OrderedDict()
+g_timers_lock = threading.Lock()
 
 def named_timer(name): 
     global g_timers
-    header = '\n' if len(g_timers) == 0 else ''
-    if name not in g_timers: 
-        g_timers[name] = SimpleTimer(name, header=header)
+    with g_timers_lock: 
+        header = '\n' if len(g_timers) == 0 else ''
+        if name not in g_timers: 
+            g_timers[name] = SimpleTimer(name, header=header)
     try: 
         return g_timers[name] 
     except KeyError as e: 
@@ -28,9 +31,11 @@ def timeitmethod(func):
             name = ''.join([args[0].__class__.__name__, '::', func.__name__])
         except: 
             raise RuntimeError('timeitmethod requires first argument to be self')
-        named_timer(name).start()
+        # Time locally, so that concurrent calls (threads) do not
+        # share the timer's start time
+        st = time.time()
         r = func(*args, **kwargs)
-        named_timer(name).stop()
+        named_timer(name).add(time.time() - st)
         return r
     return wrapper
 
@@ -42,9 +47,9 @@ def timeit(func):
             name = ''.join([func.__name__])
         except: 
             raise RuntimeError('timeitmethod requires first argument to be self')
-        named_timer(name).start()
+        st = time.time()
         r = func(*args, **kwargs)
-        named_timer(name).stop()
+        named_timer(name).add(time.time() - st)
         return r
     return wrapper
 
@@ -61,6 +66,7 @@ class SimpleTimer:
 
         self.last_print_ = time.time()        
         self.last_fps_ = 0
+        self.lock_ = threading.Lock()
 
     def __enter__(self):
         self.start()
@@ -86,9 +92,16 @@ class SimpleTimer:
             self.counter_ = 0
 
     def poll_piecemeal(self, force_print=False): 
+        self.add(time.time() - self.last_, force_print=force_print)
+
+    def add(self, dt, force_print=False): 
+        """ Record a timed period dt (thread-safe) """
+        with self.lock_: 
+            self._add(dt, force_print=force_print)
+
+    def _add(self, dt, force_print=False): 
         self.counter_ += 1
         now = time.time()
-        dt = (now - self.last_)
         self.period_ += dt
 
         if (now-self.last_print_) > 1.0 / self.hz_ or force_print:
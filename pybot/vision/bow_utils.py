@@ -0,0 +1,446 @@
+"""
+Bag-of-words / VLAD / Fisher (lite) encoding utilities
+"""
+# Author: Sudeep Pillai <spillai@csail.mit.edu>
+# License: MIT
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.spatial import cKDTree
+from sklearn.cluster import MiniBatchKMeans
+
+from pybot.utils.db_utils import AttrDict
+
+# =====================================================================
+# Codebook construction
+# ---------------------------------------------------------------------
+
+def iter_minibatches(desc_iterable, batch_size=10000, max_per_item=None, seed=0):
+    """
+    Re-chunk an iterable of descriptors [N_i x D] into
+    mini-batches of (at least) batch_size descriptors.
+    Optionally randomly subsample up to max_per_item
+    descriptors from each item.
+    """
+    rng = np.random.RandomState(seed)
+    buf, buf_size = [], 0
+    for desc in desc_iterable:
+        if desc is None or not len(desc):
+            continue
+        if max_per_item is not None and len(desc) > max_per_item:
+            desc = desc[rng.choice(len(desc), max_per_item, replace=False)]
+        buf.append(desc)
+        buf_size += len(desc)
+        if buf_size >= batch_size:
+            yield np.vstack(buf).astype(np.float32)
+            buf, buf_size = [], 0
+    if buf_size:
+        yield np.vstack(buf).astype(np.float32)
+
+def bow_codebook(data, K=64, batch_size=10000, seed=0):
+    """
+    Build codebook [K x D] with mini-batch k-means, from an in-memory
+    [N x D] array, or an iterable of descriptor arrays (streamed)
+    """
+    vectorizer = BoWVectorizer(K=K, batch_size=batch_size, seed=seed)
+    vectorizer.build(data)
+    return vectorizer.codebook
+
+# =====================================================================
+# Quantization
+# ---------------------------------------------------------------------
+
+def nearest_codewords(X, codebook, codebook_sqnorm=None, chunk_size=8192):
+    """
+    Brute-force (BLAS) nearest codeword assignment,
+    chunked to cap memory at [chunk_size x K]
+    """
+    if codebook_sqnorm is None:
+        codebook_sqnorm = np.sum(codebook ** 2, axis=1)
+    codes = np.empty(len(X), dtype=np.int64)
+    for idx in range(0, len(X), chunk_size):
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2 (|x|^2 is constant per row)
+        d = codebook_sqnorm[np.newaxis,:] - 2 * X[idx:idx+chunk_size].dot(codebook.T)
+        codes[idx:idx+chunk_size] = np.argmin(d, axis=1)
+    return codes
+
+def spatial_pyramid_cells(pts, shape, levels=(1,)):
+    """
+    Returns the spatial pyramid cell index of each point [L x N],
+    for each level (LxL grid), offset such that cells are unique
+    across levels, and the total number of cells
+    """
+    H, W = shape[:2]
+    pts = np.asarray(pts, dtype=np.float32)
+    cells, offset = [], 0
+    for L in levels:
+        cx = np.clip((pts[:,0] * L / W).astype(np.int64), 0, L-1)
+        cy = np.clip((pts[:,1] * L / H).astype(np.int64), 0, L-1)
+        cells.append(offset + cy * L + cx)
+        offset += L * L
+    return np.vstack(cells), offset
+
+def _groups(codes, K, pts=None, shape=None, levels=(1,)):
+    """
+    Returns the (cell, codeword) group of each descriptor
+    (repeated for each pyramid level), descriptor indices,
+    and number of groups
+    """
+    N = len(codes)
+    if pts is None or shape is None:
+        return codes, np.arange(N), K
+    cells, ncells = spatial_pyramid_cells(pts, shape, levels=levels)
+    groups = (cells * K + codes[np.newaxis,:]).ravel()
+    inds = np.tile(np.arange(N), len(cells))
+    return groups, inds, ncells * K
+
+def _group_sums(groups, inds, G, X):
+    """ Sum of X rows per group [G x D] via sparse matrix product """
+    M = sp.csr_matrix((np.ones(len(groups), dtype=np.float32), (groups, inds)),
+                      shape=(G, len(X)))
+    return np.asarray(M.dot(X))
+
+def _normalize(v, eps=1e-12):
+    return v / (np.linalg.norm(v) + eps)
+
+def _power_normalize(v, alpha=0.5):
+    return np.sign(v) * np.fabs(v) ** alpha
+
+# =====================================================================
+# Encodings
+# ---------------------------------------------------------------------
+
+def bow_project(data, codebook, pts=None, shape=None, levels=(1,), codes=None):
+    """
+    Bag-of-words histogram (with spatial pyramid pooling if pts
+    and image shape are provided) [(cells x K)]
+    """
+    K = len(codebook)
+    if codes is None:
+        codes = nearest_codewords(np.float32(data), codebook)
+    groups, _, G = _groups(codes, K, pts=pts, shape=shape, levels=levels)
+    hist = np.bincount(groups, minlength=G).astype(np.float32)
+    return _normalize(np.sqrt(hist))
+
+def vlad_project(data, codebook, pts=None, shape=None, levels=(1,), codes=None):
+    """
+    VLAD encoding (with spatial pyramid pooling if pts and image
+    shape are provided) [(cells x K x D)], with intra-normalization,
+    power (signed square-root), and L2 normalization
+    """
+    X = np.float32(data)
+    K, D = codebook.shape[:2]
+    if codes is None:
+        codes = nearest_codewords(X, codebook)
+    groups, inds, G = _groups(codes, K, pts=pts, shape=shape, levels=levels)
+
+    # Sum of residuals per group: sum(x) - count * c
+    sums = _group_sums(groups, inds, G, X)
+    counts = np.bincount(groups, minlength=G).astype(np.float32)
+    vlad = sums - counts[:,np.newaxis] * np.tile(codebook, (G // K, 1))
+
+    # Intra-normalization
+    vlad /= (np.linalg.norm(vlad, axis=1)[:,np.newaxis] + 1e-12)
+    return _normalize(_power_normalize(vlad.ravel()))
+
+def fisher_project(data, codebook, variances, weights, pts=None, shape=None, levels=(1,), codes=None):
+    """
+    Fisher-vector (lite) encoding with hard assignments, and per-codeword
+    diagonal variances and priors [(cells x K x 2D)]
+    """
+    X = np.float32(data)
+    K, D = codebook.shape[:2]
+    if codes is None:
+        codes = nearest_codewords(X, codebook)
+    groups, inds, G = _groups(codes, K, pts=pts, shape=shape, levels=levels)
+
+    # Normalized residuals, and their first and second order statistics
+    sigma = np.sqrt(variances)
+    R = (X - codebook[codes]) / sigma[codes]
+    S1 = _group_sums(groups, inds, G, R)
+    S2 = _group_sums(groups, inds, G, R ** 2) - \
+         np.bincount(groups, minlength=G).astype(np.float32)[:,np.newaxis]
+
+    w = np.tile(weights, G // K)[:,np.newaxis]
+    N = max(len(X), 1)
+    fv = np.hstack([S1 / (N * np.sqrt(w)), S2 / (N * np.sqrt(2 * w))])
+    return _normalize(_power_normalize(fv.ravel()))
+
+# =====================================================================
+# Region encodings (integral histograms)
+# ---------------------------------------------------------------------
+
+def integral_statistics(codes, pts, shape, K, step=4, X=None):
+    """
+    Integral image of per-codeword statistics over a grid of
+    [step x step] pixel cells [(gh+1) x (gw+1) x K x F]. The last
+    feature is the codeword count, preceded by the sum of X (if
+    provided). Regions are then pooled in O(1) per box (region_lookup).
+
+    Note: Memory scales as (H/step) x (W/step) x K x F, use a
+    coarser step for VLAD/Fisher statistics.
+    """
+    H, W = shape[:2]
+    gh, gw = int(np.ceil(H * 1.0 / step)), int(np.ceil(W * 1.0 / step))
+    pts = np.asarray(pts)
+    cx = np.clip((pts[:,0] // step).astype(np.int64), 0, gw-1)
+    cy = np.clip((pts[:,1] // step).astype(np.int64), 0, gh-1)
+
+    G = gh * gw * K
+    groups = (cy * gw + cx) * K + codes
+    counts = np.bincount(groups, minlength=G).astype(np.float32)[:,np.newaxis]
+    stats = counts if X is None else \
+            np.hstack([_group_sums(groups, np.arange(len(codes)), G, X), counts])
+
+    integral = np.zeros((gh+1, gw+1, K, stats.shape[1]), dtype=np.float32)
+    integral[1:,1:] = stats.reshape(gh, gw, K, -1)
+    np.cumsum(integral, axis=0, out=integral)
+    np.cumsum(integral, axis=1, out=integral)
+    return integral
+
+def pyramid_bboxes(bboxes, levels=(1,)):
+    """
+    Split each box [x1,y1,x2,y2] into LxL sub-boxes, for
+    each pyramid level [B x cells x 4]
+    """
+    bboxes = np.float32(bboxes)
+    x1, y1, x2, y2 = [bboxes[:,j,np.newaxis] for j in range(4)]
+    sub = []
+    for L in levels:
+        t = np.arange(L + 1, dtype=np.float32) / L
+        xs, ys = x1 + (x2 + 1 - x1) * t, y1 + (y2 + 1 - y1) * t
+        for r in range(L):
+            for c in range(L):
+                sub.append(np.hstack([xs[:,c:c+1], ys[:,r:r+1], xs[:,c+1:c+2], ys[:,r+1:r+2]]))
+    return np.stack(sub, axis=1)
+
+def region_lookup(integral, bboxes, step=4):
+    """
+    Pool integral statistics within boxes [... x 4] with exclusive
+    right/bottom edges (see pyramid_bboxes), snapped to the cell
+    grid [... x K x F]
+    """
+    gh, gw = integral.shape[0]-1, integral.shape[1]-1
+    bboxes = np.asarray(bboxes, dtype=np.float32)
+    c0 = np.clip(np.round(bboxes[...,0] / step).astype(np.int64), 0, gw)
+    r0 = np.clip(np.round(bboxes[...,1] / step).astype(np.int64), 0, gh)
+    c1 = np.clip(np.round(bboxes[...,2] / step).astype(np.int64), 0, gw)
+    r1 = np.clip(np.round(bboxes[...,3] / step).astype(np.int64), 0, gh)
+    return integral[r1,c1] - integral[r0,c1] - integral[r1,c0] + integral[r0,c0]
+
+def _normalize_rows(V, eps=1e-12):
+    return V / (np.linalg.norm(V, axis=1)[:,np.newaxis] + eps)
+
+# =====================================================================
+# Vectorizer
+# ---------------------------------------------------------------------
+
+class BoWVectorizer(object):
+    """
+    Bag-of-words vectorizer with streaming mini-batch k-means
+    codebook training, and BoW, VLAD, and Fisher (lite) encoding
+    with spatial pyramid pooling
+
+        K:          Codebook size
+        method:     Encoding method {bow, vlad, fisher}
+        levels:     Spatial pyramid levels (LxL grids)
+        quantizer:  Codeword assignment {brute, kdtree}. For kdtree,
+                    eps > 0 allows (1+eps)-approximate assignment
+
+        bow = BoWVectorizer(K=256, method='vlad', levels=(1,2))
+        bow.build(desc for desc in descriptors)
+        code = bow.project(desc, pts=pts, shape=im.shape)
+
+    """
+    methods = ['bow', 'vlad', 'fisher']
+
+    def __init__(self, K=64, method='bow', levels=(1,),
+                 quantizer='brute', eps=0.0,
+                 batch_size=10000, max_per_item=None, seed=0):
+        if method not in BoWVectorizer.methods:
+            raise ValueError('Unknown encoding method {}, use from {}'
+                             .format(method, BoWVectorizer.methods))
+        if quantizer not in ('brute', 'kdtree'):
+            raise ValueError('Unknown quantizer {}, use from [brute, kdtree]'.format(quantizer))
+
+        self.K_ = K
+        self.method_ = method
+        self.levels_ = tuple(levels)
+        self.quantizer_ = quantizer
+        self.eps_ = eps
+        self.batch_size_ = max(batch_size, 3 * K)
+        self.max_per_item_ = max_per_item
+        self.seed_ = seed
+
+        self.codebook_ = None
+        self.variances_ = None
+        self.weights_ = None
+
+    @property
+    def dictionary_size(self):
+        return self.K_
+
+    @property
+    def codebook(self):
+        return self.codebook_
+
+    @property
+    def method(self):
+        return self.method_
+
+    @property
+    def levels(self):
+        return self.levels_
+
+    @property
+    def dimension(self):
+        ncells = sum(L * L for L in self.levels_)
+        D = self.codebook_.shape[1]
+        return ncells * self.K_ * {'bow': 1, 'vlad': D, 'fisher': 2 * D}[self.method_]
+
+    def build(self, data):
+        """
+        Build codebook from an in-memory [N x D] array, or an
+        iterable of descriptor arrays that is streamed through
+        mini-batch k-means (never held in memory at once)
+        """
+        max_per_item = self.max_per_item_
+        if isinstance(data, np.ndarray):
+            # Shuffled [batch_size x D] chunks of the (optionally
+            # subsampled) array, one partial_fit each
+            rng = np.random.RandomState(self.seed_)
+            inds = rng.permutation(len(data))[:max_per_item]
+            desc = data
+            data = (desc[inds[j:j+self.batch_size_]]
+                    for j in range(0, len(inds), self.batch_size_))
+            max_per_item = None
+
+        km = MiniBatchKMeans(n_clusters=self.K_, batch_size=self.batch_size_,
+                             random_state=self.seed_)
+
+        # Per-codeword counts, and sum of squared residuals (w.r.t
+        # the centers at the time each batch is seen) for fisher
+        counts = np.zeros(self.K_, dtype=np.float64)
+        sqres = None
+        for X in iter_minibatches(data, batch_size=self.batch_size_,
+                                  max_per_item=max_per_item, seed=self.seed_):
+            km.partial_fit(X)
+            C = km.cluster_centers_.astype(np.float32)
+            codes = nearest_codewords(X, C)
+            if sqres is None:
+                sqres = np.zeros(C.shape, dtype=np.float64)
+            counts += np.bincount(codes, minlength=self.K_)
+            sqres += _group_sums(codes, np.arange(len(X)), self.K_, (X - C[codes]) ** 2)
+
+        if sqres is None:
+            raise RuntimeError('{}: No descriptors provided to build codebook'
+                               .format(self.__class__.__name__))
+
+        self.codebook_ = km.cluster_centers_.astype(np.float32)
+        self.variances_ = np.float32(np.maximum(sqres / np.maximum(counts, 1)[:,np.newaxis], 1e-6))
+        self.weights_ = np.float32(np.maximum(counts / counts.sum(), 1e-6))
+        self._setup()
+        return self
+
+    def _setup(self):
+        self.codebook_sqnorm_ = np.sum(self.codebook_ ** 2, axis=1)
+        self.index_ = cKDTree(self.codebook_) if self.quantizer_ == 'kdtree' else None
+
+    def quantize(self, data):
+        """ Nearest codeword for each descriptor """
+        if self.codebook_ is None:
+            raise RuntimeError('Vocabulary not setup, build() first')
+        X = np.float32(data)
+        if self.index_ is not None:
+            _, codes = self.index_.query(X, k=1, eps=self.eps_)
+            return codes.astype(np.int64)
+        return nearest_codewords(X, self.codebook_, codebook_sqnorm=self.codebook_sqnorm_)
+
+    def project(self, data, pts=None, shape=None):
+        """
+        Encode descriptors [N x D] of a single image (with
+        spatial pyramid pooling, if pts and image shape provided)
+        """
+        X = np.float32(data)
+        codes = self.quantize(X)
+        if self.method_ == 'bow':
+            return bow_project(X, self.codebook_, pts=pts, shape=shape,
+                               levels=self.levels_, codes=codes)
+        elif self.method_ == 'vlad':
+            return vlad_project(X, self.codebook_, pts=pts, shape=shape,
+                                levels=self.levels_, codes=codes)
+        return fisher_project(X, self.codebook_, self.variances_, self.weights_,
+                              pts=pts, shape=shape, levels=self.levels_, codes=codes)
+
+    def project_batch(self, data, pts=None, shapes=None):
+        """
+        Encode descriptors of several images [B x dimension]
+        """
+        pts = [None] * len(data) if pts is None else pts
+        shapes = [None] * len(data) if shapes is None else shapes
+        return np.vstack([self.project(desc, pts=p, shape=shape)
+                          for desc, p, shape in zip(data, pts, shapes)])
+
+    def project_regions(self, data, pts, shape, bboxes, step=4):
+        """
+        Encode all boxes [B x 4] (e.g. ObjectProposal.process output)
+        of a single image [B x dimension]. Descriptors are quantized
+        once, and pooled per box via integral statistics over
+        [step x step] cells, instead of re-describing each crop.
+        """
+        X = np.float32(data)
+        K, D = self.codebook_.shape[:2]
+        B = len(bboxes)
+        if not B:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        codes = self.quantize(X)
+        if self.method_ == 'fisher':
+            R = (X - self.codebook_[codes]) / np.sqrt(self.variances_)[codes]
+            X = np.hstack([R, R ** 2])
+        integral = integral_statistics(codes, pts, shape, K, step=step,
+                                       X=None if self.method_ == 'bow' else X)
+
+        # [B x cells x K x F] pooled statistics
+        stats = region_lookup(integral, pyramid_bboxes(bboxes, levels=self.levels_), step=step)
+        counts = stats[...,-1]
+
+        if self.method_ == 'bow':
+            return _normalize_rows(np.sqrt(counts.reshape(B, -1)))
+
+        elif self.method_ == 'vlad':
+            V = stats[...,:D] - counts[...,np.newaxis] * self.codebook_
+            V /= (np.linalg.norm(V, axis=-1)[...,np.newaxis] + 1e-12)
+            return _normalize_rows(_power_normalize(V.reshape(B, -1)))
+
+        N = np.maximum(counts.reshape(B, -1).sum(axis=1) / len(self.levels_), 1)
+        N = N[:,np.newaxis,np.newaxis,np.newaxis]
+        w = self.weights_[:,np.newaxis]
+        S1 = stats[...,:D] / (N * np.sqrt(w))
+        S2 = (stats[...,D:2*D] - counts[...,np.newaxis]) / (N * np.sqrt(2 * w))
+        return _normalize_rows(_power_normalize(np.concatenate([S1, S2], axis=-1).reshape(B, -1)))
+
+    def to_dict(self):
+        return AttrDict(K=self.K_, method=self.method_, levels=np.int64(self.levels_),
+                        quantizer=self.quantizer_, eps=self.eps_,
+                        batch_size=self.batch_size_, seed=self.seed_,
+                        codebook=self.codebook_, variances=self.variances_,
+                        weights=self.weights_)
+
+    @classmethod
+    def from_dict(cls, db):
+        bow = cls(K=int(db.K), method=str(db.method), levels=tuple(int(L) for L in db.levels),
+                  quantizer=str(db.quantizer), eps=float(db.eps),
+                  batch_size=int(db.batch_size), seed=int(db.seed))
+        bow.codebook_ = np.float32(db.codebook)
+        bow.variances_ = np.float32(db.variances)
+        bow.weights_ = np.float32(db.weights)
+        bow._setup()
+        return bow
+
+    def save(self, fn):
+        self.to_dict().save(fn)
+
+    @classmethod
+    def load(cls, fn):
+        return cls.from_dict(AttrDict.load(fn))
@@ -37,6 +37,38 @@ def draw_features(im, pts, colors=None, size=2):
         # cv2.circle(out, tuple(map(int, pt)), size, tuple(col), -1, lineType=cv2.CV_AA)
     return out
 
+def splat_features(out, pts, colors, size=2): 
+    """
+    Draw filled square markers (similar to draw_features) in-place 
+    for all the points at once via array indexing, instead of 
+    issuing one cv2.rectangle per point. 
+
+    colors: [N x C] per-point colors, or a single [C] color
+    """
+    cols = np.asarray(colors)
+    per_point = cols.ndim > 1
+    valid = np.isfinite(pts).all(axis=1)
+    pts = pts[valid]
+    if per_point: 
+        cols = cols[valid]
+    if not len(pts): 
+        return out
+
+    H, W = out.shape[:2]
+    d = np.arange(-size, size+1)
+    xys = np.int64(pts)
+    xs, ys = np.broadcast_arrays((xys[:,0:1] + d)[:,np.newaxis,:], 
+                                 (xys[:,1:2] + d)[:,:,np.newaxis])
+    inside = (xs >= 0) & (xs < W) & (ys >= 0) & (ys < H)
+
+    if out.ndim == 2: 
+        cols = cols.max(axis=-1)
+    if per_point: 
+        cols = np.broadcast_to(cols.reshape((len(pts), 1, 1) + cols.shape[1:]), 
+                               xs.shape + cols.shape[1:])[inside]
+    out[ys[inside], xs[inside]] = cols
+    return out
+
 def draw_lines(im, pts1, pts2, colors=None, thickness=1): 
     out = to_color(im)
     cols = get_color(len(pts1), colors=colors)
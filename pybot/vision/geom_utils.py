@@ -72,6 +72,83 @@ def intersection_over_union(A,B):
     I, U = intersection_union(A, B)
     return I * 1.0 / U
 
+def intersection_union_matrix(bboxes1, bboxes2, offset=0): 
+    """
+    Pairwise intersection and union areas [N x M] of 
+    bboxes1 [N x 4] and bboxes2 [M x 4] (via broadcasting). 
+    Use offset=1 for inclusive pixel coordinates [x1,y1,x2,y2]
+    """
+    b1, b2 = np.asarray(bboxes1), np.asarray(bboxes2)
+    dtype = np.result_type(b1, b2, np.float32)
+    b1, b2 = b1.astype(dtype, copy=False).reshape(-1,4), b2.astype(dtype, copy=False).reshape(-1,4)
+    area1 = (b1[:,2]-b1[:,0]+offset) * (b1[:,3]-b1[:,1]+offset)
+    area2 = (b2[:,2]-b2[:,0]+offset) * (b2[:,3]-b2[:,1]+offset)
+    w = np.minimum(b1[:,np.newaxis,2], b2[np.newaxis,:,2]) - \
+        np.maximum(b1[:,np.newaxis,0], b2[np.newaxis,:,0]) + offset
+    h = np.minimum(b1[:,np.newaxis,3], b2[np.newaxis,:,3]) - \
+        np.maximum(b1[:,np.newaxis,1], b2[np.newaxis,:,1]) + offset
+    I = np.maximum(w, 0) * np.maximum(h, 0)
+    U = area1[:,np.newaxis] + area2[np.newaxis,:] - I
+    return I, U
+
+def intersection_over_union_matrix(bboxes1, bboxes2, chunk_size=2048, offset=0): 
+    """
+    Pairwise IoU [N x M] of bboxes1 [N x 4] and bboxes2 [M x 4], 
+    computed in chunks of bboxes1 to bound memory
+    """
+    dtype = np.result_type(np.asarray(bboxes1), np.asarray(bboxes2), np.float32)
+    A = np.zeros(shape=(len(bboxes1), len(bboxes2)), dtype=dtype)
+    for idx in range(0, len(bboxes1), chunk_size): 
+        I, U = intersection_union_matrix(bboxes1[idx:idx+chunk_size], bboxes2, offset=offset)
+        A[idx:idx+chunk_size] = I / np.maximum(U, np.finfo(dtype).eps)
+    return A
+
+def intersection_matrix(bboxes1, bboxes2, chunk_size=2048): 
+    """
+    Pairwise intersection areas [N x M], computed in chunks of bboxes1
+    """
+    A = np.zeros(shape=(len(bboxes1), len(bboxes2)), dtype=np.float32)
+    for idx in range(0, len(bboxes1), chunk_size): 
+        A[idx:idx+chunk_size], _ = intersection_union_matrix(bboxes1[idx:idx+chunk_size], bboxes2)
+    return A
+
+def equality_matrix(targets1, targets2): 
+    """ Pairwise target equality [N x M] """
+    return np.asarray(targets1)[:,np.newaxis] == np.asarray(targets2)[np.newaxis,:]
+
+def match_hungarian(A, threshold=0.5): 
+    """
+    Optimal one-to-one assignment maximizing the total 
+    score A [N x M] (e.g. IoU), retaining matches > threshold. 
+    Returns matched row and column indices. 
+    """
+    from scipy.optimize import linear_sum_assignment
+    if not A.size: 
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    rows, cols = linear_sum_assignment(-A)
+    valid = A[rows, cols] > threshold
+    return rows[valid].astype(np.int64), cols[valid].astype(np.int64)
+
+def match_greedy(A, threshold=0.5): 
+    """
+    Greedy one-to-one assignment in decreasing order of 
+    score A [N x M] (e.g. IoU), retaining matches > threshold. 
+    Returns matched row and column indices. 
+    """
+    rows, cols = np.where(A > threshold)
+    order = np.argsort(-A[rows, cols], kind='mergesort')
+    rows, cols = rows[order], cols[order]
+
+    row_used = np.zeros(A.shape[0], dtype=bool)
+    col_used = np.zeros(A.shape[1], dtype=bool)
+    keep = []
+    for idx, (r, c) in enumerate(zip(rows, cols)): 
+        if row_used[r] or col_used[c]: 
+            continue
+        row_used[r], col_used[c] = True, True
+        keep.append(idx)
+    return rows[keep].astype(np.int64), cols[keep].astype(np.int64)
+
 def brute_force_match(bboxes_truth, bboxes_test, 
                       match_func=lambda x,y: None, dtype=np.float32):
     A = np.zeros(shape=(len(bboxes_truth), len(bboxes_test)), dtype=dtype)
@@ -81,14 +158,13 @@ def brute_force_match(bboxes_truth, bboxes_test,
     return A
 
 def brute_force_match_coords(bboxes_truth, bboxes_test): 
-    return brute_force_match(bboxes_truth, bboxes_test, 
-                             match_func=lambda x,y: intersection_over_union(x['coords'], y['coords']),
-                             dtype=np.float32)
+    return intersection_over_union_matrix(
+        np.float32([x['coords'] for x in bboxes_truth]).reshape(-1,4), 
+        np.float32([y['coords'] for y in bboxes_test]).reshape(-1,4))
 
 def brute_force_match_target(bboxes_truth, bboxes_test): 
-    return brute_force_match(bboxes_truth, bboxes_test, 
-                             match_func=lambda x,y: x['target'] == y['target'], 
-                             dtype=np.bool)
+    return equality_matrix([x['target'] for x in bboxes_truth], 
+                           [y['target'] for y in bboxes_test]).reshape(len(bboxes_truth), len(bboxes_test))
 
 def match_targets(bboxes_truth, bboxes_test, intersection_th=0.5): 
     A = brute_force_match_coords(bboxes_truth, bboxes_test)
@@ -101,7 +177,6 @@ def match_bboxes(bboxes_truth, bboxes_test, intersection_th=0.5):
     return A > intersection_th
 
 def match_bboxes_and_targets(bboxes_truth, bboxes_test, targets_truth, targets_test, intersection_th=0.5):
-    A = brute_force_match(bboxes_truth, bboxes_test, match_func=intersection_over_union)
-    B = brute_force_match(targets_truth, targets_test, match_func=lambda x,y: x==y, dtype=np.bool)
+    A = intersection_over_union_matrix(bboxes_truth, bboxes_test)
+    B = equality_matrix(targets_truth, targets_test).reshape(A.shape)
     return np.bitwise_and(A > intersection_th, B)
-    
@@ -1,6 +1,8 @@
 # Author: Sudeep Pillai <spillai@csail.mit.edu>
 # License: MIT
 
+import os
+
 import cv2
 import numpy as np
 from collections import deque
@@ -20,6 +22,96 @@ def im_resize(im, shape=None, scale=1.0, interpolation=cv2.INTER_AREA):
             shape = (int(im.shape[1]*scale), int(im.shape[0]*scale))
             return im_resize(im, shape)
 
+# Reduced-resolution decoding (OpenCV >= 3.2), keyed by reduction factor
+IMREAD_REDUCED = { 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                   4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                   8: cv2.IMREAD_REDUCED_GRAYSCALE_8 } \
+                   if hasattr(cv2, 'IMREAD_REDUCED_GRAYSCALE_2') else {}
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg', '.jpe')
+
+def jpeg_shape(buf):
+    """
+    Image (height, width) from the JPEG header (SOFn marker),
+    or None if buf is not a JPEG
+    """
+    buf = np.asarray(buf, dtype=np.uint8).ravel()
+    if len(buf) < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+    pos, n = 2, len(buf)
+    while pos + 9 < n:
+        if buf[pos] != 0xFF:
+            return None
+        marker = buf[pos+1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h = (int(buf[pos+5]) << 8) | int(buf[pos+6])
+            w = (int(buf[pos+7]) << 8) | int(buf[pos+8])
+            return h, w
+        pos += 2 + ((int(buf[pos+2]) << 8) | int(buf[pos+3]))
+    return None
+
+def im_reduced_flags(scale=1.0, flags=cv2.IMREAD_UNCHANGED):
+    """
+    Returns the imdecode flags that decode a JPEG directly at
+    reduced resolution (1/2, 1/4, 1/8, via DCT scaling), and the
+    residual scale left to im_resize.
+
+    IMREAD_UNCHANGED is decoded as ANYDEPTH | ANYCOLOR (ignoring
+    the EXIF orientation) when reduced.
+    """
+    for factor, reduced in IMREAD_REDUCED.items():
+        if np.fabs(scale * factor - 1.0) < 1e-6:
+            if flags == cv2.IMREAD_UNCHANGED:
+                flags = cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR | \
+                        getattr(cv2, 'IMREAD_IGNORE_ORIENTATION', 0)
+            return flags | reduced, 1.0
+    return flags, scale
+
+def im_read(fn, scale=1.0, flags=cv2.IMREAD_UNCHANGED,
+            interpolation=cv2.INTER_AREA, reduced=True):
+    """
+    Read image at scale, JPEGs are decoded at reduced
+    resolution if possible (see im_decode)
+    """
+    if reduced and len(IMREAD_REDUCED) and \
+       os.path.splitext(fn)[1].lower() in JPEG_EXTENSIONS:
+        try:
+            buf = np.fromfile(fn, dtype=np.uint8)
+        except (IOError, OSError):
+            return None
+        return im_decode(buf, scale=scale, flags=flags,
+                         interpolation=interpolation, reduced=reduced)
+
+    im = cv2.imread(fn, flags)
+    return im_resize(im, scale=scale, interpolation=interpolation) \
+        if im is not None else None
+
+def im_decode(buf, scale=1.0, flags=cv2.IMREAD_UNCHANGED,
+              interpolation=cv2.INTER_AREA, reduced=True):
+    """
+    Decode image buffer at scale. JPEGs with scale 1/2, 1/4 or 1/8
+    are decoded at reduced resolution, and cropped to the shape
+    im_resize would return. Other images are decoded and resized
+    with im_resize.
+    """
+    shape = jpeg_shape(buf) if reduced else None
+    if shape is not None:
+        rflags, rscale = im_reduced_flags(scale, flags)
+        if rscale == 1.0:
+            im = cv2.imdecode(buf, rflags)
+            if im is None:
+                return None
+            h, w = int(np.rint(shape[0] * scale)), int(np.rint(shape[1] * scale))
+            return im[:h,:w] if im.shape[0] >= h and im.shape[1] >= w \
+                else im_resize(im, shape=(w, h), interpolation=interpolation)
+
+    im = cv2.imdecode(buf, flags)
+    return im_resize(im, scale=scale, interpolation=interpolation) \
+        if im is not None else None
+
 def im_pad(im, pad=3, value=0): 
     return cv2.copyMakeBorder(im, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value)
 
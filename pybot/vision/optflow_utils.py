@@ -3,42 +3,232 @@
 
 import cv2
 import numpy as np
+from threading import Thread
+from multiprocessing.pool import ThreadPool
 
-from pybot.vision.image_utils import to_gray, to_color
+from pybot.vision.image_utils import to_gray, to_color, im_resize
 from pybot.vision.camera_utils import Camera, CameraIntrinsic, CameraExtrinsic
+from pybot.geometry.rigid_transform import RigidTransform
+
+# Cached [H x W x 2] pixel coordinate grids, keyed by (H, W)
+_coordinate_grids = {}
+
+def coordinate_grid(shape): 
+    """
+    Returns the (cached, read-only) [H x W x 2] float32 grid 
+    of pixel coordinates (x, y) for the given image shape
+    """
+    H, W = shape[:2]
+    try: 
+        return _coordinate_grids[(H, W)]
+    except KeyError: 
+        xs, ys = np.meshgrid(np.arange(W, dtype=np.float32), 
+                             np.arange(H, dtype=np.float32))
+        grid = np.dstack([xs, ys])
+        grid.setflags(write=False)
+        _coordinate_grids[(H, W)] = grid
+        return grid
+
+def farneback_flow(im1, im2, pyr_scale=0.5, levels=3, winsize=5, 
+                   iterations=3, poly_n=5, poly_sigma=1.2, flow=None): 
+    """
+    Farneback flow from im1 to im2, optionally warm-started 
+    with the provided initial flow (keyword arguments, as the 
+    position of flow differs across OpenCV versions)
+    """
+    params = dict(pyr_scale=pyr_scale, levels=levels, winsize=winsize, 
+                  iterations=iterations, poly_n=poly_n, poly_sigma=poly_sigma)
+    if flow is None: 
+        return cv2.calcOpticalFlowFarneback(im1, im2, flow=None, flags=0, **params)
+    return cv2.calcOpticalFlowFarneback(im1, im2, flow=np.float32(flow).copy(), 
+                                        flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **params)
+
+def fb_inconsistent(fflow, rflow, fb_threshold): 
+    """
+    Forward-backward flow check, returns the [H x W] mask 
+    of pixels whose round-trip exceeds fb_threshold
+    """
+    xys1 = coordinate_grid(fflow.shape)
+    xys2 = xys1 + fflow
+    xys1r = xys2 + rflow
+    return (np.fabs(xys1r - xys1) > fb_threshold).all(axis=2)
 
 def dense_optical_flow(im1, im2, pyr_scale=0.5, levels=3, winsize=5, 
                        iterations=3, poly_n=5, poly_sigma=1.2, fb_threshold=-1, 
                        mask1=None, mask2=None, 
                        flow1=None, flow2=None): 
+    """
+    Dense (Farneback) flow from im1 to im2. 
+
+    flow1, flow2: Optional initial forward (im1->im2) and 
+                  backward (im2->im1) flow estimates
+    fb_threshold: If > 0, the forward and backward flows are 
+                  computed concurrently, and inconsistent flow is NaN'd
 
-    if flow1 is None: 
-        fflow = cv2.calcOpticalFlowFarneback(to_gray(im1), to_gray(im2), pyr_scale, levels, winsize, 
-                                             iterations, poly_n, poly_sigma, 0)
-    else: 
-        fflow = cv2.calcOpticalFlowFarneback(to_gray(im1), to_gray(im2), pyr_scale, levels, winsize, 
-                                             iterations, poly_n, poly_sigma, 0, flow1.copy())
+    For streams, see DenseOpticalFlow (that owns its thread pool)
+    """
+    params = dict(pyr_scale=pyr_scale, levels=levels, winsize=winsize, 
+                  iterations=iterations, poly_n=poly_n, poly_sigma=poly_sigma)
+    gim1, gim2 = to_gray(im1), to_gray(im2)
+
+    # Backward flow in a separate thread
+    if fb_threshold > 0: 
+        rflows = []
+        t = Thread(target=lambda: rflows.append(
+            farneback_flow(gim2, gim1, flow=flow2, **params)))
+        t.start()
+    fflow = farneback_flow(gim1, gim2, flow=flow1, **params)
 
     if mask1 is not None: 
-        fflow[~mask1.astype(np.bool)] = np.nan
+        fflow[~mask1.astype(bool)] = np.nan
 
     if fb_threshold > 0: 
-        H, W = im1.shape[:2]
-        xs, ys = np.meshgrid(np.arange(W), np.arange(H))
-        xys1 = np.dstack([xs, ys])
-        xys2 = xys1 + fflow
-        rflow = dense_optical_flow(im2, im1, pyr_scale=pyr_scale, levels=levels, 
-                                   winsize=winsize, iterations=iterations, poly_n=poly_n, 
-                                   poly_sigma=poly_sigma, fb_threshold=-1)
+        t.join()
+        rflow, = rflows
         if mask2 is not None: 
-            rflow[~mask2.astype(np.bool)] = np.nan
-
-        xys1r = xys2 + rflow
-        fb_bad = (np.fabs(xys1r - xys1) > fb_threshold).all(axis=2)
-        fflow[fb_bad] = np.nan
+            rflow[~mask2.astype(bool)] = np.nan
+        fflow[fb_inconsistent(fflow, rflow, fb_threshold)] = np.nan
 
     return fflow
- 
+
+
+class DenseOpticalFlow(object): 
+    """
+    Dense (Farneback) optical flow engine for image streams
+
+        scale:          Compute flow on images downscaled by scale, 
+                        and upsample the flow to full resolution
+        tiles:          (rows, cols) tiles that are computed concurrently, 
+                        each padded with overlap pixels of context
+        fb_threshold:   If > 0, forward and backward flow are computed 
+                        concurrently, and inconsistent flow is NaN'd
+        warm_start:     Initialize flow from the previous frame's flow
+
+        flow = DenseOpticalFlow(scale=0.5, fb_threshold=2)
+        for im in images: 
+            f = flow.process(im)  # None for the first frame
+
+    """
+    def __init__(self, pyr_scale=0.5, levels=3, winsize=5, 
+                 iterations=3, poly_n=5, poly_sigma=1.2, 
+                 fb_threshold=-1, scale=1.0, tiles=(1,1), overlap=16, 
+                 warm_start=True, num_workers=None): 
+        self.params_ = dict(pyr_scale=pyr_scale, levels=levels, winsize=winsize, 
+                            iterations=iterations, poly_n=poly_n, poly_sigma=poly_sigma)
+        self.fb_threshold_ = fb_threshold
+        self.scale_ = scale
+        self.tiles_ = tiles
+        self.overlap_ = overlap
+        self.warm_start_ = warm_start
+
+        # Forward and backward passes over all tiles run concurrently
+        njobs = tiles[0] * tiles[1] * (2 if fb_threshold > 0 else 1)
+        self.pool_ = ThreadPool(processes=num_workers if num_workers is not None else njobs)
+
+        self.reset()
+
+    def __del__(self): 
+        self.close()
+
+    def close(self): 
+        if getattr(self, 'pool_', None) is not None: 
+            self.pool_.close()
+            self.pool_.join()
+            self.pool_ = None
+
+    def reset(self): 
+        self.im_ = None
+        self.fflow_, self.rflow_ = None, None
+
+    def preprocess(self, im): 
+        return im_resize(to_gray(im), scale=self.scale_)
+
+    def tile_bounds(self, shape): 
+        """
+        Returns the (interior, padded) [y0, y1, x0, x1] bounds of each tile
+        """
+        H, W = shape[:2]
+        ys = np.linspace(0, H, self.tiles_[0] + 1).astype(np.int64)
+        xs = np.linspace(0, W, self.tiles_[1] + 1).astype(np.int64)
+        o = self.overlap_
+        return [((y0, y1, x0, x1), 
+                 (max(y0-o, 0), min(y1+o, H), max(x0-o, 0), min(x1+o, W)))
+                for y0, y1 in zip(ys[:-1], ys[1:])
+                for x0, x1 in zip(xs[:-1], xs[1:])]
+
+    def _flow(self, args): 
+        im1, im2, flow = args
+        return farneback_flow(im1, im2, flow=flow, **self.params_)
+
+    def _submit(self, im1, im2, flow, bounds): 
+        jobs = []
+        for _, (py0, py1, px0, px1) in bounds: 
+            jobs.append(self.pool_.apply_async(self._flow, [(
+                np.ascontiguousarray(im1[py0:py1, px0:px1]), 
+                np.ascontiguousarray(im2[py0:py1, px0:px1]), 
+                flow[py0:py1, px0:px1] if flow is not None else None)]))
+        return jobs
+
+    def _stitch(self, jobs, bounds, shape): 
+        flow = np.empty(shape[:2] + (2,), dtype=np.float32)
+        for job, ((y0, y1, x0, x1), (py0, _, px0, _)) in zip(jobs, bounds): 
+            flow[y0:y1, x0:x1] = job.get()[y0-py0:y1-py0, x0-px0:x1-px0]
+        return flow
+
+    def upsample(self, flow, shape): 
+        """ Upsample flow to full resolution (rescaling its magnitude) """
+        if np.fabs(self.scale_-1.0) < 1e-2: 
+            return flow
+        H, W = shape[:2]
+        return cv2.resize(flow, (W, H), interpolation=cv2.INTER_LINEAR) * (1.0 / self.scale_)
+
+    def compute(self, im1, im2, flow1=None, flow2=None): 
+        """
+        Compute the (full-resolution) flow from im1 to im2. 
+        flow1, flow2 are optional initial forward and backward 
+        flow at the computation scale. 
+
+        Returns the full-resolution forward flow, and the forward 
+        and backward flow at computation scale
+        """
+        shape = im1.shape[:2]
+        gim1, gim2 = self.preprocess(im1), self.preprocess(im2)
+        return self._compute(gim1, gim2, shape, flow1=flow1, flow2=flow2)
+
+    def _compute(self, gim1, gim2, shape, flow1=None, flow2=None): 
+        bounds = self.tile_bounds(gim1.shape)
+        fjobs = self._submit(gim1, gim2, flow1, bounds)
+        rjobs = self._submit(gim2, gim1, flow2, bounds) if self.fb_threshold_ > 0 else None
+
+        fflow = self._stitch(fjobs, bounds, gim1.shape)
+        rflow = self._stitch(rjobs, bounds, gim1.shape) if rjobs is not None else None
+
+        flow = fflow.copy()
+        if rflow is not None: 
+            flow[fb_inconsistent(fflow, rflow, self.fb_threshold_ * self.scale_)] = np.nan
+        return self.upsample(flow, shape), fflow, rflow
+
+    def process(self, im): 
+        """
+        Compute the flow from the previous image to the provided image
+        (warm-started with the previous frame's flow)
+        """
+        gim = self.preprocess(im)
+        if self.im_ is None or self.im_.shape != gim.shape: 
+            self.reset()
+            self.im_ = gim
+            return None
+
+        flow1, flow2 = (self.fflow_, self.rflow_) if self.warm_start_ else (None, None)
+        flow, self.fflow_, self.rflow_ = self._compute(self.im_, gim, im.shape[:2], 
+                                                       flow1=flow1, flow2=flow2)
+        self.im_ = gim
+        return flow
+
+    @property
+    def flow(self): 
+        return self.fflow_
+
 def dense_optical_flow_sf(im1, im2, layers=3, averaging_block_size=2, max_flow=4): 
     flow = np.zeros((im1.shape[0], im1.shape[1], 2))
     cv2.calcOpticalFlowSF(im1, im2, flow, layers, averaging_block_size, max_flow)
@@ -95,11 +285,8 @@ def draw_hsv(flow, scale=2):
     return bgr
 
 def warp_flow(img, flow):
-    h, w = flow.shape[:2]
-    flow = -flow
-    flow[:,:,0] += np.arange(w)
-    flow[:,:,1] += np.arange(h)[:,np.newaxis]
-    res = cv2.remap(img, flow, None, cv2.INTER_LINEAR)
+    xys = coordinate_grid(flow.shape) - flow
+    res = cv2.remap(img, xys.astype(np.float32), None, cv2.INTER_LINEAR)
     return res
 
 def test_flow(img1, img2): 
@@ -115,6 +302,19 @@ class SceneFlow(object):
     """
     Computes the scene flow vectors given relative pose and scene depth
     (Note: assuming static scenes)
+
+    Per-pixel (undistorted) rays are computed once and cached, and 
+    points are projected in float with the camera's K and D directly 
+    (without the cv2.projectPoints round trip). Cameras with rational/
+    thin-prism distortion (non-zero coefficients beyond k3) are 
+    projected with cv2.projectPoints instead. 
+
+        sf = SceneFlow(cam)
+        flow = sf.flow(p_21, depth1)               # [H x W x 2]
+        flows = sf.flow_batch(poses_21, depths1)   # [B x H x W x 2]
+
+    where p_21 transforms points from the first camera frame into
+    the second camera frame (X_2 = p_21 * X_1).
     """
     def __init__(self, cam):
         assert(cam.shape is not None)
@@ -123,10 +323,103 @@ class SceneFlow(object):
         
         self.xs_, self.ys_ = np.meshgrid(np.arange(0,W), np.arange(0,H))
         self.grid_ = np.dstack([self.xs_,self.ys_]).astype(np.float32)
+
+        # Cached per-pixel rays [H x W x 3] (with z=1)
+        self.rays_ = self.cam_.ray(self.grid_.reshape(-1,2), undistort=True)\
+                              .reshape(H,W,3).astype(np.float32)
+        D = np.ravel(self.cam_.D)
+        self.distorted_ = np.fabs(D).max() > 0
+        self.rational_ = D.size > 5 and np.fabs(D[5:]).max() > 0
+
+    @property
+    def rays(self): 
+        return self.rays_
+
+    def project(self, X, min_depth=0.1): 
+        """
+        Project [... x 3] points onto the image plane [... x 2] in float, 
+        points with depth below min_depth are NaN
+        """
+        Z = X[...,2]
+        valid = Z >= min_depth
+        if self.rational_: 
+            x = np.full(X.shape[:-1] + (2,), np.nan, dtype=np.float32)
+            if valid.any(): 
+                proj, _ = cv2.projectPoints(np.float64(X[valid]).reshape(-1,1,3), 
+                                            np.zeros(3), np.zeros(3), 
+                                            self.cam_.K, np.ravel(self.cam_.D))
+                x[valid] = proj.reshape(-1,2)
+            return x
+
+        with np.errstate(invalid='ignore', divide='ignore'): 
+            x, y = X[...,0] / Z, X[...,1] / Z
+        x[~valid], y[~valid] = np.nan, np.nan
+
+        # Apply distortion (k1, k2, p1, p2, k3), zero-padded
+        if self.distorted_: 
+            D = np.zeros(5)
+            D[:min(5, self.cam_.D.size)] = np.ravel(self.cam_.D)[:5]
+            k1, k2, p1, p2, k3 = D
+            r2 = x * x + y * y
+            radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+            x, y = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x), \
+                   y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+
+        K = self.cam_.K
+        return np.stack([K[0,0] * x + K[0,1] * y + K[0,2], 
+                         K[1,1] * y + K[1,2]], axis=-1).astype(np.float32)
+
+    def flow_batch(self, poses, depths, check_bounds=True, min_depth=0.1): 
+        """
+        Computes the (subpixel) forward flow at each pixel of the 
+        first frame, for a batch of relative poses and depth maps. 
+
+        poses:  B relative poses p_21 (RigidTransforms, or [B x 4 x 4])
+        depths: [B x H x W] depth maps of the first frame
+
+        Returns [B x H x W x 2] flow, NaN for invalid depths, 
+        and points that project out of the image (if check_bounds)
+        """
+        depths = np.asarray(depths, dtype=np.float32)
+        if depths.ndim == 2: 
+            depths = depths[np.newaxis]
+        if depths.shape[1:] != self.rays_.shape[:2]: 
+            raise ValueError('''depth shape does not agree with cam.shape, '''
+                             '''depths.shape needs to be [B x H x W] '''
+                             '''depths: {}, cam.shape: {}'''.format(depths.shape, self.cam_.shape[:2]))
+
+        T = np.float32([p.matrix if isinstance(p, RigidTransform) else p for p in poses])
+        if len(T) != len(depths): 
+            raise ValueError('Number of poses ({}) and depths ({}) do not agree'
+                             .format(len(T), len(depths)))
+
+        # Reconstruct, transform, and project
+        X1 = self.rays_[np.newaxis] * depths[..., np.newaxis]
+        X2 = np.einsum('bij,bhwj->bhwi', T[:,:3,:3], X1) + T[:,np.newaxis,np.newaxis,:3,3]
+        x2 = self.project(X2, min_depth=min_depth)
+
+        if check_bounds: 
+            H, W = self.rays_.shape[:2]
+            with np.errstate(invalid='ignore'): 
+                valid = (x2[...,0] >= 0) & (x2[...,0] <= W-1) & \
+                        (x2[...,1] >= 0) & (x2[...,1] <= H-1)
+            x2[~valid] = np.nan
+
+        return x2 - self.grid_
+
+    def flow(self, pose, depth, check_bounds=True, min_depth=0.1): 
+        """
+        Computes the (subpixel) forward flow [H x W x 2] at each pixel
+        of the first frame given relative pose p_21 and its depth map
+        """
+        return self.flow_batch([pose], depth[np.newaxis], 
+                               check_bounds=check_bounds, min_depth=min_depth)[0]
         
     def process(self, dX):
         """
-        
+        Computes the flow (in the second frame) given the 
+        [H x W x 3] scene points of the first frame expressed 
+        in the second camera frame 
         """
         if (np.int32(dX.shape[:2]) != self.cam_.shape[:2]).any():
             raise ValueError('''dX shape does not agree with cam.shape, '''
@@ -134,18 +427,19 @@ class SceneFlow(object):
                              '''dX: {}, cam.shape: {}'''.format(np.int32(dX.shape[:2]), self.cam_.shape[:2]))
         
         # Project scene points 
-        x2 = self.cam_.project(dX.reshape(-1,3)).astype(np.int32)
+        x2 = self.project(dX.reshape(-1,3))
         
         # Only return points within-image bounds
-        valid = np.bitwise_and(
+        with np.errstate(invalid='ignore'): 
+            valid = np.bitwise_and(
                 np.bitwise_and(x2[:,0] >= 0, x2[:,0] < self.cam_.shape[1]), \
                 np.bitwise_and(x2[:,1] >= 0, x2[:,1] < self.cam_.shape[0]))
-        xs, ys = x2[:,0], x2[:,1]
+        xs, ys = x2[valid,0].astype(np.int32), x2[valid,1].astype(np.int32)
 
         # Compare against expected image points based on VO
-        gxs, gys = self.xs_.ravel(), self.ys_.ravel()
+        gxs, gys = self.xs_.ravel()[valid], self.ys_.ravel()[valid]
         new_grid = np.copy(self.grid_) * np.nan
-        new_grid[ys[valid], xs[valid]] = self.grid_[gys[valid], gxs[valid]]
+        new_grid[ys, xs] = self.grid_[gys, gxs]
 
         return new_grid - self.grid_
 
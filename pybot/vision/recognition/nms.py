@@ -6,6 +6,7 @@
 # --------------------------------------------------------
 
 import numpy as np
+from pybot.vision.geom_utils import intersection_over_union_matrix
 
 def nms(dets, thresh):
     x1 = dets[:, 0]
@@ -35,3 +36,109 @@ def nms(dets, thresh):
         order = order[inds + 1]
 
     return keep
+
+# --------------------------------------------------------
+# Vectorized, batched and soft NMS
+# --------------------------------------------------------
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Pairwise IoU [N x M] of boxes [x1,y1,x2,y2] (inclusive
+    pixel coordinates, as in nms)
+    """
+    return intersection_over_union_matrix(boxes_a, boxes_b, offset=1)
+
+def nms_blocked(dets, thresh, top_k=None, block_size=512):
+    """
+    Greedy NMS over score-sorted blocks of boxes. Each block is
+    first suppressed against all boxes kept so far with a single
+    IoU matrix, and then greedily within the block using its
+    (block_size x block_size) IoU matrix. Stops once top_k boxes
+    are kept. Returns the same indices as nms(dets, thresh).
+    """
+    dets = np.asarray(dets)
+    dets = dets.astype(np.result_type(dets, np.float32), copy=False)
+    if not len(dets):
+        return np.empty(0, dtype=np.int64)
+    order = dets[:, 4].argsort()[::-1]
+    boxes = dets[order, :4]
+    top_k = len(order) if top_k is None else top_k
+
+    keep = np.empty(0, dtype=np.int64)
+    for s in range(0, len(order), block_size):
+        if len(keep) >= top_k:
+            break
+        e = min(s + block_size, len(order))
+
+        # Suppress block against previously kept boxes
+        alive = np.ones(e - s, dtype=bool)
+        if len(keep):
+            alive &= ~(iou_matrix(boxes[keep], boxes[s:e]) > thresh).any(axis=0)
+
+        # Greedy suppression within the block
+        inds, = np.where(alive)
+        ovr = iou_matrix(boxes[s+inds], boxes[s+inds]) > thresh
+        suppressed = np.zeros(len(inds), dtype=bool)
+        kept = []
+        for j in range(len(inds)):
+            if suppressed[j]:
+                continue
+            kept.append(j)
+            if len(keep) + len(kept) >= top_k:
+                break
+            suppressed[j+1:] |= ovr[j, j+1:]
+        keep = np.r_[keep, s + inds[kept]]
+
+    return order[keep[:top_k]]
+
+def batched_nms(dets, labels, thresh, top_k=None, block_size=512):
+    """
+    Per-class NMS in a single pass, by offsetting the boxes of each
+    class such that boxes of different classes never overlap
+    (in float64, so that large offsets do not lose precision)
+    """
+    dets = np.array(dets, dtype=np.float64)
+    if not len(dets):
+        return np.empty(0, dtype=np.int64)
+    labels = np.asarray(labels)
+    _, labels = np.unique(labels, return_inverse=True)
+    offset = dets[:, :4].max() - min(dets[:, :4].min(), 0) + 2
+    dets[:, :4] += (labels * offset)[:, np.newaxis]
+    return nms_blocked(dets, thresh, top_k=top_k, block_size=block_size)
+
+def soft_nms(dets, thresh=0.3, sigma=0.5, score_thresh=0.001, method='linear', top_k=None):
+    """
+    Soft-NMS (Bodla et al. 2017): decays the scores of boxes overlapping
+    the current maximum, either linearly (1 - IoU, for IoU > thresh),
+    or with a gaussian penalty exp(-IoU^2 / sigma). Boxes whose score
+    falls below score_thresh are dropped. Returns the indices of the
+    kept boxes, and their rescored values.
+    """
+    if method not in ('linear', 'gaussian'):
+        raise ValueError('Unknown soft-nms method %s, use linear/gaussian' % method)
+
+    dets = np.asarray(dets, dtype=np.float32)
+    boxes = dets[:, :4]
+    scores = dets[:, 4].copy()
+    top_k = len(dets) if top_k is None else top_k
+
+    remaining, = np.where(scores > score_thresh)
+    keep, kept_scores = [], []
+    while len(remaining) and len(keep) < top_k:
+        j = np.argmax(scores[remaining])
+        i = remaining[j]
+        keep.append(i)
+        kept_scores.append(scores[i])
+        remaining = np.delete(remaining, j)
+        if not len(remaining):
+            break
+
+        ovr = iou_matrix(boxes[i:i+1], boxes[remaining])[0]
+        if method == 'linear':
+            decay = np.where(ovr > thresh, 1 - ovr, 1)
+        else:
+            decay = np.exp(-(ovr * ovr) / sigma)
+        scores[remaining] *= decay
+        remaining = remaining[scores[remaining] > score_thresh]
+
+    return np.int64(keep), np.float32(kept_scores)
@@ -7,12 +7,16 @@ Object Recognition utilities
 import os
 import cv2
 import time
+import hashlib
+import json
 import pprint
 import datetime
 import pandas as pd
 
 import numpy as np
 from itertools import chain
+from collections import deque
+from multiprocessing import Pool
 
 import sklearn.metrics as metrics
 from sklearn.svm import LinearSVC, SVC
@@ -23,13 +27,13 @@ from sklearn.cross_validation import train_test_split, ShuffleSplit
 
 from pybot.utils.plot_utils import plt
 from pybot.utils.misc import print_yellow
-from pybot.vision.geom_utils import brute_force_match, intersection_over_union
+from pybot.vision.geom_utils import intersection_over_union_matrix
 from pybot.vision.image_utils import im_resize, gaussian_blur, median_blur, box_blur
 from pybot.utils.io_utils import memory_usage_psutil, format_time
 from pybot.utils.db_utils import AttrDict, IterDB
-from pybot.utils.itertools_recipes import chunks
+from pybot.utils.itertools_recipes import chunks, prefetch
 
-from pybot.vision.feature_detection import get_dense_detector, get_detector
+from pybot.vision.feature_detection import get_dense_detector, get_detector, to_pts
 
 # =====================================================================
 # Generic utility functions for object detection
@@ -44,16 +48,218 @@ def recall_from_IoU(IoU, samples=500):
         raise ValueError('IoU needs to be a list or 1-D')
     iou = np.float32(IoU)
 
-    # Plot intersection over union
+    # Plot intersection over union: fraction of iou >= threshold
+    # for all thresholds, via a single sort
     IoU_thresholds = np.linspace(0.0, 1.0, samples)
-    recall = np.zeros_like(IoU_thresholds)
-    for idx, IoU_th in enumerate(IoU_thresholds):
-        tp, relevant = 0, 0
-        inds, = np.where(iou >= IoU_th)
-        recall[idx] = len(inds) * 1.0 / len(IoU)
+    below = np.searchsorted(np.sort(iou), IoU_thresholds, side='left')
+    recall = (len(iou) - below) * 1.0 / len(iou)
 
     return recall, IoU_thresholds 
 
+class DetectionEvaluator(object): 
+    """
+    Streaming detection evaluation (VOC/COCO-style AP) that ingests
+    per-image detections and ground truth incrementally, matches 
+    them at multiple IoU thresholds, and accumulates per-class
+    (score, true-positive) statistics. 
+
+        evaluator = DetectionEvaluator(iou_thresholds=np.linspace(0.5, 0.95, 10))
+        for im, gt_bboxes, gt_targets in db.roidb(target_hash): 
+            bboxes, scores, targets = detect(im)
+            evaluator.add(bboxes, scores, targets, gt_bboxes, gt_targets)
+        mAP, ap = evaluator.mean_average_precision()
+
+    Detections are greedily matched (in decreasing score) to the
+    unmatched ground truth box of highest IoU (COCO-style), and
+    detections matched to ignored (difficult) boxes are discarded. 
+    
+        iou_thresholds:  IoU thresholds to evaluate at [T]
+        num_bins:        If provided, scores are accumulated into 
+                         num_bins histogram bins within score_range, 
+                         (constant memory per class), otherwise all 
+                         scores are retained (exact)
+        ap_method:       'area' (all-point interpolated, VOC2010+), 
+                         'coco' (101-point), or 'voc07' (11-point)
+    """
+    def __init__(self, iou_thresholds=(0.5,), num_bins=None, score_range=(0., 1.), 
+                 ap_method='area'): 
+        if ap_method not in ('area', 'coco', 'voc07'): 
+            raise ValueError('Unknown ap_method {}, use area/coco/voc07'.format(ap_method))
+        self.iou_thresholds_ = np.float32(iou_thresholds).ravel()
+        self.num_bins_ = num_bins
+        self.score_range_ = score_range
+        self.ap_method_ = ap_method
+        self.reset()
+
+    def reset(self): 
+        self.classes_ = {}
+        self.num_images_ = 0
+
+    def _class_stats(self, target): 
+        try: 
+            return self.classes_[target]
+        except KeyError: 
+            T = len(self.iou_thresholds_)
+            if self.num_bins_ is None: 
+                stats = AttrDict(npos=0, scores=[], tps=[])
+            else: 
+                stats = AttrDict(npos=0, 
+                                 tp=np.zeros((T, self.num_bins_), dtype=np.int64), 
+                                 fp=np.zeros((T, self.num_bins_), dtype=np.int64))
+            self.classes_[target] = stats
+            return stats
+
+    @property
+    def iou_thresholds(self): 
+        return self.iou_thresholds_
+
+    @property
+    def targets(self): 
+        return sorted(self.classes_.keys())
+
+    @property
+    def num_images(self): 
+        return self.num_images_
+
+    def match(self, bboxes, scores, gt_bboxes, gt_ignore=None): 
+        """
+        Match detections (of a single class) to ground truth at all 
+        IoU thresholds. Returns the true-positive mask [D x T], and 
+        the mask of detections matched to ignored boxes [D x T]
+        """
+        T, D, G = len(self.iou_thresholds_), len(bboxes), len(gt_bboxes)
+        tp = np.zeros((D, T), dtype=bool)
+        ignored = np.zeros((D, T), dtype=bool)
+        if not D or not G: 
+            return tp, ignored
+
+        gt_ignore = np.zeros(G, dtype=bool) if gt_ignore is None else np.asarray(gt_ignore, dtype=bool)
+        iou = intersection_over_union_matrix(bboxes, gt_bboxes)
+
+        # Visit detections in decreasing score, matching all thresholds
+        # at once. Prefer non-ignored ground truth. 
+        thresholds = self.iou_thresholds_[:,np.newaxis]
+        matched = np.zeros((T, G), dtype=bool)
+        rT = np.arange(T)
+        for d in np.argsort(-np.asarray(scores), kind='mergesort'): 
+            valid = (iou[d][np.newaxis,:] >= thresholds) & ~matched
+            cand = np.where(valid, iou[d][np.newaxis,:] + (~gt_ignore) * 2., -1.)
+            j = np.argmax(cand, axis=1)
+            ok = cand[rT, j] >= 0
+            matched[rT[ok], j[ok]] = True
+            tp[d] = ok & ~gt_ignore[j]
+            ignored[d] = ok & gt_ignore[j]
+        return tp, ignored
+
+    def add(self, bboxes, scores, targets, gt_bboxes, gt_targets, gt_ignore=None): 
+        """
+        Ingest detections [D x 4] with scores [D] and targets [D], 
+        and ground truth [G x 4] with targets [G] of a single image
+        """
+        bboxes, scores, targets = np.asarray(bboxes).reshape(-1,4), \
+                                  np.float32(scores).ravel(), np.asarray(targets).ravel()
+        gt_bboxes, gt_targets = np.asarray(gt_bboxes).reshape(-1,4), np.asarray(gt_targets).ravel()
+        gt_ignore = np.zeros(len(gt_bboxes), dtype=bool) if gt_ignore is None \
+                    else np.asarray(gt_ignore, dtype=bool).ravel()
+        
+        for target in np.union1d(np.unique(targets), np.unique(gt_targets)): 
+            dinds, = np.where(targets == target)
+            ginds, = np.where(gt_targets == target)
+            tp, ignored = self.match(bboxes[dinds], scores[dinds], 
+                                     gt_bboxes[ginds], gt_ignore[ginds])
+
+            stats = self._class_stats(target.item() if hasattr(target, 'item') else target)
+            stats.npos += int(np.sum(~gt_ignore[ginds]))
+            if not len(dinds): 
+                continue
+            
+            # Ignored detections are neither true nor false positives
+            if self.num_bins_ is None: 
+                stats.scores.append(scores[dinds])
+                stats.tps.append(np.where(ignored, -1, tp).astype(np.int8))
+            else: 
+                lo, hi = self.score_range_
+                bins = np.clip(((scores[dinds] - lo) / (hi - lo) * self.num_bins_).astype(np.int64), 
+                               0, self.num_bins_-1)
+                for t in range(len(self.iou_thresholds_)): 
+                    keep = ~ignored[:,t]
+                    stats.tp[t] += np.bincount(bins[keep], weights=tp[keep,t].astype(np.float64), 
+                                               minlength=self.num_bins_).astype(np.int64)
+                    stats.fp[t] += np.bincount(bins[keep], weights=(~tp[keep,t]).astype(np.float64), 
+                                               minlength=self.num_bins_).astype(np.int64)
+        self.num_images_ += 1
+
+    def ingest(self, roidb, detect_cb): 
+        """
+        Evaluate detect_cb(im) -> (bboxes, scores, targets) over 
+        (im, gt_bboxes, gt_targets) tuples (e.g. LogDB.roidb)
+        """
+        for im, gt_bboxes, gt_targets in roidb: 
+            bboxes, scores, targets = detect_cb(im)
+            self.add(bboxes, scores, targets, gt_bboxes, gt_targets)
+        return self
+
+    def precision_recall(self, target): 
+        """
+        Precision, recall [T x N] and the corresponding (decreasing) 
+        score thresholds [N] of a class, via cumulative sums 
+        over a single sort
+        """
+        stats = self.classes_[target]
+        if self.num_bins_ is None: 
+            if not len(stats.scores): 
+                T = len(self.iou_thresholds_)
+                return np.zeros((T,0)), np.zeros((T,0)), np.zeros(0)
+
+            # Compact accumulated chunks
+            stats.scores = [np.concatenate(stats.scores)]
+            stats.tps = [np.vstack(stats.tps)]
+            order = np.argsort(-stats.scores[0], kind='mergesort')
+            scores, tps = stats.scores[0][order], stats.tps[0][order].T
+            tp, fp = np.cumsum(tps == 1, axis=1), np.cumsum(tps == 0, axis=1)
+        else: 
+            lo, hi = self.score_range_
+            scores = lo + (np.arange(self.num_bins_)[::-1] + 1.) * (hi - lo) / self.num_bins_
+            tp, fp = np.cumsum(stats.tp[:,::-1], axis=1), np.cumsum(stats.fp[:,::-1], axis=1)
+
+        recall = tp * 1.0 / max(stats.npos, 1)
+        precision = tp * 1.0 / np.maximum(tp + fp, np.finfo(np.float64).eps)
+        return precision, recall, scores
+
+    def average_precision(self, target): 
+        """ Average precision of a class at each IoU threshold [T] """
+        precision, recall, _ = self.precision_recall(target)
+        T = len(self.iou_thresholds_)
+        if not precision.shape[1] or not self.classes_[target].npos: 
+            return np.zeros(T)
+
+        # Precision envelope (monotonically decreasing)
+        envelope = np.maximum.accumulate(precision[:,::-1], axis=1)[:,::-1]
+        if self.ap_method_ == 'area': 
+            r = np.hstack([np.zeros((T,1)), recall])
+            return np.sum((r[:,1:] - r[:,:-1]) * envelope, axis=1)
+
+        # Sampled recall points: precision at the first recall >= r
+        rs = np.linspace(0, 1, 101 if self.ap_method_ == 'coco' else 11)
+        ap = np.zeros(T)
+        for t in range(T): 
+            inds = np.searchsorted(recall[t], rs, side='left')
+            valid = inds < recall.shape[1]
+            ap[t] = np.sum(envelope[t, inds[valid]]) / len(rs)
+        return ap
+
+    def mean_average_precision(self, targets=None): 
+        """
+        Mean AP over classes with ground truth (at each IoU 
+        threshold) [T], and the per-class AP {target: [T]}
+        """
+        targets = self.targets if targets is None else targets
+        ap = np.vstack([self.average_precision(target) for target in targets]) \
+             if len(targets) else np.zeros((0, len(self.iou_thresholds_)))
+        valid = np.bool_([self.classes_[target].npos > 0 for target in targets])
+        mAP = ap[valid].mean(axis=0) if valid.any() else np.zeros(len(self.iou_thresholds_))
+        return mAP, AttrDict(zip(targets, ap))
+
 # =====================================================================
 # Generic utility functions for object recognition
 # ---------------------------------------------------------------------
@@ -299,31 +505,31 @@ def root_sift(kpts, desc, eps=1e-7):
     desc = np.sqrt(desc / (np.sum(desc, axis=1)[:,np.newaxis] + eps))
     # desc /= (np.linalg.norm(desc, axis=1)[:,np.newaxis] + eps)
 
-    inds, = np.where(np.isfinite(desc).all(axis=1))
-    kpts, desc = [kpts[ind] for ind in inds], desc[inds]
+    # Only re-index keypoints if any of the descriptors are invalid
+    valid = np.isfinite(desc).all(axis=1)
+    if not valid.all(): 
+        kpts_arr = np.empty(len(kpts), dtype=object)
+        kpts_arr[:] = kpts
+        kpts, desc = list(kpts_arr[valid]), desc[valid]
     return kpts, desc
 
+# Cached describers for im_detect_and_describe
+_describers = {}
+
 def im_detect_and_describe(img, mask=None, detector='dense', descriptor='SIFT', colorspace='gray',
                            step=4, levels=7, scale=np.sqrt(2)): 
     """ 
     Describe image using dense sampling / specific detector-descriptor combination. 
+    (describers are cached per parameter set, see DenseDescriber)
     """
-    detector = get_detector(detector=detector, step=step, levels=levels, scale=scale)
-    extractor = cv2.DescriptorExtractor_create(descriptor)
-
-    try:     
-        kpts = detector.detect(img, mask=mask)
-        kpts, desc = extractor.compute(img, kpts)
-        
-        if descriptor == 'SIFT': 
-            kpts, desc = root_sift(kpts, desc)
-
-        pts = np.vstack([kp.pt for kp in kpts]).astype(np.int32)
-        return pts, desc
-
-    except Exception as e: 
-        print('im_detect_and_describe', e)
-        return None, None
+    key = (detector, descriptor, step, levels, scale)
+    try: 
+        describer = _describers[key]
+    except KeyError: 
+        describer = DenseDescriber(detector=detector, descriptor=descriptor, 
+                                   step=step, levels=levels, scale=scale)
+        _describers[key] = describer
+    return describer.detect_and_describe(img, mask=mask)
 
 def im_describe(*args, **kwargs): 
     """ 
@@ -333,6 +539,109 @@ def im_describe(*args, **kwargs):
     kpts, desc = im_detect_and_describe(*args, **kwargs)
     return desc
 
+class DenseDescriber(object): 
+    """
+    Image describer (dense sampling / specific detector-descriptor
+    combination) that reuses the detector and descriptor extractor 
+    across images, and caches the dense keypoint grid per image shape. 
+
+        describer = DenseDescriber(descriptor='SIFT', step=4)
+        pts, desc = describer.detect_and_describe(im)
+
+        # Describe several images in a process pool
+        desc, offsets = describer.describe_batch(ims)
+        desc_i = desc[offsets[i]:offsets[i+1]]
+
+    """
+    def __init__(self, detector='dense', descriptor='SIFT', step=4, levels=7, scale=np.sqrt(2)): 
+        self.params_ = dict(detector=detector, descriptor=descriptor, 
+                            step=step, levels=levels, scale=scale)
+        self.detector_ = get_detector(detector=detector, step=step, levels=levels, scale=scale)
+        self.extractor_ = cv2.DescriptorExtractor_create(descriptor)
+
+        # Cached dense keypoints, keyed by image shape
+        self.kpts_ = {}
+        self.pool_, self.num_workers_ = None, None
+
+    def __del__(self): 
+        self.close()
+
+    def close(self): 
+        if getattr(self, 'pool_', None) is not None: 
+            self.pool_.close()
+            self.pool_.join()
+            self.pool_ = None
+
+    @property
+    def params(self): 
+        return self.params_
+
+    def keypoints(self, img, mask=None): 
+        """
+        Dense keypoints are identical for same-sized images, 
+        and are only detected once per image shape
+        """
+        if self.params_['detector'] != 'dense' or mask is not None: 
+            return self.detector_.detect(img, mask=mask)
+
+        shape = img.shape[:2]
+        try: 
+            return self.kpts_[shape]
+        except KeyError: 
+            kpts = self.detector_.detect(img)
+            self.kpts_[shape] = kpts
+            return kpts
+
+    def detect_and_describe(self, img, mask=None): 
+        try: 
+            kpts, desc = self.extractor_.compute(img, self.keypoints(img, mask=mask))
+            if self.params_['descriptor'] == 'SIFT': 
+                kpts, desc = root_sift(kpts, desc)
+
+            pts = to_pts(kpts).astype(np.int32)
+            return pts, desc
+
+        except Exception as e: 
+            print('{}::detect_and_describe {}'.format(self.__class__.__name__, e))
+            return None, None
+
+    def describe(self, img, mask=None): 
+        pts, desc = self.detect_and_describe(img, mask=mask)
+        return desc
+
+    def describe_batch(self, images, num_workers=None, chunksize=4): 
+        """
+        Describe images in a process pool (each worker owns its 
+        own DenseDescriber). Returns the stacked descriptors [N x D], 
+        and per-image offsets [len(images)+1] into them. 
+        Images that fail to be described contribute no descriptors.
+        The pool is re-created if num_workers changes. 
+        """
+        if self.pool_ is None or num_workers != self.num_workers_: 
+            self.close()
+            self.pool_ = Pool(processes=num_workers, 
+                              initializer=_init_dense_describer, initargs=(self.params_,))
+            self.num_workers_ = num_workers
+
+        descs = self.pool_.map(_dense_describe, images, chunksize=chunksize)
+        sizes = [len(desc) if desc is not None else 0 for desc in descs]
+        offsets = np.r_[0, np.cumsum(sizes)].astype(np.int64)
+
+        descs = [desc for desc in descs if desc is not None and len(desc)]
+        if not len(descs): 
+            return np.empty((0, 0), dtype=np.float32), offsets
+        return np.vstack(descs), offsets
+
+# Per-process describer for DenseDescriber.describe_batch
+_dense_describer = None
+
+def _init_dense_describer(params): 
+    global _dense_describer
+    _dense_describer = DenseDescriber(**params)
+
+def _dense_describe(img): 
+    return _dense_describer.describe(img)
+
 # def color_codes(img, kpts): 
 #     # Extract color information (Lab)
 #     pts = np.vstack([kp.pt for kp in kpts]).astype(np.int32)
@@ -345,6 +654,57 @@ def im_describe(*args, **kwargs):
 # General-purpose object recognition interfaces, and functions
 # ---------------------------------------------------------------------
 
+def iterchunks_stacked(db, keys=('X', 'y'), batch_size=100, prefetch_size=4, inds=None): 
+    """
+    Iterate IterDB in chunks of batch_size items, stacking the
+    items of each key into arrays ([N x D] features, [N] targets), 
+    read-ahead in a background thread. If inds is provided, 
+    only those chunks are read. 
+    """
+    def stacked(): 
+        for chunk in db.iterchunks_keys(list(keys), batch_size=batch_size, inds=inds): 
+            yield tuple(np.vstack(items) if np.ndim(items[0]) > 1 else np.hstack(items) 
+                        for items in chunk)
+    return prefetch(stacked(), size=prefetch_size) if prefetch_size > 0 else stacked()
+
+def split_chunks(num_chunks, test_every=10): 
+    """
+    Train and held-out (every test_every-th) chunk indices, 
+    all chunks are used for training if test_every <= 0
+    """
+    inds = np.arange(num_chunks)
+    if test_every <= 0: 
+        return inds, inds[:0]
+    held_out = inds % test_every == 0
+    return inds[~held_out], inds[held_out]
+
+def reservoir_shuffle(iterable, buffer_size=50000, seed=0): 
+    """
+    Approximately shuffle a stream of (X, y) chunks within a buffer of 
+    buffer_size samples: each incoming chunk replaces randomly chosen
+    buffered samples, which are emitted as a batch. The remaining 
+    buffer is emitted (shuffled) at the end. 
+    """
+    rng = np.random.RandomState(seed)
+    bX, by = None, None
+    for X, y in iterable: 
+        if bX is None or len(bX) < buffer_size: 
+            bX = X if bX is None else np.vstack([bX, X])
+            by = y if by is None else np.hstack([by, y])
+            continue
+
+        n = min(len(X), len(bX))
+        slots = rng.choice(len(bX), n, replace=False)
+        outX, outy = bX[slots], by[slots]
+        bX[slots], by[slots] = X[:n], y[:n]
+        yield outX, outy
+        if n < len(X): 
+            yield X[n:], y[n:]
+
+    if bX is not None: 
+        inds = rng.permutation(len(bX))
+        yield bX[inds], by[inds]
+
 class HistogramClassifier(object): 
     def __init__(self, filename, target_map,
                  classifier='svm',
@@ -429,17 +789,67 @@ class HistogramClassifier(object):
             self._save(self.filename_.replace('.h5', '_iter_{}.h5'.format(self.epoch_no_)))
         self.epoch_no_ += 1
 
-    def predict(self, X): 
-        return self.clf_.predict(X)
+    def fit_streaming(self, db, keys=('X', 'y'), epochs=5, batch_size=100, 
+                      buffer_size=50000, prefetch_size=4, test_every=10): 
+        """
+        Out-of-core training via partial_fit epochs over IterDB chunks 
+        (of batch_size items), read-ahead in a background thread and 
+        shuffled within a reservoir of buffer_size samples. Every 
+        test_every-th chunk is held out for evaluation. Chunks are 
+        selected before reading, so that each is only read by the 
+        pass (training or evaluation) that uses it. 
+        """
+        if not hasattr(getattr(self, 'clf_', None), 'partial_fit'): 
+            raise RuntimeError('{}: Streaming training requires a classifier with partial_fit (sgd)'
+                               .format(self.__class__.__name__))
+
+        train_inds, _ = split_chunks(db.num_chunks(keys[0], batch_size=batch_size), 
+                                     test_every=test_every)
+        print_yellow('====> STREAMING Training (out-of-core): {} epochs, buffer: {} samples'
+                     .format(epochs, buffer_size))
+        for epoch in range(epochs): 
+            train_it = iterchunks_stacked(db, keys=keys, batch_size=batch_size, 
+                                          prefetch_size=prefetch_size, inds=train_inds)
+            for X, y in reservoir_shuffle(train_it, buffer_size=buffer_size, 
+                                          seed=self.seed_ + epoch): 
+                self.clf_.partial_fit(X, y, classes=self.target_ids_)
+
+            if test_every > 0: 
+                print_yellow('Epoch {}: Held-out accuracy {:4.3f}'.format(
+                    epoch, self.score_streaming(db, keys=keys, batch_size=batch_size, 
+                                                prefetch_size=prefetch_size, test_every=test_every)))
+            self.epoch_no_ += 1
+        self._save(self.filename_)
+
+    def score_streaming(self, db, keys=('X', 'y'), batch_size=100, prefetch_size=4, test_every=10): 
+        """ Accuracy over the held-out chunks (every test_every-th chunk) """
+        num_chunks = db.num_chunks(keys[0], batch_size=batch_size)
+        train_inds, test_inds = split_chunks(num_chunks, test_every=test_every)
+        correct, total = 0, 0
+        for X, y in iterchunks_stacked(db, keys=keys, batch_size=batch_size, 
+                                       prefetch_size=prefetch_size, 
+                                       inds=test_inds if test_every > 0 else train_inds): 
+            correct += np.sum(self.predict(X) == y)
+            total += len(y)
+        return correct * 1.0 / max(total, 1)
+
+    def _chunked(self, func, X, batch_size): 
+        if batch_size is None or len(X) <= batch_size: 
+            return func(X)
+        return np.concatenate([func(X[idx:idx+batch_size]) 
+                               for idx in range(0, len(X), batch_size)])
 
-    def decision_function(self, X): 
-        return self.clf_.decision_function(X)
+    def predict(self, X, batch_size=None): 
+        return self._chunked(self.clf_.predict, X, batch_size)
 
-    def predict_proba(self, X): 
-        return self.clf_.predict_proba(X)
+    def decision_function(self, X, batch_size=None): 
+        return self._chunked(self.clf_.decision_function, X, batch_size)
 
-    def predict_log_proba(self, X): 
-        return self.clf_.predict_log_proba(X)
+    def predict_proba(self, X, batch_size=None): 
+        return self._chunked(self.clf_.predict_proba, X, batch_size)
+
+    def predict_log_proba(self, X, batch_size=None): 
+        return self._chunked(self.clf_.predict_log_proba, X, batch_size)
 
     def report(self, y, y_pred, background=None): 
         print_yellow('-------------------------------')
@@ -519,12 +929,82 @@ class HistogramClassifier(object):
         print_yellow('-------------------------------')
         return c
 
+class ProposalCache(object): 
+    """
+    On-disk cache of object proposals [N x 4], keyed by the image
+    content hash and the proposer parameters, such that subsequent
+    epochs/experiments skip proposal computation 
+    
+        cache = ProposalCache('~/data/proposals', params=dict(method='GOP', num_proposals=1000))
+        bboxes = cache.get(im)
+        if bboxes is None: 
+            bboxes = cache.put(im, proposer.process(im))
+
+    """
+    def __init__(self, cache_dir, params): 
+        self.params_hash_ = hashlib.sha1(
+            json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        self.cache_dir_ = os.path.join(os.path.expanduser(cache_dir), self.params_hash_[:16])
+        if not os.path.exists(self.cache_dir_): 
+            os.makedirs(self.cache_dir_)
+
+    @staticmethod
+    def image_hash(im): 
+        im = np.ascontiguousarray(im)
+        h = hashlib.sha1(repr((im.shape, im.dtype.str)).encode('utf-8'))
+        h.update(im.view(np.uint8).data)
+        return h.hexdigest()
+
+    def filename(self, key): 
+        return os.path.join(self.cache_dir_, key[:2], '{}.npy'.format(key))
+
+    def get(self, im=None, key=None): 
+        fn = self.filename(ProposalCache.image_hash(im) if key is None else key)
+        try: 
+            return np.load(fn)
+        except (IOError, ValueError): 
+            return None
+
+    def put(self, im, bboxes, key=None): 
+        """ Write-then-rename, so that concurrent readers never see partial files """
+        fn = self.filename(ProposalCache.image_hash(im) if key is None else key)
+        dirname = os.path.dirname(fn)
+        if not os.path.exists(dirname): 
+            try: 
+                os.makedirs(dirname)
+            except OSError: 
+                pass
+        tmp = '{}.{}.tmp'.format(fn, os.getpid())
+        with open(tmp, 'wb') as f: 
+            np.save(f, bboxes)
+        os.rename(tmp, fn)
+        return bboxes
+
+# Per-process proposer for NegativeMiningGenerator
+_proposer = None
+
+def _init_proposer(params): 
+    global _proposer
+    from pybot.vision.recognition.proposals import ObjectProposal
+    _proposer = ObjectProposal.create(**params)
+
+def _propose(im): 
+    return _proposer.process(im)
+
 class NegativeMiningGenerator(object): 
     """
     Generate negative samples with training dataset generator, 
     and object proposal technique
+
+        proposer_params: ObjectProposal.create() parameters, required
+                         to build a proposer in each worker process
+                         (num_workers > 0), and used to key the cache
+        num_workers:     Proposer worker processes (0: serial)
+        cache_dir:       On-disk proposal cache (see ProposalCache)
+
     """
-    def __init__(self, dataset, proposer, target, num_proposals=50):
+    def __init__(self, dataset, proposer, target, num_proposals=50, 
+                 proposer_params=None, num_workers=0, cache_dir=None):
         print_yellow('NegativeMiningGenerator: '
               'Generating negative samples with {}, num_proposals: {}'
               .format(proposer, num_proposals))
@@ -537,29 +1017,97 @@ class NegativeMiningGenerator(object):
         
         self.generate_targets = lambda N: np.ones(N, dtype=np.int64) * target
 
-    def mine(self, im, gt_bboxes): 
+        if num_workers > 0 and proposer_params is None: 
+            raise ValueError('NegativeMiningGenerator: proposer_params required for num_workers > 0')
+        if cache_dir is not None and proposer_params is None: 
+            raise ValueError('NegativeMiningGenerator: proposer_params required for cache_dir '
+                             '(proposals are cached per proposer configuration)')
+        self.proposer_params_ = proposer_params
+        self.num_workers_ = num_workers
+        self.pool_ = None
+
+        # Key cache with the proposer params
+        self.cache_ = ProposalCache(cache_dir, proposer_params) \
+                      if cache_dir is not None else None
+
+    def __del__(self): 
+        self.close()
+
+    def close(self): 
+        if getattr(self, 'pool_', None) is not None: 
+            self.pool_.close()
+            self.pool_.join()
+            self.pool_ = None
+
+    def propose(self, im): 
+        """ Proposals for an image, looked up from / stored in the cache """
+        if self.cache_ is None: 
+            return self.proposer_.process(im)
+        key = ProposalCache.image_hash(im)
+        bboxes = self.cache_.get(key=key)
+        if bboxes is None: 
+            bboxes = self.cache_.put(im, self.proposer_.process(im), key=key)
+        return bboxes
+
+    def filter(self, bboxes, gt_bboxes): 
         """
-        Propose bounding boxes using proposer, and
-        augment non-overlapping boxes with IoU < 0.1
-        to the ground truth set.
-        (up to a maximum of num_proposals)
+        Retain bboxes that do not overlap with the ground truth 
+        (IoU < 0.1), up to a maximum of num_proposals
         """
-        bboxes = self.proposer_.process(im)
-
         if len(gt_bboxes): 
             # Determine bboxes that have low IoU with ground truth
             # iou = [N x GT]
-            iou = brute_force_match(bboxes, gt_bboxes, 
-                                    match_func=lambda x,y: intersection_over_union(x,y))
-            # print('Detected {}, {}, {}'.format(iou.shape, len(gt_bboxes), len(bboxes))) # , np.max(iou, axis=1)
+            iou = intersection_over_union_matrix(bboxes, gt_bboxes)
             overlap_inds, = np.where(np.max(iou, axis=1) < 0.1)
             bboxes = bboxes[overlap_inds]
-            # print('Remaining non-overlapping {}'.format(len(bboxes)))
 
         bboxes = bboxes[:self.num_proposals_]
         targets = self.generate_targets(len(bboxes))
         return bboxes, targets
 
+    def mine(self, im, gt_bboxes): 
+        """
+        Propose bounding boxes using proposer, and
+        augment non-overlapping boxes with IoU < 0.1
+        to the ground truth set.
+        (up to a maximum of num_proposals)
+        """
+        return self.filter(self.propose(im), gt_bboxes)
+
+    def _iter_parallel(self): 
+        """
+        Propose cache misses in a process pool, keeping at most 
+        2 x num_workers images in flight, and yield in dataset order
+        """
+        if self.pool_ is None: 
+            self.pool_ = Pool(processes=self.num_workers_, initializer=_init_proposer, 
+                              initargs=(self.proposer_params_,))
+
+        pending = deque()
+        def pop(): 
+            im, gt_bboxes, key, result = pending.popleft()
+            if hasattr(result, 'get'): 
+                result = result.get()
+                if self.cache_ is not None: 
+                    self.cache_.put(im, result, key=key)
+            bboxes, targets = self.filter(result, gt_bboxes)
+            return im, bboxes, targets
+
+        for (im,gt_bboxes,_) in self.dataset_: 
+            key, bboxes = None, None
+            if self.cache_ is not None: 
+                key = ProposalCache.image_hash(im)
+                bboxes = self.cache_.get(key=key)
+            result = bboxes if bboxes is not None \
+                     else self.pool_.apply_async(_propose, (im,))
+            pending.append((im, gt_bboxes, key, result))
+
+            while len(pending) > 2 * self.num_workers_: 
+                yield pop()
+
+        while len(pending): 
+            yield pop()
+
     def __iter__(self, *args, **kwargs):
         """
         Iterate through dataset with ground truth bboxes, 
@@ -567,6 +1115,11 @@ class NegativeMiningGenerator(object):
         the IoU between gt_bboxes and bboxes < 0.1.
         i.e. mine non-overlapping bboxes
         """
+        if self.num_workers_ > 0: 
+            for item in self._iter_parallel(): 
+                yield item
+            return
+
         for (im,gt_bboxes,_) in self.dataset_: 
             bboxes, targets = self.mine(im, gt_bboxes)
             yield im, bboxes, targets
@@ -577,7 +1130,6 @@ class NegativeMiningGenerator(object):
 # # ---------------------------------------------------------------------
 
 # from .feature_detection import get_dense_detector, get_detector
-# from .bow_utils import BoWVectorizer, bow_codebook, bow_project, flair_project
 
 # import sklearn.metrics as metrics
 # from sklearn.preprocessing import normalize
@@ -0,0 +1,323 @@
+"""
+Image retrieval (inverted-file, tf-idf) for place recognition / loop closure
+"""
+# Author: Sudeep Pillai <spillai@csail.mit.edu>
+# License: MIT
+
+import numpy as np
+from itertools import chain
+
+from pybot.utils.db_utils import AttrDict
+
+class InvertedFileIndex(object):
+    """
+    Incremental inverted file over visual-word ids with tf-idf
+    weighting and cosine scoring. Postings (document, term-frequency)
+    are stored sorted by word (CSR), with recently added postings in a
+    tail (indexed by word) that is merged in once it reaches
+    merge_size. Queries gather only the postings of the query words,
+    and score (and normalize) only the documents they contain.
+
+        index = InvertedFileIndex(K=vocab.dictionary_size)
+        index.add(vocab.quantize(desc), index=frame_index)
+        docs, scores = index.query(vocab.quantize(desc), k=5, index=frame_index)
+
+        K:               Vocabulary size
+        max_df:          Words occurring in more than max_df (fraction)
+                         of documents are ignored at query time (stop-words)
+        exclude_window:  Default temporal window (in frame indices) of
+                         recent documents excluded from query results
+        merge_size:      Number of tail postings merged into the CSR
+                         postings at once
+
+    Document norms are exact for the current idf: with
+    idf_w = L - l_w (L = log(N+1), l_w = log(df_w+1)), the squared
+    norm sum_w tf^2 (L - l_w)^2 is kept as L^2 A - 2 L B + C, where
+    A, B and C (per document) are updated with the postings of the
+    words whose df changes on add(), and norms are evaluated only
+    for the documents being scored.
+    """
+    def __init__(self, K, max_df=1.0, exclude_window=0, merge_size=65536):
+        self.K_ = K
+        self.max_df_ = max_df
+        self.exclude_window_ = exclude_window
+        self.merge_size_ = merge_size
+        self.reset()
+
+    def reset(self):
+        # Postings sorted by word (CSR), and recent (tail) postings
+        self.offsets_ = np.zeros(self.K_ + 1, dtype=np.int64)
+        self.docs_ = np.empty(0, dtype=np.int32)
+        self.tfs_ = np.empty(0, dtype=np.float32)
+        self.tail_words_ = np.empty(0, dtype=np.int64)
+        self.tail_docs_ = np.empty(0, dtype=np.int32)
+        self.tail_tfs_ = np.empty(0, dtype=np.float32)
+        self.tail_postings_ = {}
+        self.ntail_ = 0
+
+        # Document frequency per word, and per-document frame
+        # index, and norm terms (see class docstring)
+        self.df_ = np.zeros(self.K_, dtype=np.int64)
+        self.indices_ = np.empty(0, dtype=np.int64)
+        self.nterms_ = np.empty((0, 3), dtype=np.float64)
+        self.ndocs_ = 0
+
+    def __len__(self):
+        return self.ndocs_
+
+    @property
+    def dictionary_size(self):
+        return self.K_
+
+    @property
+    def indices(self):
+        return self.indices_[:self.ndocs_]
+
+    @property
+    def idf(self):
+        return np.float32(np.log((self.ndocs_ + 1.0) / (self.df_ + 1.0)))
+
+    @property
+    def norms(self):
+        """ tf-idf norms of all documents (with the current idf) """
+        return self.doc_norms(np.arange(self.ndocs_))
+
+    def doc_norms(self, docs):
+        """ tf-idf norms of the documents (with the current idf) """
+        L = np.log(self.ndocs_ + 1.0)
+        A, B, C = self.nterms_[docs].T
+        return np.sqrt(np.maximum(L * L * A - 2 * L * B + C, 0))
+
+    @staticmethod
+    def term_frequencies(words):
+        """ Unique words and their normalized frequencies """
+        words, counts = np.unique(np.asarray(words, dtype=np.int64), return_counts=True)
+        return words, np.float32(counts * 1.0 / max(counts.sum(), 1))
+
+    def postings(self, uwords):
+        """
+        Postings (documents, term-frequencies) of the (sorted, unique)
+        words, and the position of each posting's word in uwords
+        """
+        starts = self.offsets_[uwords]
+        sizes = self.offsets_[uwords + 1] - starts
+        inds = np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + \
+               np.arange(sizes.sum())
+        qinds = np.repeat(np.arange(len(uwords)), sizes)
+
+        # Tail postings of the query words
+        tails = [self.tail_postings_.get(w, []) for w in uwords.tolist()]
+        tsizes = [len(t) for t in tails]
+        tinds = np.fromiter(chain.from_iterable(tails), dtype=np.int64,
+                            count=sum(tsizes))
+        return np.r_[self.docs_[inds], self.tail_docs_[tinds]], \
+            np.r_[self.tfs_[inds], self.tail_tfs_[tinds]], \
+            np.r_[qinds, np.repeat(np.arange(len(uwords)), tsizes)]
+
+    def _append_tail(self, words, doc, tfs):
+        n, m = self.ntail_, len(words)
+        if n + m > len(self.tail_words_):
+            cap = max(64, 2 * (n + m))
+            self.tail_words_ = np.r_[self.tail_words_[:n], np.zeros(cap - n, dtype=np.int64)]
+            self.tail_docs_ = np.r_[self.tail_docs_[:n], np.zeros(cap - n, dtype=np.int32)]
+            self.tail_tfs_ = np.r_[self.tail_tfs_[:n], np.zeros(cap - n, dtype=np.float32)]
+        self.tail_words_[n:n+m], self.tail_docs_[n:n+m], self.tail_tfs_[n:n+m] = words, doc, tfs
+        for j, w in enumerate(words.tolist(), n):
+            self.tail_postings_.setdefault(w, []).append(j)
+        self.ntail_ = n + m
+
+    def merge(self):
+        """ Merge tail postings into the (CSR) postings """
+        if not self.ntail_:
+            return
+        n = self.ntail_
+        order = np.argsort(self.tail_words_[:n], kind='mergesort')
+        words = self.tail_words_[:n][order]
+
+        # Tail postings are newer, insert at the end of each word's list
+        pos = self.offsets_[words + 1]
+        self.docs_ = np.insert(self.docs_, pos, self.tail_docs_[:n][order])
+        self.tfs_ = np.insert(self.tfs_, pos, self.tail_tfs_[:n][order])
+        self.offsets_[1:] += np.cumsum(np.bincount(words, minlength=self.K_))
+        self.tail_postings_ = {}
+        self.ntail_ = 0
+
+    def add(self, words, index=None):
+        """
+        Insert a document (e.g. keyframe) described by its
+        visual-word ids, returns the document id
+        """
+        doc = self.ndocs_
+        if doc == len(self.indices_):
+            cap = max(64, 2 * doc)
+            self.indices_ = np.r_[self.indices_, np.zeros(cap - doc, dtype=np.int64)]
+            self.nterms_ = np.r_[self.nterms_, np.zeros((cap - doc, 3), dtype=np.float64)]
+
+        # Update norm terms of documents sharing the words (whose df changes)
+        uwords, tfs = InvertedFileIndex.term_frequencies(words)
+        l0, l1 = np.log(self.df_[uwords] + 1.0), np.log(self.df_[uwords] + 2.0)
+        pdocs, ptfs, qinds = self.postings(uwords)
+        if len(pdocs):
+            w = np.float64(ptfs) ** 2
+            self.nterms_[:doc,1] += np.bincount(pdocs, weights=w * (l1 - l0)[qinds],
+                                                minlength=doc)
+            self.nterms_[:doc,2] += np.bincount(pdocs, weights=w * (l1 * l1 - l0 * l0)[qinds],
+                                                minlength=doc)
+        self.df_[uwords] += 1
+
+        w = np.float64(tfs) ** 2
+        self.nterms_[doc] = [w.sum(), (w * l1).sum(), (w * l1 * l1).sum()]
+        self.indices_[doc] = doc if index is None else index
+        self.ndocs_ += 1
+
+        self._append_tail(uwords, doc, tfs)
+        if self.ntail_ >= self.merge_size_:
+            self.merge()
+        return doc
+
+    def reweight(self):
+        """ Recompute the norm terms of all documents from the postings """
+        self.merge()
+        words = np.repeat(np.arange(self.K_), np.diff(self.offsets_))
+        w, l = np.float64(self.tfs_) ** 2, np.log(self.df_[words] + 1.0)
+        self.nterms_ = np.zeros((self.ndocs_, 3), dtype=np.float64)
+        for j, weights in enumerate([w, w * l, w * l * l]):
+            self.nterms_[:,j] = np.bincount(self.docs_, weights=weights,
+                                            minlength=self.ndocs_)
+
+    def sparse_scores(self, words):
+        """
+        Cosine tf-idf similarity of the query to the documents
+        sharing (non stop-) words with it, returns (docs, scores)
+        """
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        if not self.ndocs_:
+            return empty
+
+        uwords, tfs = InvertedFileIndex.term_frequencies(words)
+        idf = self.idf[uwords]
+        qw = tfs * idf
+        qnorm = np.linalg.norm(qw)
+
+        # Ignore stop-words
+        valid = self.df_[uwords] <= self.max_df_ * self.ndocs_
+        uwords, qw, idf = uwords[valid], qw[valid], idf[valid]
+        if not len(uwords) or qnorm <= 0:
+            return empty
+
+        # Accumulate scores over postings of query words
+        docs, tfs, qinds = self.postings(uwords)
+        docs, inv = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inv.ravel(), weights=tfs * (qw * idf)[qinds],
+                             minlength=len(docs))
+        return docs.astype(np.int64), \
+            scores / (qnorm * np.maximum(self.doc_norms(docs), 1e-12))
+
+    def scores(self, words):
+        """ Cosine tf-idf similarity of the query to all documents """
+        scores = np.zeros(self.ndocs_, dtype=np.float64)
+        docs, dscores = self.sparse_scores(words)
+        scores[docs] = dscores
+        return scores
+
+    def query(self, words, k=5, index=None, exclude_window=None):
+        """
+        Top-k documents (and scores) most similar to the query,
+        excluding documents within exclude_window (frame indices)
+        of the query index (defaults to the latest document). Only
+        documents sharing words with the query are ranked, unless
+        there are fewer than k of them.
+        """
+        if not self.ndocs_:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        window = self.exclude_window_ if exclude_window is None else exclude_window
+        index = self.indices_[self.ndocs_-1] if index is None else index
+        excluded = lambda docs: self.indices_[docs] > index - window \
+                   if window > 0 else np.zeros(len(docs), dtype=bool)
+
+        docs, scores = self.sparse_scores(words)
+        keep = ~excluded(docs)
+        docs, scores = docs[keep], scores[keep]
+        if len(docs) < k:
+            docs = np.arange(self.ndocs_)
+            scores = self.scores(words)
+            scores[excluded(docs)] = -np.inf
+
+        k = min(k, len(scores))
+        if not k:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        inds = np.argpartition(-scores, k-1)[:k]
+        inds = inds[np.argsort(-scores[inds])]
+        inds = inds[np.isfinite(scores[inds])]
+        return docs[inds], scores[inds]
+
+    def to_dict(self):
+        self.merge()
+        return AttrDict(K=self.K_, max_df=self.max_df_,
+                        exclude_window=self.exclude_window_,
+                        merge_size=self.merge_size_,
+                        sizes=np.diff(self.offsets_), df=self.df_,
+                        docs=self.docs_, tfs=self.tfs_, indices=self.indices)
+
+    @classmethod
+    def from_dict(cls, db):
+        index = cls(int(db.K), max_df=float(db.max_df),
+                    exclude_window=int(db.exclude_window),
+                    merge_size=int(db.get('merge_size', 65536)))
+        index.offsets_ = np.r_[0, np.cumsum(db.sizes)].astype(np.int64)
+        index.docs_ = np.int32(db.docs)
+        index.tfs_ = np.float32(db.tfs)
+        index.df_ = np.int64(db.df)
+        index.indices_ = np.int64(db.indices)
+        index.ndocs_ = len(index.indices_)
+        index.reweight()
+        return index
+
+    def save(self, fn):
+        self.to_dict().save(fn)
+
+    @classmethod
+    def load(cls, fn):
+        return cls.from_dict(AttrDict.load(fn))
+
+class ImageDatabase(object):
+    """
+    Incremental keyframe database for place recognition / loop
+    closure, that quantizes descriptors with a trained vocabulary
+    (bow_utils.BoWVectorizer) into an inverted file index
+
+        db = ImageDatabase(vocab, exclude_window=50)
+        sampler = KeyframeSampler(on_sampled_cb=lambda index, kf: \
+                                  db.add(describe(kf.img), index=kf.index))
+        ...
+        indices, scores = db.query(describe(im), k=5, index=frame_index)
+
+    """
+    def __init__(self, vocab, max_df=1.0, exclude_window=0):
+        self.vocab_ = vocab
+        self.index_ = InvertedFileIndex(vocab.dictionary_size, max_df=max_df,
+                                        exclude_window=exclude_window)
+
+    def __len__(self):
+        return len(self.index_)
+
+    @property
+    def index(self):
+        return self.index_
+
+    def add(self, desc, index=None):
+        return self.index_.add(self.vocab_.quantize(desc), index=index)
+
+    def query(self, desc, k=5, index=None, exclude_window=None):
+        """ Returns the frame indices of the top-k keyframes, and scores """
+        docs, scores = self.index_.query(self.vocab_.quantize(desc), k=k, index=index,
+                                         exclude_window=exclude_window)
+        return self.index_.indices[docs], scores
+
+    def save(self, fn):
+        self.index_.save(fn)
+
+    def load(self, fn):
+        self.index_ = InvertedFileIndex.load(fn)
+        return self
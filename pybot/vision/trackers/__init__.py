@@ -1,7 +1,7 @@
 from ..feature_detection import finite_and_within_bounds, to_kpt, to_kpts, to_pts, kpts_to_array
 from ..feature_detection import FeatureDetector
 from .tracker_utils import TrackManager, OpticalFlowTracker, LKTracker, FarnebackTracker
-from .base_klt import BaseKLT, OpenCVKLT
+from .base_klt import BaseKLT, OpenCVKLT, StereoKLT, MultiStreamKLT
 try: 
     from .base_klt import MeshKLT, BoundingBoxKLT
 except: 
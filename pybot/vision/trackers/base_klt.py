@@ -20,19 +20,21 @@ between frames.
 # Author: Sudeep Pillai <spillai@csail.mit.edu>
 # License: MIT
 
+import time
 import cv2
 import numpy as np
 
-from itertools import izip
+from pybot.utils.itertools_recipes import izip
 from collections import namedtuple, deque
+from multiprocessing.pool import ThreadPool
 
 from pybot.utils.db_utils import AttrDict
 from pybot.utils.timer import timeitmethod
 from pybot.utils.plot_utils import colormap
 
 from pybot.vision.imshow_utils import imshow_cv, print_status
-from pybot.vision.image_utils import to_color, to_gray, gaussian_blur
-from pybot.vision.draw_utils import draw_features, draw_lines
+from pybot.vision.image_utils import to_color, to_gray, gaussian_blur, im_resize
+from pybot.vision.draw_utils import draw_features, draw_lines, splat_features
 
 
 from pybot.vision.trackers import FeatureDetector, OpticalFlowTracker, LKTracker
@@ -111,55 +113,61 @@ class BaseKLT(object):
         """
         self.aug_pts_ = pts
 
-    def draw_tracks(self, out, colored=False, color_type='unique', min_track_length=4, max_track_length=4):
+    def draw_tracks(self, out, colored=False, color_type='unique', min_track_length=4, max_track_length=4, 
+                    scale=1.0):
         """
         color_type: {age, unique}
-        """
-
-        N = 20
-        # inds = self.confident_tracks(min_length=min_track_length)
-        # if not len(inds): 
-        #     return
-
-        # ids, pts = self.latest_ids[inds], self.latest_pts[inds]
-        # lengths = self.tm_.lengths[inds]
+        scale: Draw on a downscaled copy of out (for live display), 
+               otherwise tracks are drawn in-place
 
-        ids, pts, lengths = self.latest_ids, self.latest_pts, self.tm_.lengths
-
-        if color_type == 'unique': 
-            cwheel = colormap(np.linspace(0, 1, N))
-            cols = np.vstack([cwheel[tid % N] for idx, tid in enumerate(ids)])
-        elif color_type == 'age': 
-            cols = colormap(lengths)
-        else: 
+        Tracks are read from the TrackManager ring buffer, and drawn
+        with a single polylines call per color. The latest keypoints 
+        are splatted via array indexing. 
+        """
+        if color_type not in ('unique', 'age'): 
             raise ValueError('Color type {:} undefined, use age or unique'.format(color_type))
 
-        if not colored: 
-            cols = np.tile([0,240,0], [len(self.tm_.tracks), 1])
+        out = im_resize(out, scale=scale)
+        ids = self.latest_ids
+        if not len(ids): 
+            return out
 
-        for col, pts in izip(cols.astype(np.int64), self.tm_.tracks.itervalues()): 
-            cv2.polylines(out, [np.vstack(pts.items).astype(np.int32)[-max_track_length:]], False, 
-                          tuple(col), thickness=1)
-            tl, br = np.int32(pts.latest_item)-2, np.int32(pts.latest_item)+2
-            cv2.rectangle(out, (tl[0], tl[1]), (br[0], br[1]), tuple(col), -1)
+        # Track colors as [labels -> color wheel]
+        N = 20
+        if not colored: 
+            cwheel = np.int64([[0,240,0]])
+            labels = np.zeros(len(ids), dtype=np.int64)
+        elif color_type == 'unique': 
+            cwheel = colormap(np.linspace(0, 1, N)).astype(np.int64)
+            labels = np.int64(ids) % N
+        else: 
+            cwheel = colormap(np.arange(256)).astype(np.int64)
+            labels = np.minimum(self.tm_.lengths, 255)
+
+        # Track history [K x T x 2]
+        tracks = self.tm_.history(maxlen=max_track_length) * scale
+        for label in np.unique(labels): 
+            cv2.polylines(out, tracks[labels == label].astype(np.int32), False, 
+                          tuple(map(int, cwheel[label])), thickness=1)
+        splat_features(out, tracks[:,-1], cwheel[labels], size=2)
+        return out
 
-    def visualize(self, out, colored=False): 
-        if not len(self.latest_pts):
-            return
+    def visualize(self, out, colored=False, scale=1.0): 
+        out = im_resize(out, scale=scale)
+        pts = self.latest_pts
+        if not len(pts):
+            return out
 
         N = 20
-        cols = colormap(np.linspace(0, 1, N))
-        valid = finite_and_within_bounds(self.latest_pts, out.shape)
-
-        for tid, pt in izip(self.latest_ids[valid], self.latest_pts[valid]): 
-            cv2.rectangle(out, tuple(map(int, pt-2)), tuple(map(int, pt+2)), 
-                          tuple(map(int, cols[tid % N])) if colored else (0,240,0), -1)
-        print_status(out, 'Tracked Features: {}'.format(len(self.latest_pts)))
+        cols = colormap(np.linspace(0, 1, N)).astype(np.int64)
+        splat_features(out, pts * scale, 
+                       cols[np.int64(self.latest_ids) % N] if colored else (0,240,0), size=2)
+        print_status(out, 'Tracked Features: {}'.format(len(pts)))
         return out
 
     def matches(self, index1=-2, index2=-1): 
         tids, p1, p2 = [], [], []
-        for tid, pts in self.tm_.tracks.iteritems(): 
+        for tid, pts in self.tm_.tracks.items(): 
             if len(pts) > abs(index1) and len(pts) > abs(index2): 
                 tids.append(tid)
                 p1.append(pts.items[index1])
@@ -210,16 +218,23 @@ class OpenCVKLT(BaseKLT):
     def reset(self): 
         self.add_features_ = True
 
+    def preprocess(self, im): 
+        return gaussian_blur(to_gray(im))
+
+    def track(self, ppts): 
+        """ Track points from the previous to the latest image """
+        return self.tracker_.track(self.ims_[-2], self.ims_[-1], ppts)
+
     @timeitmethod
     def process(self, im, detected_pts=None):
 
         # Preprocess
-        self.ims_.append(gaussian_blur(to_gray(im)))
+        self.ims_.append(self.preprocess(im))
 
         # Track object
         pids, ppts = self.tm_.ids, self.tm_.pts
         if ppts is not None and len(ppts) and len(self.ims_) == 2: 
-            pts = self.tracker_.track(self.ims_[-2], self.ims_[-1], ppts)
+            pts = self.track(ppts)
 
             # Check bounds
             valid = finite_and_within_bounds(pts, im.shape[:2])
@@ -298,33 +313,426 @@ class MeshKLT(OpenCVKLT):
 
         return out
 
+class StereoKLT(OpenCVKLT): 
+    """
+    Stereo KLT Tracker that tracks features temporally in the left
+    image (as in OpenCVKLT), and sparsely matches the left tracks into
+    the right image of a rectified stereo pair. 
+
+    The left image is preprocessed once per frame, and shared between 
+    the temporal (left-left) and stereo (left-right) LK passes (the 
+    python bindings of calcOpticalFlowPyrLK only accept images, and 
+    not the pyramids from buildOpticalFlowPyramid). 
+    Stereo matches are constrained to lie on the same rectified row 
+    (within row_threshold), and are warm-started from the track's 
+    previous disparity. 
+
+        row_threshold:  Maximum row deviation (px) for rectified matches
+        min_disparity:  Minimum valid disparity (px)
+        max_disparity:  Maximum valid disparity (px)
+        fb_threshold:   Left-right-left consistency threshold (px), 
+                        disabled if <= 0
+
+    """
+    def __init__(self, 
+                 detector=BaseKLT.default_detector, 
+                 tracker=BaseKLT.default_tracker, 
+                 camera=None, row_threshold=1.0, 
+                 min_disparity=0.5, max_disparity=128.0, fb_threshold=1.0, 
+                 min_track_length=2, max_track_length=4, min_tracks=1200, mask_size=9): 
+        OpenCVKLT.__init__(self, detector, tracker, 
+                           min_track_length=min_track_length, max_track_length=max_track_length, 
+                           min_tracks=min_tracks, mask_size=mask_size)
+
+        if not isinstance(self.tracker_, LKTracker): 
+            raise TypeError('StereoKLT requires an LKTracker, provided {:}'
+                            .format(type(self.tracker_).__name__))
+
+        # Stereo params
+        self.camera_ = camera
+        self.row_threshold_ = row_threshold
+        self.min_disparity_ = min_disparity
+        self.max_disparity_ = max_disparity
+        self.fb_threshold_ = fb_threshold
+
+        # Latest stereo matches
+        self.ids_ = np.empty(0, dtype=np.int64)
+        self.pts_ = np.empty((0,2), dtype=np.float32)
+        self.disparities_ = np.empty(0, dtype=np.float32)
+
+    @classmethod
+    def from_params(cls, camera=None, row_threshold=1.0, 
+                    min_disparity=0.5, max_disparity=128.0, fb_threshold=1.0, 
+                    detector_params=BaseKLT.default_detector_params, 
+                    tracker_params=BaseKLT.default_tracker_params,
+                    min_track_length=2, max_track_length=4, min_tracks=1200, mask_size=9): 
+
+        # Setup detector and tracker
+        detector = FeatureDetector(**detector_params)
+        tracker = OpticalFlowTracker.create(**tracker_params)
+        return cls(detector, tracker, camera=camera, row_threshold=row_threshold, 
+                   min_disparity=min_disparity, max_disparity=max_disparity, 
+                   fb_threshold=fb_threshold, 
+                   min_track_length=min_track_length, max_track_length=max_track_length, 
+                   min_tracks=min_tracks, mask_size=mask_size)
+
+    def initial_right_pts(self, ids, pts): 
+        """
+        Initialize right image locations with the previously 
+        estimated disparities of each track (if available)
+        """
+        rpts = pts.astype(np.float32).copy()
+        if not len(self.ids_) or not len(ids): 
+            return rpts
+
+        sinds = np.argsort(self.ids_)
+        sids = self.ids_[sinds]
+        pos = np.minimum(np.searchsorted(sids, ids), len(sids)-1)
+        found = sids[pos] == ids
+        disp = self.disparities_[sinds][pos]
+        found = np.bitwise_and(found, np.isfinite(disp))
+        rpts[found,0] -= disp[found]
+        return rpts
+
+    def match_stereo(self, left, right, ids, pts): 
+        """
+        Sparse LK from the left to the right image, with a 
+        rectified row constraint. Returns per-point disparities 
+        (NaN where no valid match was found)
+        """
+        disp = np.ones(len(pts), dtype=np.float32) * np.nan
+        if not len(pts): 
+            return disp
+
+        lk_params = self.tracker_.lk_params_
+        p0 = pts.astype(np.float32)
+        p1, st1, _ = cv2.calcOpticalFlowPyrLK(left, right, p0, self.initial_right_pts(ids, p0), 
+                                              flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **lk_params)
+        valid = st1.ravel() > 0
+
+        # Left-right-left consistency
+        if self.fb_threshold_ > 0: 
+            p0r, st0, _ = cv2.calcOpticalFlowPyrLK(right, left, p1, p0.copy(), 
+                                                   flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **lk_params)
+            valid = np.bitwise_and(valid, st0.ravel() > 0)
+            valid = np.bitwise_and(valid, (np.fabs(p0r-p0) < self.fb_threshold_).all(axis=1))
+
+        # Rectified row constraint, and disparity bounds
+        d = p0[:,0] - p1[:,0]
+        valid = np.bitwise_and(valid, np.fabs(p0[:,1] - p1[:,1]) < self.row_threshold_)
+        valid = np.bitwise_and(valid, np.bitwise_and(d >= self.min_disparity_, 
+                                                     d <= self.max_disparity_))
+        disp[valid] = d[valid]
+        return disp
+
+    def process(self, im, im_right, detected_pts=None): 
+        """
+        Track features temporally in the left image, and 
+        match them to the right image. Returns the track ids, 
+        left points and their disparities (NaN if unmatched)
+        """
+        ids, pts = OpenCVKLT.process(self, im, detected_pts=detected_pts)
+
+        # Stereo pass (reuses the preprocessed left image)
+        disp = self.match_stereo(self.ims_[-1], self.preprocess_right(im_right), ids, pts)
+
+        self.ids_, self.pts_, self.disparities_ = np.int64(ids), pts, disp
+        return self.ids_, self.pts_, self.disparities_
+
+    def preprocess_right(self, im): 
+        return OpenCVKLT.preprocess(self, im)
+
+    @property
+    def camera(self): 
+        return self.camera_
+
+    @property
+    def latest_disparities(self): 
+        return self.disparities_
+
+    @property
+    def landmarks(self): 
+        """
+        Returns the track ids and 3D landmarks (in the left camera frame) 
+        of the tracks with a valid stereo match
+        """
+        if self.camera_ is None: 
+            raise RuntimeError('StereoKLT camera is not set, cannot reconstruct landmarks')
+
+        valid = np.isfinite(self.disparities_)
+        if not valid.any(): 
+            return np.empty(0, dtype=np.int64), np.empty((0,3), dtype=np.float32)
+
+        xyd = np.hstack([self.pts_[valid], self.disparities_[valid].reshape(-1,1)])
+        return self.ids_[valid], self.camera_.reconstruct_sparse(xyd)
+
+class MultiStreamKLT(object): 
+    """
+    Multi-stream KLT tracker that owns one KLT tracker per camera stream, 
+    and steps all of them concurrently (per timestep) in a thread pool. 
+    
+    Feature detection (FAST) and tracking (calcOpticalFlowPyrLK) release 
+    the GIL, so streams are tracked in parallel. Each stream maintains 
+    its own TrackManager, and therefore its own track-id namespace.
+
+        klt = MultiStreamKLT.from_params(num_streams=4)
+        for ims in stream_reader: 
+            ids, pts, timings = klt.process(ims)
+
+    """
+    def __init__(self, trackers, num_workers=None): 
+        if not len(trackers): 
+            raise ValueError('MultiStreamKLT requires at least one tracker')
+
+        # Trackers cannot share KLT/detector/tracker instances across threads
+        if len(set(id(tracker) for tracker in trackers)) != len(trackers): 
+            raise ValueError('MultiStreamKLT requires a separate KLT instance per stream')
+        for attr in ['detector_', 'tracker_']: 
+            if len(set(id(getattr(tracker, attr)) for tracker in trackers)) != len(trackers): 
+                raise ValueError('MultiStreamKLT trackers share the same {:} instance, '
+                                 'use MultiStreamKLT.from_params() to instantiate trackers'
+                                 .format(attr.rstrip('_')))
+        
+        self.trackers_ = list(trackers)
+        self.num_workers_ = num_workers if num_workers is not None else len(self.trackers_)
+        self.pool_ = ThreadPool(processes=self.num_workers_)
+        self.timings_ = np.zeros(len(self.trackers_), dtype=np.float64)
+
+    @classmethod
+    def from_params(cls, num_streams, klt_cls=OpenCVKLT, num_workers=None, 
+                    detector_params=BaseKLT.default_detector_params, 
+                    tracker_params=BaseKLT.default_tracker_params,
+                    min_track_length=2, max_track_length=4, min_tracks=1200, mask_size=9): 
+        """
+        Setup independent detector and tracker instances for each stream
+        """
+        trackers = [klt_cls.from_params(detector_params=detector_params, 
+                                        tracker_params=tracker_params, 
+                                        min_track_length=min_track_length, 
+                                        max_track_length=max_track_length, 
+                                        min_tracks=min_tracks, mask_size=mask_size)
+                    for _ in range(num_streams)]
+        return cls(trackers, num_workers=num_workers)
+
+    def __len__(self): 
+        return len(self.trackers_)
+
+    def __getitem__(self, stream_idx): 
+        return self.trackers_[stream_idx]
+
+    def __del__(self): 
+        self.close()
+
+    def close(self): 
+        if getattr(self, 'pool_', None) is not None: 
+            self.pool_.close()
+            self.pool_.join()
+            self.pool_ = None
+
+    def reset(self): 
+        for tracker in self.trackers_: 
+            tracker.reset()
+
+    def register_on_track_delete_callback(self, stream_idx, cb): 
+        self.trackers_[stream_idx].register_on_track_delete_callback(cb)
+
+    def _process_stream(self, args): 
+        stream_idx, im, detected_pts = args
+        st = time.time()
+        ids, pts = self.trackers_[stream_idx].process(im, detected_pts=detected_pts)
+        return ids, pts, time.time() - st
+
+    def process(self, ims, detected_pts=None): 
+        """
+        Track features for a single timestep across all streams. 
+
+        ims:            List of images, one for each stream
+        detected_pts:   Optional list of pre-detected features, one for each stream
+        
+        Returns per-stream lists of track ids, points and 
+        processing times (in seconds)
+        """
+        if self.pool_ is None: 
+            raise RuntimeError('MultiStreamKLT has been closed')
+
+        if len(ims) != len(self.trackers_): 
+            raise ValueError('Number of images ({:}) does not match number of streams ({:})'
+                             .format(len(ims), len(self.trackers_)))
+
+        if detected_pts is None: 
+            detected_pts = [None] * len(ims)
+
+        results = self.pool_.map(self._process_stream, 
+                                 zip(range(len(ims)), ims, detected_pts))
+        ids, pts, timings = zip(*results)
+        self.timings_ = np.float64(timings)
+
+        return list(ids), list(pts), self.timings_
+
+    @property
+    def trackers(self): 
+        return self.trackers_
+
+    @property
+    def timings(self): 
+        return self.timings_
+
+    @property
+    def latest_ids(self): 
+        return [tracker.latest_ids for tracker in self.trackers_]
+
+    @property
+    def latest_pts(self): 
+        return [tracker.latest_pts for tracker in self.trackers_]
+
 def get_bbox(pts): 
     x1, x2, y1, y2 = np.min(pts[:,0]), np.max(pts[:,0]), np.min(pts[:,1]), np.max(pts[:,1]) 
     return np.int64([x1, y1, x2, y2])
 
+def get_bboxes_grouped(labels, pts): 
+    """
+    Returns the bounding box of the points within each group, 
+    computed in a single pass over all points. 
+    Returns the unique (sorted) labels, and [L x 4] bboxes
+    """
+    if not len(labels): 
+        return np.empty(0, dtype=np.int64), np.empty((0,4), dtype=np.int64)
+
+    order = np.argsort(labels, kind='mergesort')
+    slabels, spts = labels[order], pts[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(slabels)) + 1]
+    x1, y1 = np.minimum.reduceat(spts[:,0], starts), np.minimum.reduceat(spts[:,1], starts)
+    x2, y2 = np.maximum.reduceat(spts[:,0], starts), np.maximum.reduceat(spts[:,1], starts)
+    return slabels[starts], np.vstack([x1, y1, x2, y2]).T.astype(np.int64)
+
 def inside_bboxes(pts, bboxes): 
     """    
     Returns the set of points that are within each bbox
     B x N boolean mask where B bboxes, N pts    
     """
     try: 
-        bboxes = bboxes.astype(np.float32)
-        return np.vstack([((pts[:,0] >= x1) & (pts[:,0] <= x2) & (pts[:,1] >= y1) & (pts[:,1] <= y2))
-                          for (x1, y1, x2, y2) in izip(bboxes[:,0], bboxes[:,1], bboxes[:,2], bboxes[:,3])])
+        bboxes = np.float32(bboxes).reshape(-1,4)
+        xs, ys = pts[:,0], pts[:,1]
+        return (xs >= bboxes[:,0:1]) & (xs <= bboxes[:,2:3]) & \
+            (ys >= bboxes[:,1:2]) & (ys <= bboxes[:,3:4])
     except: 
         return np.array([])
 
+def inside_bboxes_inds(pts, bboxes): 
+    """
+    Returns the (bbox index, point index) pairs for every point 
+    that lies within each bbox. 
+
+    Unlike inside_bboxes (B x N), points are sorted along x once, 
+    and each bbox only visits the points within its x-extent, 
+    i.e. O(N log N + B log N + matches)
+    """
+    empty = np.empty(0, dtype=np.int64)
+    if bboxes is None or not len(bboxes) or not len(pts): 
+        return empty, empty
+
+    bboxes = np.float32(bboxes).reshape(-1,4)
+    order = np.argsort(pts[:,0], kind='mergesort')
+    xs = pts[order,0]
+
+    # Candidate points within the x-extent of each bbox
+    lo = np.searchsorted(xs, bboxes[:,0], side='left')
+    hi = np.searchsorted(xs, bboxes[:,2], side='right')
+    counts = np.maximum(hi - lo, 0)
+    if not counts.sum(): 
+        return empty, empty
+
+    binds = np.repeat(np.arange(len(bboxes), dtype=np.int64), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pinds = order[np.repeat(lo, counts) + offsets]
+
+    # Retain candidates within the y-extent
+    ys = pts[pinds,1]
+    valid = (ys >= bboxes[binds,1]) & (ys <= bboxes[binds,3])
+    return binds[valid], pinds[valid].astype(np.int64)
+
 class BoundingBoxKLT(OpenCVKLT): 
     """
     KLT Tracker with bounding boxes
+
+    Hulls are backed by a sparse track-id -> hull-id index 
+    (member_tids_, member_hids_ pairs), that is propagated along with 
+    the TrackManager. Hull updates are performed over all hulls at 
+    once, and scale with the number of tracked points (and members), 
+    not the product of the number of hulls and tracks. 
     """
     def __init__(self, *args, **kwargs): 
         OpenCVKLT.__init__(self, *args, **kwargs)
-        self.hulls_ = {}
+
+        # Hull ids, and bboxes
+        self.hids_ = np.empty(0, dtype=np.int64)
+        self.hboxes_ = np.empty((0,4), dtype=np.int64)
+        self.max_hid_ = -1
+
+        # Track-id -> hull-id index
+        self.member_tids_ = np.empty(0, dtype=np.int64)
+        self.member_hids_ = np.empty(0, dtype=np.int64)
 
     @property
     def initialized(self): 
-        return len(self.bboxes_) > 0
+        return len(self.hids_) > 0
+
+    def _set_members(self, hids, pinds, ids): 
+        """
+        Set unique (hull-id, point index) memberships 
+        """
+        N = max(len(ids), 1)
+        keys = np.unique(hids * N + pinds)
+        hids, pinds = keys // N, keys % N
+        self.member_hids_, self.member_tids_ = hids, ids[pinds]
+        return hids, pinds
+
+    def propagate_hulls(self, ids, pts): 
+        """
+        Update hulls based on the newly tracked locations
+        """
+        # Find the point indices of previously tracked hull members
+        # that are still being tracked
+        if not len(ids) or not len(self.member_tids_): 
+            empty = np.empty(0, dtype=np.int64)
+            self._set_members(empty, empty, ids)
+            self.hids_, self.hboxes_ = empty, np.empty((0,4), dtype=np.int64)
+            return
+
+        sinds = np.argsort(ids)
+        sids = ids[sinds]
+        pos = np.minimum(np.searchsorted(sids, self.member_tids_), len(sids)-1)
+        alive = sids[pos] == self.member_tids_
+        mhids, mpinds = self.member_hids_[alive], sinds[pos[alive]]
+
+        # Update the hulls to the latest points 
+        # (hulls with no common tracked ids are deleted)
+        hids, hboxes = get_bboxes_grouped(mhids, pts[mpinds])
+
+        # Update the hull ids with the points within the hull, 
+        # so that the propagation is more prolonged
+        binds, pinds = inside_bboxes_inds(pts, hboxes)
+        self._set_members(np.r_[mhids, hids[binds]], np.r_[mpinds, pinds], ids)
+        self.hids_, self.hboxes_ = hids, hboxes
+
+    def add_hulls(self, ids, pts, bboxes): 
+        """
+        Add new hulls for the points within each of the provided bboxes
+        """
+        if bboxes is None or not len(bboxes): 
+            return
+
+        binds, pinds = inside_bboxes_inds(pts, bboxes)
+        hids = self.max_hid_ + 1 + binds
+        self.max_hid_ += len(bboxes)
+        if not len(hids): 
+            return
+
+        nhids, nhboxes = get_bboxes_grouped(hids, pts[pinds])
+        self.hids_ = np.r_[self.hids_, nhids]
+        self.hboxes_ = np.vstack([self.hboxes_, nhboxes])
+        self.member_hids_ = np.r_[self.member_hids_, hids]
+        self.member_tids_ = np.r_[self.member_tids_, ids[pinds]]
 
     # @timeitmethod
     def process(self, im, bboxes=None): 
@@ -335,87 +743,31 @@ class BoundingBoxKLT(OpenCVKLT):
         OpenCVKLT.process(self, im, detected_pts=None)
 
         # Degenerate case where no points are available to propagate
-        ids, pts, flow = self.latest_ids, self.latest_pts, self.latest_flow
-
-        # 1. Update hulls based on the newly tracked locations and 
-        for hid in self.hulls_.keys(): 
-
-            # Find the intersection of previously tracked and currently tracking
-            # TODO: can potentially update the ids within the newly tracked hull, 
-            # so that the propagation is more prolonged
-            tids = self.hulls_[hid].ids
-            common_inds, = np.where(np.in1d(ids, tids))
-
-            # Delete the hull if no common tracked ids
-            if not len(common_inds): 
-                self.hulls_.pop(hid)
-                continue
-
-            # Update the hull to the latest points
-            # TODO: can update the ids as well so that 
-            # the tracking is more prolonged
-            vpts = pts[common_inds]
-            vbox = get_bbox(vpts)
-            valid_pts = inside_bboxes(pts, [vbox])
-            vinds, = np.where(valid_pts.ravel())
-            vids = ids[np.r_[common_inds, vinds]]
-
-            self.hulls_[hid].pts = vpts
-            self.hulls_[hid].bbox = vbox
-            self.hulls_[hid].ids = vids
+        ids, pts = np.int64(self.latest_ids), self.latest_pts
+
+        # 1. Update hulls based on the newly tracked locations
+        self.propagate_hulls(ids, pts)
 
         # 2. Add new hulls that are provided, and keep old tracked ones
-        max_id = len(self.hulls_)
-        
-        # # Find the bounding boxes that are relatively new (IoU < 0.3)
-        # if len(self.hulls_) and bboxes is not None: 
-        #     hbboxes = np.vstack([hull.bbox for hull in self.hulls_.itervalues()])
-        #     HB = brute_force_match(hbboxes, bboxes, 
-        #                            match_func=lambda x,y: intersection_over_union(x, y),
-        #                            dtype=np.float32)
-        #     newinds, = np.where(HB.max(axis=0) < 0.3)
-        #     bboxes = bboxes[newinds]
-
-        valid_mask = inside_bboxes(pts, bboxes)
-        for bidx, valid in enumerate(valid_mask):
-            vids, vpts = ids[valid], pts[valid], 
-            # vis = to_color(im)
-            # vis = draw_features(vis, vpts)
-            # imshow_cv('bbox_feats', vis, block=True)
-            if len(vpts): 
-                self.hulls_[max_id + bidx] = AttrDict(ids=vids, pts=vpts, bbox=get_bbox(vpts)) # bbox=bboxes[bidx])
+        self.add_hulls(ids, pts, bboxes)
 
         return self.ids, self.bboxes
 
     @property
     def bboxes(self): 
-        try: 
-            hboxes = np.vstack([ hull.bbox for hull in self.hulls_.itervalues() ]).reshape(-1,4)
-        except: 
-            hboxes = np.empty(shape=(0,4), dtype=np.int32)
-        return hboxes
+        return self.hboxes_
 
     @property
     def ids(self): 
-        try: 
-            hids = self.hulls_.keys()
-        except: 
-            hids = []
-        return hids
+        return self.hids_
 
-    def visualize(self, vis, colored=True): 
+    def visualize(self, vis, colored=True, scale=1.0): 
 
-        try: 
-            tids = set(self.ids)
-        except: 
-            return vis
-
-        for hid, hbox in izip(self.ids, self.bboxes): 
+        vis = super(BoundingBoxKLT, self).visualize(vis, colored=colored, scale=scale)
+        for hbox in (self.bboxes * scale).astype(np.int64): 
             cv2.rectangle(vis, (hbox[0], hbox[1]), (hbox[2], hbox[3]), (0,255,0), 1)
 
-        vis = super(BoundingBoxKLT, self).viz(vis, colored=colored)
-
-        # for tid, pts in self.tm_.tracks.iteritems(): 
+        # for tid, pts in self.tm_.tracks.items(): 
         #     if tid not in tids: continue
         #     cv2.polylines(vis, [np.vstack(pts.items).astype(np.int32)[-4:]], False, 
         #                   (0,255,0), thickness=1)
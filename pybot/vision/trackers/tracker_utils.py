@@ -72,6 +72,28 @@ class TrackManager(object):
         # {track_id : , IndexedDeque [(time_index, feature), ... ]
         self.tracks_ = defaultdict(lambda: IndexedDeque(maxlen=self.maxlen_))
 
+        # Dense ring buffer of the track history [maxlen x slots x 2], 
+        # with one slot (column) per live track, and its total length
+        self.slots_ = {}
+        self.free_slots_ = []
+        self.history_ = np.empty((self.maxlen_, 0, 2), dtype=np.float32)
+        self.slot_lengths_ = np.empty(0, dtype=np.int64)
+
+    def _allocate_slot(self, tid): 
+        if not len(self.free_slots_): 
+            # Grow ring buffer capacity
+            cap = self.history_.shape[1]
+            ncap = max(64, cap * 2)
+            history = np.empty((self.maxlen_, ncap, 2), dtype=np.float32)
+            history[:, :cap] = self.history_
+            self.history_ = history
+            self.slot_lengths_ = np.r_[self.slot_lengths_, np.zeros(ncap-cap, dtype=np.int64)]
+            self.free_slots_ = list(range(ncap-1, cap-1, -1))
+
+        slot = self.free_slots_.pop()
+        self.slots_[tid] = slot
+        return slot
+
     def add(self, pts, ids=None, prune=True): 
         # Add only if valid and non-zero
         if not len(pts): 
@@ -89,8 +111,18 @@ class TrackManager(object):
             self.max_id_ = N + max_id - 1
         
         # Add pts to track
-        for tid, pt in zip(tids, pts): 
-            self.tracks_[tid].append(self.index_, pt)
+        slots = np.empty(N, dtype=np.int64)
+        lengths = np.empty(N, dtype=np.int64)
+        for idx, (tid, pt) in enumerate(zip(tids, pts)): 
+            track = self.tracks_[tid]
+            track.append(self.index_, pt)
+            slot = self.slots_.get(tid)
+            slots[idx] = slot if slot is not None else self._allocate_slot(tid)
+            lengths[idx] = track.length
+
+        # Write pts to the ring buffer
+        self.history_[(lengths-1) % self.maxlen_, slots] = pts
+        self.slot_lengths_[slots] = lengths
 
         # If features are propagated
         if prune: 
@@ -102,10 +134,11 @@ class TrackManager(object):
     def prune(self): 
         # Remove tracks that are not most recent
         deleted_tracks = {}
-        for tid, track in self.tracks_.items(): 
+        for tid, track in list(self.tracks_.items()): 
             if track.latest_index < self.index_: 
                 deleted_tracks[tid] = deepcopy(self.tracks[tid])
                 del self.tracks[tid]
+                self.free_slots_.append(self.slots_.pop(tid))
 
         self.on_delete_cb_(deleted_tracks)
                 
@@ -123,7 +156,7 @@ class TrackManager(object):
         try: 
             return np.vstack([ track.item(-1)-track.item(-2) 
                                if track.length > 1 else np.zeros(2)
-                               for track in self.tracks_.itervalues() 
+                               for track in self.tracks_.values() 
                            ])
         except: 
             return np.array([])
@@ -131,17 +164,36 @@ class TrackManager(object):
     @property
     def pts(self): 
         try: 
-            return np.vstack([ track.latest_item for track in self.tracks_.itervalues() ])
+            return np.vstack([ track.latest_item for track in self.tracks_.values() ])
         except: 
             return np.array([])
         
     @property
     def ids(self): 
-        return np.array(self.tracks_.keys())
+        return np.array(list(self.tracks_.keys()))
+
+    def history(self, maxlen=None): 
+        """
+        Returns the [K x T x 2] history of the latest T points 
+        of each track (ordered as ids), read from the ring buffer. 
+        Tracks shorter than T are padded with their oldest point. 
+        """
+        T = self.maxlen_ if maxlen is None else max(1, min(maxlen, self.maxlen_))
+        if not len(self.tracks_): 
+            return np.empty((0, T, 2), dtype=np.float32)
+
+        slots = np.int64([ self.slots_[tid] for tid in self.tracks_.keys() ])
+        lengths = self.slot_lengths_[slots]
+        
+        # Write indices of the latest T points, clipped to
+        # the oldest point still available in the ring buffer
+        oldest = np.maximum(lengths - self.maxlen_, 0)
+        t = np.maximum(lengths[:,np.newaxis] - T + np.arange(T), oldest[:,np.newaxis])
+        return self.history_[t % self.maxlen_, slots[:,np.newaxis]]
 
     @property
     def lengths(self): 
-        return np.int32([ track.length for track in self.tracks_.itervalues() ])
+        return np.int32([ track.length for track in self.tracks_.values() ])
 
     def confident_tracks(self, min_length=4): 
         inds, = np.where(self.lengths >= min_length)
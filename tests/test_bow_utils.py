@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from pybot.vision.bow_utils import BoWVectorizer
+
+
+def tiny_vectorizer(method, levels=(1,)):
+    """ Two codewords in 2-D, unit variances, and uniform priors """
+    bow = BoWVectorizer(K=2, method=method, levels=levels)
+    bow.codebook_ = np.float32([[0, 0], [10, 0]])
+    bow.variances_ = np.ones((2, 2), dtype=np.float32)
+    bow.weights_ = np.float32([0.5, 0.5])
+    bow._setup()
+    return bow
+
+
+def normalized(v):
+    v = np.sign(v) * np.sqrt(np.fabs(v))
+    return v / np.linalg.norm(v)
+
+
+# Codes [0, 0, 1], residuals (1,0), (0,1), (-1,0)
+X = np.float32([[1, 0], [0, 1], [9, 0]])
+
+
+def test_bow_project_tiny_codebook():
+    bow = tiny_vectorizer('bow')
+    assert list(bow.quantize(X)) == [0, 0, 1]
+    np.testing.assert_allclose(bow.project(X), np.sqrt([2., 1.]) / np.sqrt(3), rtol=1e-6)
+
+    # Spatial pyramid: whole image, then 2x2 cells
+    bow = tiny_vectorizer('bow', levels=(1, 2))
+    pts = np.float32([[1, 1], [1, 1], [15, 15]])
+    hist = np.float32([2, 1, 2, 0, 0, 0, 0, 0, 0, 1])
+    np.testing.assert_allclose(bow.project(X, pts=pts, shape=(16, 16)),
+                               np.sqrt(hist) / np.linalg.norm(np.sqrt(hist)), rtol=1e-6)
+    assert bow.dimension == 10
+
+
+def test_vlad_project_tiny_codebook():
+    bow = tiny_vectorizer('vlad')
+    s = 1 / np.sqrt(2)
+    expected = normalized(np.float32([s, s, -1, 0]))
+    np.testing.assert_allclose(bow.project(X), expected, rtol=1e-5)
+
+
+def test_fisher_project_tiny_codebook():
+    bow = tiny_vectorizer('fisher')
+    N, w = 3., 0.5
+    S1 = np.float32([[1, 1], [-1, 0]]) / (N * np.sqrt(w))
+    S2 = np.float32([[-1, -1], [0, -1]]) / (N * np.sqrt(2 * w))
+    expected = normalized(np.hstack([S1, S2]).ravel())
+    np.testing.assert_allclose(bow.project(X), expected, rtol=1e-5, atol=1e-7)
+
+
+@pytest.mark.parametrize('method', BoWVectorizer.methods)
+def test_bow_save_load(tmpdir, method):
+    rng = np.random.RandomState(0)
+    desc = np.float32(rng.rand(300, 3))
+    bow = BoWVectorizer(K=4, method=method, levels=(1, 2),
+                        quantizer='kdtree', eps=0.1).build(desc)
+
+    fn = str(tmpdir.join('bow.h5'))
+    bow.save(fn)
+    loaded = BoWVectorizer.load(fn)
+    assert (loaded.method, loaded.levels, loaded.dictionary_size) == (method, (1, 2), 4)
+    assert loaded.quantizer_ == 'kdtree' and loaded.eps_ == pytest.approx(0.1)
+    np.testing.assert_array_equal(loaded.codebook, bow.codebook)
+
+    pts = rng.randint(0, 32, size=(50, 2))
+    np.testing.assert_array_equal(loaded.quantize(desc[:50]), bow.quantize(desc[:50]))
+    np.testing.assert_allclose(loaded.project(desc[:50], pts=pts, shape=(32, 32)),
+                               bow.project(desc[:50], pts=pts, shape=(32, 32)), rtol=1e-6)
+
+
+@pytest.mark.parametrize('method', BoWVectorizer.methods)
+def test_project_regions_matches_cropped_project(method):
+    rng = np.random.RandomState(1)
+    H, W, step = 64, 80, 4
+    desc = np.float32(rng.rand(600, 3))
+    pts = np.c_[rng.randint(0, W, 600), rng.randint(0, H, 600)]
+    bow = BoWVectorizer(K=4, method=method, levels=(1, 2)).build(desc)
+
+    # Boxes (inclusive [x1,y1,x2,y2]) whose pyramid cells are aligned
+    # to the step grid
+    bboxes = np.float32([[8, 4, 39, 35], [0, 0, 79, 63], [40, 24, 71, 55]])
+    codes = bow.project_regions(desc, pts, (H, W), bboxes, step=step)
+    assert codes.shape == (len(bboxes), bow.dimension)
+
+    for (x1, y1, x2, y2), code in zip(np.int64(bboxes), codes):
+        inside = (pts[:,0] >= x1) & (pts[:,0] <= x2) & \
+                 (pts[:,1] >= y1) & (pts[:,1] <= y2)
+        expected = bow.project(desc[inside], pts=pts[inside] - [x1, y1],
+                               shape=(y2 - y1 + 1, x2 - x1 + 1))
+        # Compare before the power (signed square-root) normalization,
+        # that amplifies float32 round-off of near-zero statistics
+        if method != 'bow':
+            code, expected = np.sign(code) * code ** 2, np.sign(expected) * expected ** 2
+        np.testing.assert_allclose(code, expected, rtol=1e-4, atol=1e-5)
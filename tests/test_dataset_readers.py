@@ -0,0 +1,265 @@
+import os
+import numpy as np
+import pytest
+
+from pybot.utils.dataset_readers import LRUCache, DatasetReader, \
+    PackedSequenceWriter, PackedSequenceReader
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(maxlen=2)
+    for key in range(3):
+        cache.put(key, np.zeros(10))
+    assert 0 not in cache and 1 in cache and 2 in cache
+
+    # Access refreshes recency
+    cache.get(1)
+    cache.put(3, np.zeros(10))
+    assert 1 in cache and 2 not in cache
+    assert cache.stats['hits'] == 1
+
+    cache = LRUCache(maxbytes=250)
+    for key in range(4):
+        cache.put(key, np.zeros(10))
+    assert len(cache) == 3 and cache.nbytes == 240
+    cache.put(4, np.zeros(100))
+    assert len(cache) == 1 and 4 in cache
+
+
+def test_lru_cache_readonly_and_generation():
+    cache = LRUCache(maxlen=4)
+    item = (np.zeros(3), [np.ones(2)])
+    cache.put(0, item)
+    with pytest.raises(ValueError):
+        cache.get(0)[0][0] = 1
+    with pytest.raises(ValueError):
+        cache.get(0)[1][0][0] = 1
+
+    # Values computed before an invalidate() are dropped
+    generation = cache.generation
+    cache.invalidate(0)
+    assert 0 not in cache
+    cache.put(0, np.zeros(3), generation=generation)
+    assert 0 not in cache
+    cache.put(0, np.zeros(3), generation=cache.generation)
+    assert 0 in cache
+
+
+def test_dataset_reader_cache():
+    calls = []
+    def process_cb(fn):
+        calls.append(fn)
+        return np.arange(3) + len(calls)
+
+    reader = DatasetReader(process_cb=process_cb, files=['a', 'b', 'c'],
+                           cache_size=2)
+    first = reader[0]
+    assert reader[0] is first and len(calls) == 1
+    assert not first.flags.writeable
+
+    reader.invalidate(0)
+    assert reader[0] is not first and len(calls) == 2
+
+    reader.prefetch_hint([1, 2])
+    items = list(reader.iterinds(np.arange(1, 3)))
+    assert sorted(calls[2:]) == ['b', 'c']
+    assert sorted(int(x[0]) for x in items) == [3, 4]
+    reader.close()
+
+
+def test_packed_sequence_roundtrip(tmpdir):
+    rng = np.random.RandomState(0)
+    frames = [dict(im=bytes(rng.bytes(rng.randint(1, 3000))),
+                   pc=np.float32(rng.rand(rng.randint(0, 200), 4)),
+                   depth=np.uint16(rng.randint(0, 1000, (6, 8))))
+              for _ in range(20)]
+    poses = rng.rand(20, 12)
+
+    fn = str(tmpdir.join('seq.pack'))
+    writer = PackedSequenceWriter(fn, meta=dict(sequence='00'), chunk_bytes=4096)
+    for frame in frames:
+        writer.append(**frame)
+
+    # Invalid frames are rejected before anything is written
+    size = writer.f_.tell()
+    for frame in [dict(im=b'x'), dict(im=b'x', pc=np.zeros((1,4), np.float32),
+                                      depth=np.zeros((1,1,1,1), np.uint16)),
+                  dict(im=np.zeros(3), pc=frames[0]['pc'], depth=frames[0]['depth'])]:
+        with pytest.raises(ValueError):
+            writer.append(**frame)
+    assert writer.f_.tell() == size
+    writer.add_array('poses', poses)
+    writer.close()
+
+    for chunked in [False, True]:
+        reader = PackedSequenceReader(fn, decode_cb=lambda field, buf: buf.tobytes(),
+                                      chunked=chunked)
+        assert len(reader) == len(frames) and reader.meta['sequence'] == '00'
+        assert reader.num_chunks > 1
+        assert sorted(reader.fields) == ['depth', 'im', 'pc']
+        assert reader.is_encoded('im') and not reader.is_encoded('pc')
+        for idx in [0, 5, 19, 3, 4]:
+            assert reader.read('im', idx) == frames[idx]['im']
+            for name in ['pc', 'depth']:
+                item = reader.read(name, idx)
+                assert item.dtype == frames[idx][name].dtype
+                np.testing.assert_array_equal(item, frames[idx][name])
+                assert not item.flags.writeable
+        np.testing.assert_array_equal(reader.array('poses'), poses)
+        assert len(list(reader.iteritems('pc', every_k_frames=3, reverse=True))) == 7
+
+
+def test_kitti_pack_sequence_missing_velodyne(tmpdir):
+    import cv2
+    from pybot.utils.db_utils import AttrDict
+    from pybot.utils.dataset.kitti import kitti_pack_sequence, \
+        KITTIPackedDatasetReader
+
+    files = dict(image_0=[], image_1=[], velodyne=[])
+    for idx in range(4):
+        for name in ['image_0', 'image_1']:
+            fn = str(tmpdir.join(name, '%06i.png' % idx).ensure())
+            cv2.imwrite(fn, np.full((8, 10), idx, dtype=np.uint8))
+            files[name].append(fn)
+    for idx in [0, 2]:
+        fn = str(tmpdir.join('velodyne', '%06i.bin' % idx).ensure())
+        np.float32(np.full((3, 4), idx)).tofile(fn)
+        files['velodyne'].append(fn)
+
+    reader = lambda files: DatasetReader(process_cb=lambda fn: fn, files=files)
+    dataset = AttrDict(stereo=AttrDict(left=reader(files['image_0']),
+                                       right=reader(files['image_1'])),
+                       velodyne=reader(files['velodyne']),
+                       sequence='00', scale=1.0, pose_array=None)
+    fn = str(tmpdir.join('00.pack'))
+    kitti_pack_sequence(dataset, fn)
+
+    frames = list(KITTIPackedDatasetReader(fn).iterframes())
+    assert [len(frame.velodyne) for frame in frames] == [3, 0, 3, 0]
+    assert [int(frame.left[0,0]) for frame in frames] == [0, 1, 2, 3]
+
+
+def test_read_manifest_invalidation(tmpdir, monkeypatch):
+    import pybot.utils.dataset_readers as dr
+
+    root, cache = tmpdir.mkdir('data'), str(tmpdir.join('cache'))
+    for idx in [10, 2, 1]:
+        root.join('seq', '%i.png' % idx).ensure()
+    read = lambda **kwargs: [os.path.relpath(fn, str(root)) for fn in
+                             dr.read_manifest(str(root), cache_dir=cache, **kwargs)]
+    assert read() == ['seq/1.png', 'seq/2.png', 'seq/10.png']
+    assert len(os.listdir(cache)) == 1
+    assert not [fn for fn in os.listdir(str(root)) if fn.startswith('.')]
+
+    # Cached manifest is used as long as the directories are unchanged
+    scans = []
+    scan_dir = dr.scan_dir
+    monkeypatch.setattr(dr, 'scan_dir', lambda *args, **kwargs: (
+        scans.append(args), scan_dir(*args, **kwargs))[1])
+    assert read() == ['seq/1.png', 'seq/2.png', 'seq/10.png'] and not len(scans)
+
+    # Added, removed and renamed files invalidate the manifest
+    root.join('seq', '3.png').ensure()
+    assert read() == ['seq/1.png', 'seq/2.png', 'seq/3.png', 'seq/10.png']
+    root.join('seq', '2.png').remove()
+    assert read() == ['seq/1.png', 'seq/3.png', 'seq/10.png']
+    root.join('seq', '3.png').rename(root.join('seq', '4.png'))
+    assert read() == ['seq/1.png', 'seq/4.png', 'seq/10.png']
+    assert len(scans) == 3
+
+    # Writing beside the dataset is opt-in
+    assert read(pattern='*.jpg', beside=True) == []
+    assert len([fn for fn in os.listdir(str(root)) if fn.startswith('.')]) == 1
+    assert read(pattern='*.jpg') == [] and len(scans) == 4
+
+
+def test_image_reader_shared_ring(tmpdir):
+    import cv2
+    from pybot.utils.dataset_readers import ImageDatasetReader
+
+    files = []
+    for idx, shape in enumerate([(8, 10), (8, 10), (16, 10)]):
+        files.append(str(tmpdir.join('%06i.png' % idx)))
+        cv2.imwrite(files[-1], np.full(shape, idx, dtype=np.uint8))
+    reader = ImageDatasetReader.from_filenames(files)
+
+    # Frames larger than the slot (sized to the first frame) fail
+    with pytest.raises(ValueError):
+        list(reader.iteritems_shared(num_workers=1))
+    assert reader.ring.num_free == reader.ring.num_slots
+
+    # Ring is rebuilt with new parameters
+    items = [im.copy() for im in reader.iteritems_shared(
+        num_workers=1, num_slots=2, slot_bytes=160)]
+    assert [im.shape for im in items] == [(8, 10), (8, 10), (16, 10)]
+    assert [int(im[0,0]) for im in items] == [0, 1, 2]
+    assert reader.ring.num_slots == 2 and len(reader.ring.slots[0]) == 160
+    reader.close()
+
+
+def test_memmap_velodyne_pc(tmpdir):
+    from pybot.utils.dataset_readers import memmap_velodyne_pc
+
+    fn = str(tmpdir.join('000000.bin'))
+    pc = np.float32(np.arange(40).reshape(10, 4))
+    pc.tofile(fn)
+    np.testing.assert_array_equal(memmap_velodyne_pc(fn), pc)
+    np.testing.assert_array_equal(memmap_velodyne_pc(fn, fields='xyz', every_k_points=3),
+                                  pc[::3, :3])
+    assert not memmap_velodyne_pc(fn).flags.writeable
+
+    fn = str(tmpdir.join('000001.bin').ensure())
+    assert memmap_velodyne_pc(fn).shape == (0, 4)
+    assert memmap_velodyne_pc(fn, fields='xyz').shape == (0, 3)
+    assert memmap_velodyne_pc(fn, fields='intensity').shape == (0,)
+
+
+def test_kitti_raw_oxts_load_matches_frames(tmpdir):
+    from pybot.utils.dataset.kitti import KITTIRawDatasetReader
+
+    formats = ['lat', 'lon', 'alt', 'roll', 'pitch', 'yaw'] + \
+              ['f%i' % j for j in range(24)]
+    tmpdir.join('oxts', 'dataformat.txt').ensure().write(
+        ''.join('%s: value\n' % fmt for fmt in formats))
+    rng = np.random.RandomState(0)
+    for idx in range(6):
+        X = np.r_[49.011 + 1e-4 * idx, 8.42 + 2e-4 * idx, 112. + 0.1 * idx,
+                  0.05 * rng.randn(2), 1.2 + 0.1 * idx, rng.randn(24)]
+        tmpdir.join('oxts', 'data', '%010i.txt' % idx).ensure().write(
+            ' '.join('%.12f' % x for x in X))
+
+    def frames(dataset):
+        return np.array([oxts.pose.matrix
+                         for oxts in dataset.iter_oxts_frames()])
+
+    # Same trajectory regardless of which path runs first
+    dataset = KITTIRawDatasetReader(str(tmpdir))
+    poses, packets = dataset.load_oxts(num_workers=2)
+    np.testing.assert_allclose(frames(dataset), poses, atol=1e-6)
+    np.testing.assert_allclose(poses[0], np.eye(4), atol=1e-9)
+    assert np.linalg.norm(poses[-1][:3,3]) > 10
+
+    dataset = KITTIRawDatasetReader(str(tmpdir))
+    per_frame = frames(dataset)
+    np.testing.assert_allclose(dataset.load_oxts()[0], per_frame, atol=1e-6)
+    np.testing.assert_allclose(packets['yaw'], 1.2 + 0.1 * np.arange(6))
+
+    # Every k-th frame, the origin remains the first frame
+    dataset = KITTIRawDatasetReader(str(tmpdir))
+    every = [oxts.pose.matrix for oxts in dataset.iter_oxts_frames(every_k_frames=2)]
+    np.testing.assert_allclose(every, poses[::2], atol=1e-6)
+
+
+def test_scan_dir_listdir_fallback(tmpdir, monkeypatch):
+    from pybot.utils import dataset_readers as dr
+
+    for fn in ['a.png', 'b.txt', 'x/c.png', 'x/y/d.png', 'z/e.png']:
+        tmpdir.join(fn).ensure()
+    expected, stamps = dr.scan_dir(str(tmpdir), pattern='*.png', num_workers=2)
+
+    monkeypatch.setattr(dr, 'scandir', dr._listdir_scandir)
+    files, fstamps = dr.scan_dir(str(tmpdir), pattern='*.png', num_workers=2)
+    assert sorted(files) == sorted(expected) and len(files) == 4
+    assert fstamps == stamps
+    assert sorted(dr.scan_dir(str(tmpdir), recursive=False)[0]) == \
+        [str(tmpdir.join('a.png'))]
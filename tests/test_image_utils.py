@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+
+from pybot.vision.image_utils import im_resize, im_read, im_decode, \
+    jpeg_shape
+
+
+def random_image(shape=(376, 1241, 3), seed=0):
+    rng = np.random.RandomState(seed)
+    im = cv2.resize(rng.randint(0, 255, (shape[0] // 8, shape[1] // 8, 3))
+                    .astype(np.uint8), (shape[1], shape[0]))
+    return im if len(shape) == 3 else cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
+
+
+def test_jpeg_shape():
+    im = random_image()
+    _, buf = cv2.imencode('.jpg', im)
+    assert jpeg_shape(buf) == im.shape[:2]
+    _, buf = cv2.imencode('.png', im)
+    assert jpeg_shape(buf) is None
+
+
+def test_im_decode_jpeg_matches_resize_shape():
+    for shape in [(376, 1241, 3), (375, 1242), (101, 99, 3)]:
+        im = random_image(shape)
+        _, buf = cv2.imencode('.jpg', im, [cv2.IMWRITE_JPEG_QUALITY, 98])
+        full = cv2.imdecode(buf, cv2.IMREAD_UNCHANGED)
+        for scale in [0.5, 0.25, 0.125, 0.3]:
+            expected = im_resize(full, scale=scale)
+            out = im_decode(buf, scale=scale)
+            assert out.shape == expected.shape
+            assert np.abs(out.astype(np.float32) - expected).mean() < 8
+
+
+def test_im_read_png_unchanged(tmpdir):
+    im = random_image()
+    fn = str(tmpdir.join('im.png'))
+    cv2.imwrite(fn, im)
+    for scale in [1.0, 0.5, 0.25]:
+        np.testing.assert_array_equal(
+            im_read(fn, scale=scale), im_resize(im, scale=scale))
+
+    fn = str(tmpdir.join('im.jpg'))
+    cv2.imwrite(fn, im)
+    assert im_read(fn, scale=0.5).shape == im_resize(im, scale=0.5).shape
+    assert im_read(fn, scale=0.5, flags=cv2.IMREAD_GRAYSCALE).shape == (188, 620)
+    assert im_read(str(tmpdir.join('missing.jpg')), scale=0.5) is None
@@ -0,0 +1,121 @@
+import cv2
+import numpy as np
+import pytest
+
+try:
+    from pybot.vision.trackers.base_klt import OpenCVKLT, StereoKLT, \
+        MultiStreamKLT, BoundingBoxKLT, get_bbox, inside_bboxes
+except (ImportError, AttributeError) as e:
+    # FeatureDetector requires the OpenCV 2.4 feature detector API
+    pytest.skip('KLT trackers unavailable: {}'.format(e), allow_module_level=True)
+
+
+def texture(shape=(120, 160), seed=0):
+    rng = np.random.RandomState(seed)
+    im = cv2.resize(np.uint8(rng.randint(0, 255, (shape[0] // 4, shape[1] // 4))),
+                    (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)
+    return cv2.GaussianBlur(im, (3, 3), 0)
+
+
+def shifted(im, dx):
+    """ Image content moved by dx pixels to the right """
+    return np.roll(im, dx, axis=1)
+
+
+def test_stereo_klt_process():
+    disparity = 6
+    klt = StereoKLT.from_params(min_tracks=200, fb_threshold=1.0)
+    im = texture()
+
+    tracked = []
+    for t in range(3):
+        left = shifted(im, 2 * t)
+        right = shifted(left, -disparity)
+        ids, pts, disp = klt.process(left, right)
+        assert len(ids) == len(pts) == len(disp)
+        tracked.append(set(ids))
+
+        # Valid (interior) matches recover the disparity
+        interior = (pts[:,0] > 20) & (pts[:,0] < 140)
+        valid = np.isfinite(disp) & interior
+        if t > 0:
+            assert valid.sum() > 10
+            assert np.median(np.fabs(disp[valid] - disparity)) < 0.5
+    assert len(tracked[1] & tracked[2]) > 10
+
+
+def test_multistream_klt_matches_independent():
+    ims = [texture(seed=seed) for seed in range(3)]
+    params = dict(min_tracks=150)
+    multi = MultiStreamKLT.from_params(num_streams=len(ims), **params)
+    single = [OpenCVKLT.from_params(**params) for _ in ims]
+
+    for t in range(4):
+        frames = [shifted(im, 2 * t) for im in ims]
+        ids, pts, timings = multi.process(frames)
+        assert len(timings) == len(ims)
+        for stream, klt in enumerate(single):
+            sids, spts = klt.process(frames[stream])
+            np.testing.assert_array_equal(ids[stream], sids)
+            np.testing.assert_array_equal(pts[stream], spts)
+    multi.close()
+
+    with pytest.raises(ValueError):
+        MultiStreamKLT([single[0], single[0]])
+
+
+class ReferenceHulls(object):
+    """ Previous per-hull grouping (hull id -> member track ids) """
+    def __init__(self):
+        self.hulls, self.max_hid = {}, -1
+
+    def process(self, ids, pts, bboxes):
+        for hid in list(self.hulls.keys()):
+            common, = np.where(np.isin(ids, self.hulls[hid]))
+            if not len(common):
+                self.hulls.pop(hid)
+                continue
+            bbox = get_bbox(pts[common])
+            inside, = np.where(inside_bboxes(pts, [bbox]).ravel())
+            self.hulls[hid] = ids[np.r_[common, inside]]
+
+        if bboxes is not None:
+            for bidx, valid in enumerate(inside_bboxes(pts, bboxes)):
+                if valid.any():
+                    self.hulls[self.max_hid + 1 + bidx] = ids[valid]
+            self.max_hid += len(bboxes)
+
+    def bboxes(self, ids, pts):
+        return dict((hid, get_bbox(pts[np.isin(ids, tids)]))
+                    for hid, tids in self.hulls.items())
+
+
+def test_bounding_box_klt_hulls_match_reference():
+    rng = np.random.RandomState(0)
+    klt, ref = BoundingBoxKLT(), ReferenceHulls()
+
+    ids, pts = np.arange(200), np.float32(rng.uniform(0, 100, (200, 2)))
+    next_id = 200
+    for t in range(8):
+        # Tracks are pruned, moved, and new tracks added
+        keep = rng.rand(len(ids)) > 0.15
+        ids, pts = ids[keep], pts[keep] + np.float32(rng.normal(0, 1, (keep.sum(), 2)))
+        nnew = rng.randint(0, 30)
+        ids = np.r_[ids, np.arange(next_id, next_id + nnew)]
+        pts = np.vstack([pts, np.float32(rng.uniform(0, 100, (nnew, 2)))])
+        next_id += nnew
+
+        xy = rng.uniform(0, 80, (2, 2))
+        bboxes = np.hstack([xy, xy + rng.uniform(5, 30, (2, 2))]) if t % 3 == 0 else None
+
+        klt.propagate_hulls(ids, pts)
+        klt.add_hulls(ids, pts, bboxes)
+        ref.process(ids, pts, bboxes)
+
+        expected = ref.bboxes(ids, pts)
+        assert sorted(expected.keys()) == list(klt.ids)
+        for hid, hbox in zip(klt.ids, klt.bboxes):
+            np.testing.assert_array_equal(hbox, expected[hid])
+            np.testing.assert_array_equal(
+                np.unique(klt.member_tids_[klt.member_hids_ == hid]),
+                np.unique(ref.hulls[hid]))
@@ -0,0 +1,62 @@
+import numpy as np
+
+from pybot.vision.geom_utils import intersection_union, \
+    intersection_over_union_matrix
+from pybot.vision.recognition.nms import nms, nms_blocked, batched_nms, \
+    soft_nms, iou_matrix
+
+
+def random_dets(n=300, seed=0):
+    rng = np.random.RandomState(seed)
+    xy = rng.uniform(0, 200, (n, 2))
+    wh = rng.uniform(5, 60, (n, 2))
+    return np.float32(np.hstack([xy, xy + wh, rng.uniform(0, 1, (n, 1))]))
+
+
+def test_iou_matrix():
+    dets = random_dets(50)
+    A = intersection_over_union_matrix(dets[:20, :4], dets[:, :4], chunk_size=7)
+    for i in range(20):
+        for j in range(len(dets)):
+            I, U = intersection_union(dets[i, :4], dets[j, :4])
+            assert abs(A[i, j] - I / U) < 1e-5
+    np.testing.assert_allclose(np.diag(A[:, :20]), 1, atol=1e-6)
+
+    # Inclusive pixel coordinates
+    boxes = np.float32([[0, 0, 9, 9], [5, 0, 14, 9], [20, 20, 29, 29]])
+    np.testing.assert_allclose(iou_matrix(boxes[:1], boxes)[0], [1, 50. / 150, 0])
+    assert iou_matrix(boxes[:0], boxes).shape == (0, 3)
+
+
+def test_nms_blocked_matches_nms():
+    dets = random_dets()
+    for thresh in [0.1, 0.3, 0.7]:
+        expected = nms(dets, thresh)
+        for block_size in [1, 16, 512]:
+            np.testing.assert_array_equal(
+                nms_blocked(dets, thresh, block_size=block_size), expected)
+        np.testing.assert_array_equal(nms_blocked(dets, thresh, top_k=5), expected[:5])
+
+    assert len(nms_blocked(np.zeros((0, 5)), 0.3)) == 0
+    assert len(batched_nms(np.zeros((0, 5)), [], 0.3)) == 0
+
+
+def test_batched_nms():
+    dets = random_dets()
+    labels = np.arange(len(dets)) % 3
+    keep = batched_nms(dets, labels, 0.3)
+    expected = np.concatenate([np.where(labels == l)[0][nms(dets[labels == l], 0.3)]
+                               for l in range(3)])
+    np.testing.assert_array_equal(np.sort(keep), np.sort(expected))
+
+    # Large coordinates, offsets in float64
+    np.testing.assert_array_equal(
+        np.sort(batched_nms(np.float64(dets) + [1e6, 1e6, 1e6, 1e6, 0], labels, 0.3)),
+        np.sort(expected))
+
+
+def test_soft_nms():
+    dets = random_dets(100)
+    keep, scores = soft_nms(dets, method='linear', score_thresh=0.)
+    assert len(keep) == len(dets) and np.all(scores <= dets[keep, 4] + 1e-6)
+    assert keep[0] == np.argmax(dets[:, 4])
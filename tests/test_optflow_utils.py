@@ -0,0 +1,127 @@
+import cv2
+import numpy as np
+
+from pybot.vision.optflow_utils import coordinate_grid, farneback_flow, \
+    fb_inconsistent, dense_optical_flow, DenseOpticalFlow
+
+
+def texture(shape=(96, 128), seed=0):
+    rng = np.random.RandomState(seed)
+    im = cv2.GaussianBlur(np.float32(rng.rand(*shape)), (0, 0), 3)
+    im = (im - im.min()) / (im.max() - im.min())
+    return np.uint8(255 * im)
+
+
+def shifted(im, dx, dy):
+    M = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(im, M, im.shape[::-1], borderMode=cv2.BORDER_REFLECT)
+
+
+def interior(flow, border=16):
+    return flow[border:-border, border:-border]
+
+
+def test_coordinate_grid_cached():
+    grid = coordinate_grid((4, 5, 3))
+    assert grid.shape == (4, 5, 2) and grid.dtype == np.float32
+    assert coordinate_grid((4, 5)) is grid and not grid.flags.writeable
+    assert grid[3, 2, 0] == 2 and grid[3, 2, 1] == 3
+    assert coordinate_grid((5, 4)).shape == (5, 4, 2)
+
+
+def test_dense_optical_flow_fb():
+    im1 = texture()
+    im2 = shifted(im1, 2, 1)
+    flow = dense_optical_flow(im1, im2, fb_threshold=1)
+
+    fflow, rflow = farneback_flow(im1, im2), farneback_flow(im2, im1)
+    invalid = fb_inconsistent(fflow, rflow, 1)
+    assert np.array_equal(np.isnan(flow[..., 0]), invalid)
+    np.testing.assert_allclose(flow[~invalid], fflow[~invalid])
+
+
+def test_dense_flow_tiled_matches_farneback():
+    im1 = texture()
+    im2 = shifted(im1, 2, 1)
+    expected = farneback_flow(im1, im2)
+
+    engine = DenseOpticalFlow(tiles=(2, 2), overlap=16, warm_start=False)
+    flow, _, _ = engine.compute(im1, im2)
+    engine.close()
+    assert engine.pool_ is None
+    err = np.fabs(interior(flow) - interior(expected))
+    assert np.median(err) < 0.05 and np.percentile(err, 95) < 0.5
+
+
+def test_dense_flow_scaled_matches_farneback():
+    im1 = texture((192, 256))
+    im2 = shifted(im1, 4, 2)
+    expected = farneback_flow(im1, im2, winsize=9)
+
+    engine = DenseOpticalFlow(scale=0.5, winsize=9, warm_start=False)
+    flow, fflow, _ = engine.compute(im1, im2)
+    engine.close()
+    assert flow.shape == im1.shape + (2,) and fflow.shape == (96, 128, 2)
+    err = np.fabs(interior(flow, 32) - interior(expected, 32))
+    assert np.median(err) < 0.25
+
+
+def test_dense_flow_warm_start_matches_farneback():
+    ims = [shifted(texture(), 2 * j, j) for j in range(3)]
+    engine = DenseOpticalFlow(fb_threshold=2)
+    assert engine.process(ims[0]) is None
+
+    prev = None
+    for im1, im2 in zip(ims[:-1], ims[1:]):
+        flow = engine.process(im2)
+        fflow = farneback_flow(im1, im2, flow=prev)
+        np.testing.assert_allclose(engine.flow, fflow, atol=1e-5)
+        assert np.isnan(flow).sum() < 0.1 * flow[..., 0].size
+        assert np.nanmedian(np.fabs(interior(flow) - [2, 1])) < 0.2
+        prev = fflow
+    engine.close()
+
+
+def reference_flow(cam, pose, depth, min_depth=0.1):
+    """ Per-pixel scene flow via cv2.projectPoints """
+    H, W = depth.shape
+    R, t = pose[:3,:3], pose[:3,3]
+    flow = np.full((H, W, 2), np.nan, dtype=np.float32)
+    for y in range(H):
+        for x in range(W):
+            X1 = cam.ray(np.float32([[x, y]]))[0] * depth[y, x]
+            X2 = R.dot(X1) + t
+            if X2[2] < min_depth:
+                continue
+            proj, _ = cv2.projectPoints(X2.reshape(1, 1, 3), np.zeros(3), np.zeros(3),
+                                        cam.K, cam.D)
+            u, v = proj.ravel()
+            if 0 <= u <= W - 1 and 0 <= v <= H - 1:
+                flow[y, x] = u - x, v - y
+    return flow
+
+
+def test_scene_flow_matches_per_pixel():
+    from pybot.geometry.rigid_transform import RigidTransform
+    from pybot.vision.camera_utils import CameraIntrinsic
+    from pybot.vision.optflow_utils import SceneFlow
+
+    H, W = 12, 16
+    K = np.float64([[20, 0, 7.5], [0, 20, 5.5], [0, 0, 1]])
+    rng = np.random.RandomState(0)
+    depths = np.float32(2 + rng.rand(2, H, W))
+    depths[0, 0, :3] = 0
+    poses = [RigidTransform.from_rpyxyz(0.01, -0.02, 0.03, 0.1, -0.05, 0.2),
+             RigidTransform.from_rpyxyz(0, 0.05, 0, -0.3, 0, -0.1)]
+
+    for D in [np.zeros(5), np.float64([0.1, -0.05, 0.001, 0.002, 0.01]),
+              np.float64([0.1, -0.05, 0.001, 0.002, 0.01, 0.02, -0.01, 0.005])]:
+        cam = CameraIntrinsic(K, D=D, shape=(H, W))
+        sf = SceneFlow(cam)
+        flows = sf.flow_batch(poses, depths)
+        for pose, depth, flow in zip(poses, depths, flows):
+            expected = reference_flow(cam, pose.matrix, depth)
+            np.testing.assert_array_equal(np.isnan(flow), np.isnan(expected))
+            np.testing.assert_allclose(flow, expected, atol=1e-3)
+            np.testing.assert_allclose(sf.flow(pose, depth), flow, atol=1e-6)
+        assert np.isnan(flows[0, 0, :3]).all()
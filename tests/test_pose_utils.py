@@ -0,0 +1,88 @@
+import numpy as np
+
+from pybot.geometry.rigid_transform import RigidTransform, \
+    tf_quaternion_matrices, tf_compose_batch, tf_inverse_batch, \
+    tf_relative_to_first
+from pybot.utils.dataset_readers import PoseArrayReader
+from pybot.utils.dataset.kitti import kitti_load_pose_array, \
+    kitti_load_poses, kitti_write_poses, kitti_poses_to_str
+
+
+def random_poses(n=10, seed=0):
+    rng = np.random.RandomState(seed)
+    return [RigidTransform.from_rpyxyz(*rng.uniform(-np.pi, np.pi, 6))
+            for _ in range(n)]
+
+
+def write_kitti_poses(fn, poses):
+    with open(fn, 'w') as f:
+        f.write('\n'.join(' '.join('%.17g' % x for x in p.matrix[:3,:4].ravel())
+                          for p in poses))
+
+
+def test_kitti_load_pose_array_matches_loader(tmpdir):
+    poses = random_poses()
+    fn = str(tmpdir.join('00.txt'))
+    write_kitti_poses(fn, poses)
+
+    # Previous per-row loader
+    X = np.fromfile(fn, dtype=np.float64, sep=' ').reshape(-1,12)
+    expected = [RigidTransform.from_Rt(x.reshape(3,4)[:3,:3], x.reshape(3,4)[:3,3])
+                for x in X]
+
+    T = kitti_load_pose_array(fn)
+    assert T.shape == (len(poses), 4, 4)
+    np.testing.assert_allclose(T[:,3], np.tile([0,0,0,1], (len(poses), 1)))
+    for Ti, p, q in zip(T, expected, kitti_load_poses(fn)):
+        np.testing.assert_allclose(Ti, p.matrix, atol=1e-12)
+        np.testing.assert_allclose(q.matrix, p.matrix, atol=1e-12)
+
+
+def test_kitti_write_poses_roundtrip(tmpdir):
+    poses = random_poses()
+    T = np.float64([p.matrix for p in poses])
+
+    fn = str(tmpdir.join('array.txt'))
+    kitti_write_poses(fn, T)
+    np.testing.assert_allclose(kitti_load_pose_array(fn), T, atol=1e-10)
+
+    fn = str(tmpdir.join('list.txt'))
+    kitti_write_poses(fn, poses)
+    np.testing.assert_allclose(kitti_load_pose_array(fn), T, atol=1e-10)
+
+    fn = str(tmpdir.join('str.txt'))
+    with open(fn, 'w') as f:
+        f.write(kitti_poses_to_str(T))
+    np.testing.assert_allclose(kitti_load_pose_array(fn), T, atol=1e-10)
+
+
+def test_pose_array_reader_lazy(tmpdir):
+    poses = random_poses()
+    fn = str(tmpdir.join('00.txt'))
+    kitti_write_poses(fn, poses)
+
+    reader = PoseArrayReader(fn, load_cb=kitti_load_pose_array)
+    assert reader.items_ is None
+    np.testing.assert_allclose(reader.array[3], poses[3].matrix, atol=1e-10)
+
+    sub = reader.subset(np.arange(2, 8, 2))
+    np.testing.assert_array_equal(sub.indices_, [2, 4, 6])
+    for p, q in zip(sub.iteritems(), [poses[2], poses[4], poses[6]]):
+        np.testing.assert_allclose(p.matrix, q.matrix, atol=1e-10)
+    assert reader.items_ is None
+    assert len(reader.items) == len(poses)
+
+
+def test_batch_transforms():
+    poses = random_poses()
+    T = np.float64([p.matrix for p in poses])
+
+    xyzw = np.float64([p.quat.to_xyzw() for p in poses])
+    np.testing.assert_allclose(tf_quaternion_matrices(xyzw), T[:,:3,:3], atol=1e-12)
+    np.testing.assert_allclose(tf_compose_batch(T[:,:3,:3], T[:,:3,3]), T)
+
+    np.testing.assert_allclose(tf_inverse_batch(T),
+                               [p.inverse().matrix for p in poses], atol=1e-12)
+    np.testing.assert_allclose(tf_relative_to_first(T),
+                               [(poses[0].inverse() * p).matrix for p in poses],
+                               atol=1e-6)
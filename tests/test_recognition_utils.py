@@ -0,0 +1,285 @@
+import cv2
+import numpy as np
+import pytest
+
+try:
+    from pybot.utils.db_utils import IterDB
+    from pybot.vision import recognition_utils as ru
+except (ImportError, AttributeError) as e:
+    pytest.skip('recognition_utils unavailable: {}'.format(e),
+                allow_module_level=True)
+
+from sklearn.linear_model import SGDClassifier
+
+
+def blobs(n=400, seed=0):
+    rng = np.random.RandomState(seed)
+    y = rng.randint(0, 2, n).astype(np.int32)
+    X = rng.randn(n, 4).astype(np.float32) + 3. * y[:, None]
+    return X, y
+
+
+def write_db(filename, X, y, per_item=10):
+    db = IterDB(filename=filename, mode='w')
+    for idx in range(0, len(X), per_item):
+        db.append('X', X[idx:idx+per_item])
+        db.append('y', y[idx:idx+per_item])
+    db.close()
+    return IterDB(filename=filename, mode='r')
+
+
+def sgd_classifier(tmpdir):
+    clf = ru.HistogramClassifier(str(tmpdir.join('clf.h5')),
+                                 target_map={0: 'neg', 1: 'pos'})
+    clf.clf_ = SGDClassifier(random_state=0)
+    return clf
+
+
+def test_reservoir_shuffle_preserves_samples():
+    X = np.arange(100).reshape(-1, 1)
+    chunks = [(X[idx:idx+7], X[idx:idx+7, 0]) for idx in range(0, 100, 7)]
+
+    out = list(ru.reservoir_shuffle(iter(chunks), buffer_size=20, seed=1))
+    oX = np.vstack([x for x, _ in out])
+    oy = np.hstack([y for _, y in out])
+    assert np.array_equal(oX[:, 0], oy)
+    assert np.array_equal(np.sort(oy), np.arange(100))
+    assert not np.array_equal(oy, np.arange(100))
+
+
+def test_split_chunks():
+    train, test = ru.split_chunks(7, test_every=3)
+    assert list(train) == [1, 2, 4, 5]
+    assert list(test) == [0, 3, 6]
+
+    train, test = ru.split_chunks(7, test_every=0)
+    assert list(train) == list(range(7)) and len(test) == 0
+
+
+def test_iterchunks_stacked_inds(tmpdir):
+    X, y = blobs(100)
+    db = write_db(str(tmpdir.join('db.h5')), X, y)
+
+    full = list(ru.iterchunks_stacked(db, batch_size=2, prefetch_size=2))
+    sub = list(ru.iterchunks_stacked(db, batch_size=2, prefetch_size=0, inds=[1, 4]))
+    assert len(full) == 5 and len(sub) == 2
+    for (sX, sy), idx in zip(sub, [1, 4]):
+        assert np.array_equal(sX, full[idx][0])
+        assert np.array_equal(sy, full[idx][1])
+    assert np.array_equal(full[1][0], X[20:40])
+    db.close()
+
+
+def test_fit_streaming_reads_each_chunk_once(tmpdir, monkeypatch):
+    X, y = blobs(400)
+    db = write_db(str(tmpdir.join('db.h5')), X, y)
+
+    reads = []
+    read_chunk = IterDB.read_chunk
+    def counted(self, key, index, batch_size=10):
+        reads.append((key, index))
+        return read_chunk(self, key, index, batch_size=batch_size)
+    monkeypatch.setattr(IterDB, 'read_chunk', counted)
+
+    clf = sgd_classifier(tmpdir)
+    monkeypatch.setattr(clf, '_save', lambda filename: None)
+    clf.fit_streaming(db, epochs=2, batch_size=5, buffer_size=50,
+                      prefetch_size=2, test_every=4)
+
+    # 8 chunks: 6 training, 2 held-out, read once per epoch (per key)
+    counts = {}
+    for read in reads:
+        counts[read] = counts.get(read, 0) + 1
+    assert sorted(counts) == sorted((k, idx) for k in ('X', 'y') for idx in range(8))
+    assert all(count == 2 for count in counts.values())
+
+    # Held-out accuracy only reads held-out chunks
+    del reads[:]
+    acc = clf.score_streaming(db, batch_size=5, prefetch_size=0, test_every=4)
+    assert sorted(set(idx for _, idx in reads)) == [0, 4]
+
+    held_out = np.hstack([np.arange(0, 50), np.arange(200, 250)])
+    expected = np.mean(clf.predict(X[held_out]) == y[held_out])
+    assert acc == pytest.approx(expected)
+    assert acc > 0.9
+    db.close()
+
+
+def test_predict_chunked(tmpdir):
+    X, y = blobs(200)
+    clf = sgd_classifier(tmpdir)
+    clf.clf_.fit(X, y)
+
+    assert np.array_equal(clf.predict(X, batch_size=33), clf.predict(X))
+    assert np.allclose(clf.decision_function(X, batch_size=33),
+                       clf.decision_function(X))
+
+
+def test_dense_describer_batch_matches_describe():
+    try:
+        describer = ru.DenseDescriber(step=8)
+    except (AttributeError, cv2.error) as e:
+        pytest.skip('OpenCV dense describer unavailable: {}'.format(e))
+
+    rng = np.random.RandomState(0)
+    ims = [cv2.GaussianBlur(np.uint8(255 * rng.rand(48 + 8 * j, 64)), (0, 0), 1.5)
+           for j in range(5)]
+    expected = [describer.describe(im) for im in ims]
+
+    for num_workers in [2, 1, 1]:
+        desc, offsets = describer.describe_batch(ims, num_workers=num_workers, chunksize=2)
+        assert describer.num_workers_ == num_workers
+        assert describer.pool_._processes == num_workers
+        assert len(offsets) == len(ims) + 1
+        for j, edesc in enumerate(expected):
+            np.testing.assert_allclose(desc[offsets[j]:offsets[j+1]], edesc, rtol=1e-6)
+
+    describer.close()
+    assert describer.pool_ is None
+
+
+def test_recall_from_IoU():
+    recall, thresholds = ru.recall_from_IoU(np.float32([0.2, 0.6, 0.9]), samples=11)
+    np.testing.assert_allclose(thresholds, np.linspace(0, 1, 11))
+    np.testing.assert_allclose(recall[[0, 3, 5, 8, 10]], [1, 2/3., 2/3., 1/3., 0])
+
+
+def test_detection_evaluator_duplicate_is_false_positive():
+    gt = np.float32([[0, 0, 10, 10], [20, 20, 30, 30]])
+    dets = np.float32([[0, 0, 10, 10], [0, 0, 10, 10], [20, 20, 30, 30]])
+    for num_bins in [100, None]:
+        evaluator = ru.DetectionEvaluator(num_bins=num_bins)
+        evaluator.add(dets, [0.9, 0.8, 0.7], [1, 1, 1], gt, [1, 1])
+
+        np.testing.assert_allclose(evaluator.average_precision(1), [0.5 + 0.5 * 2/3.])
+
+    precision, recall, scores = evaluator.precision_recall(1)
+    np.testing.assert_allclose(precision, [[1, 0.5, 2/3.]])
+    np.testing.assert_allclose(recall, [[0.5, 0.5, 1]])
+
+
+def test_detection_evaluator_iou_thresholds():
+    # IoU of 0.82 with the ground truth
+    evaluator = ru.DetectionEvaluator(iou_thresholds=[0.5, 0.75, 0.9])
+    evaluator.add([[0, 0, 10, 8.2]], [0.9], [1], [[0, 0, 10, 10]], [1])
+    np.testing.assert_allclose(evaluator.average_precision(1), [1, 1, 0])
+
+    coco = ru.DetectionEvaluator(iou_thresholds=np.linspace(0.5, 0.95, 10), ap_method='coco')
+    coco.add([[0, 0, 10, 8.2]], [0.9], [1], [[0, 0, 10, 10]], [1])
+    mAP, _ = coco.mean_average_precision()
+    np.testing.assert_allclose(mAP, [1] * 7 + [0] * 3)
+
+
+def test_detection_evaluator_empty_ground_truth():
+    evaluator = ru.DetectionEvaluator()
+    evaluator.add([[0, 0, 10, 10]], [0.9], [1], np.zeros((0, 4)), [])
+    assert evaluator.targets == [1] and evaluator.num_images == 1
+    np.testing.assert_allclose(evaluator.average_precision(1), [0])
+    mAP, ap = evaluator.mean_average_precision()
+    np.testing.assert_allclose(mAP, [0])
+
+    # Missed ground truth counts, detections without ground truth do not
+    evaluator.add([], [], [], [[0, 0, 10, 10]], [2])
+    np.testing.assert_allclose(evaluator.average_precision(2), [0])
+    mAP, _ = ru.DetectionEvaluator().mean_average_precision()
+    np.testing.assert_allclose(mAP, [0])
+
+
+def test_detection_evaluator_per_class_map():
+    evaluator = ru.DetectionEvaluator(iou_thresholds=[0.5, 0.75])
+    gt = np.float32([[0, 0, 10, 10], [20, 20, 30, 30], [40, 40, 50, 50]])
+    evaluator.add([[0, 0, 10, 10], [20, 20, 30, 30], [60, 60, 70, 70]], [0.9, 0.8, 0.7],
+                  [1, 2, 3], gt, [1, 2, 2])
+    evaluator.add([[0, 0, 10, 9]], [0.6], [1], gt[:1], [1])
+
+    mAP, ap = evaluator.mean_average_precision()
+    assert sorted(ap.keys()) == [1, 2, 3]
+    np.testing.assert_allclose(ap[1], [1, 1])
+    np.testing.assert_allclose(ap[2], [0.5, 0.5])
+    np.testing.assert_allclose(ap[3], [0, 0])
+    np.testing.assert_allclose(mAP, [0.75, 0.75])
+
+    mAP, ap = evaluator.mean_average_precision(targets=[2])
+    np.testing.assert_allclose(mAP, [0.5, 0.5])
+
+
+class FakeProposer(object):
+    """ Deterministic proposals from the image content """
+    def __init__(self, size=8):
+        self.size_ = size
+
+    def process(self, im):
+        rng = np.random.RandomState(int(im.sum()) % 1000)
+        xy = rng.randint(0, 32, size=(20, 2))
+        return np.float32(np.hstack([xy, xy + self.size_]))
+
+
+def _init_fake_proposer(params):
+    ru._proposer = FakeProposer(**params)
+
+
+def test_proposal_cache_hit_miss(tmpdir):
+    im1, im2 = np.zeros((4, 5), dtype=np.uint8), np.ones((4, 5), dtype=np.uint8)
+    bboxes = np.float32([[0, 0, 2, 2], [1, 1, 3, 3]])
+
+    cache = ru.ProposalCache(str(tmpdir), params=dict(method='GOP', num_proposals=10))
+    assert cache.get(im1) is None
+    np.testing.assert_array_equal(cache.put(im1, bboxes), bboxes)
+    np.testing.assert_array_equal(cache.get(im1), bboxes)
+    assert cache.get(im2) is None
+    assert cache.get(im1.astype(np.float32)) is None
+
+    # Same params (in any order) hit, changed params miss
+    same = ru.ProposalCache(str(tmpdir), params=dict(num_proposals=10, method='GOP'))
+    np.testing.assert_array_equal(same.get(im1), bboxes)
+    other = ru.ProposalCache(str(tmpdir), params=dict(method='GOP', num_proposals=20))
+    assert other.get(im1) is None
+
+
+def test_proposal_cache_write_then_rename(tmpdir, monkeypatch):
+    import os
+    cache = ru.ProposalCache(str(tmpdir), params=dict(method='GOP'))
+    im, bboxes = np.zeros((4, 5), dtype=np.uint8), np.float32([[0, 0, 2, 2]])
+    fn = cache.filename(ru.ProposalCache.image_hash(im))
+
+    renames = []
+    rename = os.rename
+    def checked(src, dst):
+        # Complete temporary file, and nothing at the destination yet
+        assert dst == fn and not os.path.exists(dst)
+        np.testing.assert_array_equal(np.load(src), bboxes)
+        renames.append(src)
+        rename(src, dst)
+    monkeypatch.setattr(os, 'rename', checked)
+
+    cache.put(im, bboxes)
+    assert len(renames) == 1 and renames[0].endswith('.tmp')
+    assert os.listdir(os.path.dirname(fn)) == [os.path.basename(fn)]
+
+
+def test_negative_mining_parallel_matches_serial(tmpdir, monkeypatch):
+    monkeypatch.setattr(ru, '_init_proposer', _init_fake_proposer)
+    rng = np.random.RandomState(0)
+    dataset = [(np.uint8(rng.randint(0, 255, (8, 8))),
+                np.float32([[0, 0, 16, 16]]), None) for _ in range(9)]
+    params = dict(size=8)
+
+    def mined(**kwargs):
+        generator = ru.NegativeMiningGenerator(dataset, FakeProposer(**params), target=3,
+                                               num_proposals=10, proposer_params=params,
+                                               **kwargs)
+        items = list(generator)
+        generator.close()
+        return items
+
+    serial = mined()
+    assert len(serial) == len(dataset)
+    cache_dir = str(tmpdir.join('cache'))
+    for items in [mined(num_workers=2), mined(num_workers=2, cache_dir=cache_dir),
+                  mined(num_workers=3, cache_dir=cache_dir), mined(cache_dir=cache_dir)]:
+        assert len(items) == len(serial)
+        for (im, bboxes, targets), (sim, sbboxes, stargets) in zip(items, serial):
+            assert im is sim
+            np.testing.assert_array_equal(bboxes, sbboxes)
+            np.testing.assert_array_equal(targets, stargets)
+            assert np.all(targets == 3)
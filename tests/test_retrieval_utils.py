@@ -0,0 +1,73 @@
+import numpy as np
+
+from pybot.vision.retrieval_utils import InvertedFileIndex
+
+
+def dense_scores(docs, query, K):
+    """ Brute-force cosine tf-idf scores """
+    tf = lambda words: np.bincount(words, minlength=K) * 1.0 / len(words)
+    T = np.float64([tf(words) for words in docs])
+    idf = np.log((len(docs) + 1.0) / ((T > 0).sum(axis=0) + 1.0))
+    D, q = T * idf, tf(query) * idf
+    return D.dot(q) / (np.linalg.norm(q) * np.maximum(np.linalg.norm(D, axis=1), 1e-12))
+
+
+def test_inverted_file_scores():
+    K, rng = 50, np.random.RandomState(0)
+    index = InvertedFileIndex(K, merge_size=37)
+    docs = []
+    for j in range(60):
+        docs.append(rng.randint(0, K, rng.randint(1, 30)))
+        assert index.add(docs[-1], index=10 * j) == j
+
+        # Norms and scores are exact as the idf changes
+        query = rng.randint(0, K, 20)
+        np.testing.assert_allclose(index.scores(query), dense_scores(docs, query, K),
+                                   rtol=1e-5, atol=1e-6)
+    assert index.ntail_ < 37
+
+    # Exclusion window and top-k
+    query = docs[5]
+    inds, scores = index.query(query, k=3, exclude_window=0)
+    assert inds[0] == 5 and np.all(np.diff(scores) <= 0)
+    inds, _ = index.query(query, k=100, exclude_window=100)
+    assert len(inds) == 50 and index.indices[inds].max() <= 490
+
+
+def test_inverted_file_dict_roundtrip():
+    K, rng = 20, np.random.RandomState(1)
+    index = InvertedFileIndex(K, max_df=0.5, merge_size=1000)
+    for j in range(30):
+        index.add(rng.randint(0, K, 10))
+
+    loaded = InvertedFileIndex.from_dict(index.to_dict())
+    assert len(loaded) == len(index) and loaded.ntail_ == 0
+    np.testing.assert_allclose(loaded.norms, index.norms, rtol=1e-6)
+    for _ in range(5):
+        query = rng.randint(0, K, 10)
+        np.testing.assert_allclose(loaded.scores(query), index.scores(query), rtol=1e-5)
+    assert InvertedFileIndex(K).scores([1, 2]).shape == (0,)
+
+
+def test_inverted_file_query_touches_own_postings():
+    K, rng = 5000, np.random.RandomState(2)
+    index = InvertedFileIndex(K, merge_size=500)
+    docs = [rng.randint(0, K, 20) for _ in range(2000)]
+    for words in docs:
+        index.add(words)
+    assert 0 < index.ntail_ < 500
+
+    # Postings (CSR and tail) only of the query words
+    query = docs[-1][:3]
+    pdocs, _, qinds = index.postings(np.unique(query))
+    expected = [j for j, words in enumerate(docs) for w in np.unique(query) if w in words]
+    assert sorted(pdocs) == sorted(expected)
+
+    # Norms are evaluated only for documents sharing words with the query
+    normed = []
+    doc_norms = index.doc_norms
+    index.doc_norms = lambda d: normed.append(len(d)) or doc_norms(d)
+    inds, scores = index.query(query, k=3)
+    assert normed == [len(set(expected))] and len(set(expected)) < len(docs) // 50
+    np.testing.assert_allclose(scores, dense_scores(docs, query, K)[inds], rtol=1e-5)
+    assert len(docs) - 1 in inds
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from pybot.utils.dataset_readers import shard_indices, SHARD_STRATEGIES
+from pybot.externals.log_utils import Decoder, LogReader
+
+
+def test_shard_indices_partition():
+    groups = np.repeat(['a', 'b', 'c', 'd', 'e'], [7, 3, 11, 1, 5])
+    n = len(groups)
+    for strategy in SHARD_STRATEGIES:
+        for count in [1, 2, 3, 4, 8, 40]:
+            shards = [shard_indices(n, index, count, strategy=strategy,
+                                    groups=groups if strategy == 'by_sequence' else None)
+                      for index in range(count)]
+
+            # Disjoint, and covering range(n)
+            allinds = np.concatenate(shards)
+            assert len(allinds) == n
+            np.testing.assert_array_equal(np.sort(allinds), np.arange(n))
+
+            # Deterministic
+            for index, inds in enumerate(shards):
+                np.testing.assert_array_equal(
+                    inds, shard_indices(n, index, count, strategy=strategy,
+                                        groups=groups if strategy == 'by_sequence' else None))
+
+
+def test_shard_indices_strategies():
+    np.testing.assert_array_equal(shard_indices(10, 1, 3, 'contiguous'), [3, 4, 5])
+    np.testing.assert_array_equal(shard_indices(10, 1, 3, 'strided'), [1, 4, 7])
+
+    # Whole sequences per shard, balanced by size
+    groups = np.repeat(['a', 'b', 'c'], [6, 3, 3])
+    shards = [shard_indices(12, index, 2, 'by_sequence', groups=groups)
+              for index in range(2)]
+    assert [len(inds) for inds in shards] == [6, 6]
+    for inds in shards:
+        assert len(set(groups[inds])) in (1, 2)
+        assert not set(groups[shards[0]]) & set(groups[shards[1]])
+
+    np.testing.assert_array_equal(shard_indices(0, 0, 2, 'by_sequence'), [])
+    with pytest.raises(ValueError):
+        shard_indices(10, 3, 3)
+    with pytest.raises(ValueError):
+        shard_indices(10, 0, 3, strategy='random')
+
+
+class ListLogReader(LogReader):
+    """ Log of (t, channel, data) messages held in memory """
+    messages = [(t, 'A' if t % 3 else 'B', t) for t in range(100)]
+
+    def load_log(self, filename):
+        return self.messages
+
+    def time_bounds(self):
+        return self.messages[0][0], self.messages[-1][0]
+
+    def iteritems(self, reverse=False):
+        self.reset_shard()
+        for t, ch, data in self.log:
+            res, msg = self.decode_msg(ch, data, t)
+            if res:
+                yield msg
+
+
+def test_log_reader_shard(tmpdir):
+    fn = tmpdir.join('log.txt')
+    fn.write('')
+    make = lambda: ListLogReader(str(fn), decoder=Decoder(channel='A'))
+    expected = [t for t, ch, _ in ListLogReader.messages if ch == 'A']
+
+    for strategy in ['contiguous', 'strided']:
+        shards = []
+        for index in range(3):
+            reader = make().shard(index, 3, strategy=strategy)
+            items = [data for _, _, data in reader.iteritems()]
+
+            # Repeated iteration yields the same shard
+            assert items == [data for _, _, data in reader.iteritems()]
+            shards.append(items)
+        assert sorted(sum(shards, [])) == expected
+        if strategy == 'contiguous':
+            assert sum(shards, []) == expected
+
+        # Indexed logs filter their index
+        reader = make().shard(1, 3, strategy=strategy)
+        np.testing.assert_array_equal(
+            np.float64(expected)[reader.shard_mask(expected)], shards[1])
+
+    with pytest.raises(ValueError):
+        make().shard(0, 2, strategy='by_sequence')
@@ -0,0 +1,23 @@
+import time
+from multiprocessing.pool import ThreadPool
+
+from pybot.utils.timer import timeitmethod, named_timer
+
+
+class Sleeper(object):
+    @timeitmethod
+    def run(self, dt):
+        time.sleep(dt)
+        return dt
+
+
+def test_timeitmethod_threads():
+    sleeper = Sleeper()
+    pool = ThreadPool(8)
+    assert sum(pool.map(sleeper.run, [1e-3] * 200)) > 0
+    pool.close()
+    pool.join()
+
+    timer = named_timer('Sleeper::run')
+    assert timer.calls_ + timer.counter_ == 200
+    assert timer.counter_ == 0 or timer.period_ >= 1e-3 * timer.counter_
@@ -0,0 +1,30 @@
+import numpy as np
+
+from pybot.vision.draw_utils import draw_features, splat_features
+
+
+def test_splat_features_matches_draw_features():
+    rng = np.random.RandomState(0)
+    im = np.uint8(rng.randint(0, 255, (48, 64, 3)))
+
+    # Non-overlapping markers, including ones clipped at the borders
+    xs, ys = np.meshgrid(np.arange(0, 64, 7), np.arange(0, 48, 7))
+    pts = np.float32(np.dstack([xs, ys]).reshape(-1, 2)) + 0.25
+    pts[-1] = [63, 47]
+    cols = np.int64(rng.randint(0, 255, (len(pts), 3)))
+
+    for size in [0, 1, 2]:
+        np.testing.assert_array_equal(
+            splat_features(im.copy(), pts, cols, size=size),
+            draw_features(im, pts, colors=cols, size=size))
+        np.testing.assert_array_equal(
+            splat_features(im.copy(), pts, [0, 255, 0], size=size),
+            draw_features(im, pts, size=size))
+
+
+def test_splat_features_invalid_points():
+    out = np.zeros((10, 10), dtype=np.uint8)
+    pts = np.float32([[np.nan, 1], [5, 5], [-10, 3], [3, np.inf]])
+    splat_features(out, pts, np.int64([[1, 2, 3]] * 4), size=1)
+    assert out.sum() == 9 * 3 and (out[4:7, 4:7] == 3).all()
+    assert splat_features(out, pts[:1], [1, 2, 3]) is out